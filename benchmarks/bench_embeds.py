@@ -0,0 +1,54 @@
+"""
+
+Benchmark fitting video fields into discord's embed limits, on normal and pathological documents
+(thousands of tags / alternate titles).
+
+    python3 benchmarks/bench_embeds.py
+
+VideoEmbed itself is also benchmarked if discord.py is installed.
+
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bot"))
+
+from embedbudget import fit_embed  # noqa: E402
+from fixtures import make_document, DOCUMENT_CASES  # noqa: E402
+from video import ETCVideo  # noqa: E402
+
+
+def timed(fn, number):
+    best = None
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = (time.perf_counter() - start) / number
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    rng = random.Random(0)
+    cases = {f"{name} ({tags} tags, {alternates} alternates)": make_document(0, rng, tags=tags, alternates=alternates)
+             for name, (tags, alternates) in DOCUMENT_CASES.items()}
+
+    try:
+        from embeds import VideoEmbed
+    except ImportError:
+        VideoEmbed = None
+
+    for name, document in cases.items():
+        fields = ETCVideo(**document).as_dict()
+        result = timed(lambda: fit_embed(f"Video {document['id']}", dict(fields)), number=20)
+        print(f"fit_embed  {name:45} {result * 1000:8.3f} ms")
+        if VideoEmbed is not None:
+            result = timed(lambda: VideoEmbed(ETCVideo(**document)), number=20)
+            print(f"VideoEmbed {name:45} {result * 1000:8.3f} ms")
+
+
+if __name__ == '__main__':
+    main()
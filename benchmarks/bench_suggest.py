@@ -0,0 +1,71 @@
+"""
+
+Benchmark the title suggestion index at the size of the full archive: build time, memory, and the latency
+of "did you mean" lookups (queries with a typo) and prefix completion.
+
+    python3 benchmarks/bench_suggest.py [--count 150000]
+
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bot"))
+
+from fixtures import make_titles, make_typo  # noqa: E402
+from suggest import TitleSuggester  # noqa: E402
+
+
+def latencies(fn, queries):
+    times = []
+    for query in queries:
+        start = time.perf_counter()
+        fn(query)
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return statistics.median(times), times[int(len(times) * 0.99)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=150000, help="titles (main index titles + alternate titles)")
+    parser.add_argument("--queries", type=int, default=500)
+    args = parser.parse_args()
+
+    titles = make_titles(args.count)
+    entries = [(title, f"{i:011d}") for i, title in enumerate(titles)]
+    suggester = TitleSuggester()
+
+    start = time.perf_counter()
+    suggester.build(entries)
+    build = time.perf_counter() - start
+
+    # Built again under tracemalloc for the memory, as tracing slows the build down a lot
+    tracemalloc.start()
+    traced = TitleSuggester()
+    traced.build(entries)
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del traced
+
+    rng = random.Random(1)
+    targets = [rng.choice(titles) for _ in range(args.queries)]
+    typos = [make_typo(make_typo(title, rng), rng) for title in targets]
+    found = sum(1 for target, typo in zip(targets, typos) if any(s[0] == target for s in suggester.suggest(typo)))
+    suggest_p50, suggest_p99 = latencies(suggester.suggest, typos)
+    complete_p50, complete_p99 = latencies(suggester.complete, [title[:rng.randint(3, 10)] for title in targets])
+
+    print(f"titles:               {args.count}")
+    print(f"build:                {build:.2f} s")
+    print(f"memory (traced):      {allocated / 1024 / 1024:.1f} MB ({suggester.memory_bytes() / 1024 / 1024:.1f} MB of data)")
+    print(f"suggest p50 / p99:    {suggest_p50 * 1000:.2f} / {suggest_p99 * 1000:.2f} ms")
+    print(f"complete p50 / p99:   {complete_p50 * 1000:.2f} / {complete_p99 * 1000:.2f} ms")
+    print(f"typo recall (top 5):  {found / len(typos):.1%}")
+
+
+if __name__ == '__main__':
+    main()
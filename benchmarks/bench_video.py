@@ -0,0 +1,59 @@
+"""
+
+Benchmark ETCVideo construction, listing access and as_dict() on a batch of archive-like documents,
+and the memory held per object.
+
+    python3 benchmarks/bench_video.py [--count 10000]
+
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bot"))
+
+from fixtures import make_documents  # noqa: E402
+from video import ETCVideo  # noqa: E402
+
+
+def timed(fn, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=10000)
+    args = parser.parse_args()
+
+    documents = make_documents(args.count)
+
+    construct = timed(lambda: [ETCVideo(**d) for d in documents])
+    listing = timed(lambda: [(v.id, v.title) for v in [ETCVideo(**d) for d in documents]])
+    full = timed(lambda: [v.as_dict() for v in [ETCVideo(**d) for d in documents]])
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    videos = [ETCVideo(**d) for d in documents]
+    for v in videos:
+        v.as_dict()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+
+    print(f"documents:                {args.count}")
+    print(f"construct:                {construct * 1000:.1f} ms ({construct / args.count * 1e6:.2f} us/doc)")
+    print(f"construct + id/title:     {listing * 1000:.1f} ms")
+    print(f"construct + as_dict():    {full * 1000:.1f} ms")
+    print(f"memory per object (used): {allocated / args.count:.0f} bytes")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+
+Synthetic archive-like documents shared by the benchmarks.
+
+Everything is generated from a seeded random.Random, so every run (and every benchmark) sees the same data.
+
+"""
+import itertools
+import random
+
+VOCABULARY = ["weekly", "weird", "news", "etc", "tech", "tuesday", "podcast", "live", "gaming", "machinima"]
+
+
+def words(rng, n):
+    return " ".join(rng.choice(VOCABULARY) for _ in range(n))
+
+
+def make_document(i, rng, tags=25, alternates=2):
+    """
+    A document shaped like the ones in the ETC index. tags/alternates control the size of the list fields,
+    the archive has a handful of videos with thousands of tags.
+    """
+    return {
+        'id': f"{i:011d}",
+        'title': words(rng, 8) + r"\n",
+        'alternate_titles': [words(rng, 6) for _ in range(alternates)] + ["NA"],
+        'description': words(rng, 120),
+        'alternate_descriptions': [words(rng, 80) for _ in range(alternates)],
+        'duration': str(rng.randint(60, 3600)),
+        'date_published': str(rng.randint(1300000000, 1550000000)),
+        'uploader': "MachinimaETC",
+        'alternate_uploaders': ["Machinima ETC", ""],
+        'uploader_ids': ["MachinimaETC", "UCdIaNUarhzLSXGoItz7BHVA"],
+        'tags': [words(rng, 1) + str(t) for t in range(tags)],
+        'duplicate_of': [],
+        'archived': True,
+        'local_quality_width': 1280,
+        'local_quality_height': 720,
+    }
+
+
+def make_documents(count, seed=0, **kwargs):
+    rng = random.Random(seed)
+    return [make_document(i, rng, **kwargs) for i in range(count)]
+
+
+# name -> (tags, alternates), from a typical video to the worst documents in the archive
+DOCUMENT_CASES = {
+    'typical': (25, 2),
+    'many tags': (5000, 2),
+    'pathological': (20000, 500),
+}
+
+
+COMMON_WORDS = ["the", "of", "and", "in", "a", "to", "is", "new", "news", "weekly", "weird", "tech", "live", "game",
+                "top", "ten", "best", "worst", "trailer", "review", "episode", "part", "with", "how"]
+
+
+def make_titles(count, seed=0):
+    """
+    Video titles: made up words (a vocabulary of 20,000, used with a Zipf-like skew) mixed with common English
+    words, some prefixed with a series name
+    """
+    rng = random.Random(seed)
+    consonants, vowels = "bcdfghjklmnprstvwxyz", "aeiou"
+    vocabulary = list(dict.fromkeys("".join(rng.choice(consonants) + rng.choice(vowels) for _ in range(rng.randint(2, 4)))
+                                    for _ in range(20000)))
+    cum_weights = list(itertools.accumulate(1 / (rank + 10) for rank in range(len(vocabulary))))
+    series = ["Weekly Weird News", "Tech Tuesday", "ETC Podcast", "Creepy Text Theatre", "ETC Live", "Spacebar"]
+    titles = []
+    for _ in range(count):
+        words = [rng.choice(COMMON_WORDS) if rng.random() < 0.3 else rng.choices(vocabulary, cum_weights=cum_weights)[0].capitalize()
+                 for _ in range(rng.randint(3, 9))]
+        title = " ".join(words)
+        titles.append(f"{rng.choice(series)} - {title}" if rng.random() < 0.3 else title)
+    return titles
+
+
+def make_typo(text, rng):
+    """
+    text with one character dropped, swapped or replaced
+    """
+    i = rng.randrange(len(text) - 1)
+    kind = rng.choice(("drop", "swap", "replace"))
+    if kind == "drop":
+        return text[:i] + text[i + 1:]
+    if kind == "swap":
+        return text[:i] + text[i + 1] + text[i] + text[i + 2:]
+    return text[:i] + rng.choice("abcdefghijklmnopqrstuvwxyz") + text[i + 1:]
+
+
+def make_phrase_stats(phrases, seed=0):
+    """
+    Per phrase stats as returned by ETCDatabase.get_stats_by_phrase
+    """
+    rng = random.Random(seed)
+    stats = {}
+    for phrase in phrases:
+        total = rng.randint(0, 5000)
+        stats[phrase] = {'total': total, 'total_archived': rng.randint(0, total), 'total_reuploaded': rng.randint(0, total)}
+    return stats
+
+
+def make_thumb_entries(count, seed=0):
+    """
+    (video id, ipfs path) entries of a thumbnail manifest
+    """
+    rng = random.Random(seed)
+    return [(f"{i:011d}", "/ipfs/Qm" + "".join(rng.choice("abcdefghijkmnopqrstuvwxyz123456789") for _ in range(44)))
+            for i in range(count)]
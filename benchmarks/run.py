@@ -0,0 +1,157 @@
+"""
+
+CPU micro-benchmarks of the bot's hot paths, runnable without Elasticsearch, IPFS or discord:
+
+    ETCVideo construction / as_dict(), VideoEmbed / VideoListingEmbed (if discord.py is installed),
+    fitting fields into the embed limits, building search queries and merging the stats of phrases,
+    and loading the caches the bot reads at startup (the thumbnail manifest).
+
+    python3 benchmarks/run.py [--filter embed] [--json results.json] [--compare baseline.json] [--threshold 0.1]
+
+Each benchmark reports the best per-call time of several rounds. With --compare, every benchmark is compared
+against a previous --json output, and the exit status is 1 if any got slower by more than threshold.
+
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bot"))
+
+from const import TITLE_PHRASES, MAX_LIST  # noqa: E402
+from embedbudget import fit_embed  # noqa: E402
+from fixtures import make_document, make_documents, make_phrase_stats, make_thumb_entries, DOCUMENT_CASES  # noqa: E402
+from query import build_search_query  # noqa: E402
+from statscache import merge_phrase_stats  # noqa: E402
+from thumbmanifest import ThumbManifest  # noqa: E402
+from video import ETCVideo  # noqa: E402
+
+try:
+    from embeds import VideoEmbed, VideoListingEmbed
+except ImportError:
+    VideoEmbed = VideoListingEmbed = None
+
+ROUNDS = 5
+MIN_ROUND_TIME_S = 0.05
+STARTUP_THUMBNAILS = 10000
+
+
+def measure(fn, rounds=ROUNDS):
+    """
+    Best per-call time over rounds, each round calling fn enough times to take at least MIN_ROUND_TIME_S
+    """
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        if time.perf_counter() - start >= MIN_ROUND_TIME_S:
+            break
+        number *= 2
+
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = (time.perf_counter() - start) / number
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def benchmarks(tmp_dir):
+    """
+    Returns name -> function to time, the files they read are written to tmp_dir
+    """
+    cases = {}
+
+    documents = make_documents(MAX_LIST)
+    cases['video.construct[listing page]'] = lambda: [ETCVideo(**d) for d in documents]
+    cases['video.id_title[listing page]'] = lambda: [(v.id, v.title) for v in [ETCVideo(**d) for d in documents]]
+
+    rng = random.Random(0)
+    for name, (tags, alternates) in DOCUMENT_CASES.items():
+        document = make_document(0, rng, tags=tags, alternates=alternates)
+        fields = ETCVideo(**document).as_dict()
+        cases[f'video.as_dict[{name}]'] = lambda d=document: ETCVideo(**d).as_dict()
+        cases[f'embed.fit[{name}]'] = lambda f=fields: fit_embed("Video 00000000000", dict(f))
+        if VideoEmbed is not None:
+            cases[f'embed.video[{name}]'] = lambda d=document: VideoEmbed(ETCVideo(**d))
+
+    if VideoListingEmbed is not None:
+        videos = [ETCVideo(**d) for d in documents]
+        cases['embed.listing[listing page]'] = lambda: VideoListingEmbed(videos, page=0, has_next=True)
+
+    cases['query.build[search]'] = lambda: build_search_query(query="weird news")
+    cases['query.build[searchda]'] = lambda: build_search_query(query="weird news", sort_by_field="date_published",
+                                                                extra_querys=[{"exists": {"field": "date_published"}}])
+    cases['query.build[searchr]'] = lambda: build_search_query(
+        extra_querys=[{"range": {"date_published": {"gte": 1400000000, "lte": 1400691200}}}],
+        match_phrase=False, sort_by_field="date_published")
+
+    phrase_stats = make_phrase_stats(TITLE_PHRASES)
+    cases['stats.merge_phrases'] = lambda: merge_phrase_stats({p: dict(s) for p, s in phrase_stats.items()})
+
+    manifest_file = os.path.join(tmp_dir, "thumb_manifest.sqlite")
+    ThumbManifest.build(manifest_file, "QmFolder", make_thumb_entries(STARTUP_THUMBNAILS))
+    cases[f'startup.thumb_manifest[{STARTUP_THUMBNAILS} thumbnails]'] = lambda: ThumbManifest(manifest_file).close()
+
+    return cases
+
+
+def compare(results, baseline, threshold):
+    """
+    Print the change of every benchmark against baseline, returns the names of the ones that regressed
+    """
+    regressed = []
+    for name, seconds in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        change = (seconds - before) / before
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressed.append(name)
+        print(f"{name:45} {before * 1e6:12.2f} us -> {seconds * 1e6:12.2f} us  {change:+7.1%}{flag}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--filter", default=None, help="only run benchmarks whose name contains this")
+    parser.add_argument("--json", default=None, help="write the results to this file")
+    parser.add_argument("--compare", default=None, help="compare against the results in this file")
+    parser.add_argument("--threshold", type=float, default=0.1, help="slowdown to report as a regression (0.1 = 10%%)")
+    args = parser.parse_args()
+
+    if VideoEmbed is None:
+        print("discord.py is not installed, skipping the embed construction benchmarks")
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, fn in benchmarks(tmp_dir).items():
+            if args.filter is not None and args.filter not in name:
+                continue
+            results[name] = measure(fn)
+            print(f"{name:45} {results[name] * 1e6:12.2f} us")
+
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump({'python': platform.python_version(), 'machine': platform.machine(), 'results': results}, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        print()
+        if len(compare(results, baseline, args.threshold)) != 0:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+import asyncio
+import collections
+import logging
+import time
+from discord.ext import commands
+from metrics import metrics
+log = logging.getLogger('root')
+
+"""
+
+Admission control for commands, so bursts queue up or are turned away instead of piling onto Elasticsearch/IPFS.
+
+Each command is charged a weight (e.g !stats, which fans out to many aggregations, costs more than a search)
+against a global capacity. Commands that don't fit wait in a bounded FIFO queue, for at most queue_timeout
+seconds. A command is shed (Overloaded is raised) if the queue is full, the wait times out, or its user/guild
+already has too many commands running or queued.
+
+Limits are per bot process.
+
+"""
+
+ADMISSION_CAPACITY = 8
+ADMISSION_MAX_PER_USER = 2
+ADMISSION_MAX_PER_GUILD = 6
+ADMISSION_MAX_QUEUE = 32
+ADMISSION_QUEUE_TIMEOUT_S = 10
+# command -> weight charged against the capacity. 0 = not limited. Other commands weigh DEFAULT_WEIGHT
+COMMAND_WEIGHTS = {'stats': 4, 'help': 0, 'about': 0}
+DEFAULT_WEIGHT = 1
+WAIT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Overloaded(commands.CommandError):
+
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason
+
+
+class Ticket:
+
+    def __init__(self, command, weight, user_id, guild_id):
+        self.command = command
+        self.weight = weight
+        self.user_id = user_id
+        self.guild_id = guild_id
+        self.admitted = None  # future resolved once the weight is acquired
+
+
+class AdmissionController:
+
+    def __init__(self, capacity=ADMISSION_CAPACITY, max_per_user=ADMISSION_MAX_PER_USER,
+                 max_per_guild=ADMISSION_MAX_PER_GUILD, max_queue=ADMISSION_MAX_QUEUE,
+                 queue_timeout=ADMISSION_QUEUE_TIMEOUT_S, weights=None):
+        self.capacity = capacity
+        self.max_per_user = max_per_user
+        self.max_per_guild = max_per_guild
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.weights = {**COMMAND_WEIGHTS, **(weights or {})}
+        self.available = capacity
+        self.__queue = collections.deque()  # tickets waiting for capacity, oldest first
+        self.__per_user = collections.Counter()  # user id -> commands running or queued
+        self.__per_guild = collections.Counter()
+        self.admitted = 0
+        self.shed = 0
+
+    def weight(self, command):
+        # A command weighing more than the capacity could never run alone
+        return min(self.weights.get(command, DEFAULT_WEIGHT), self.capacity)
+
+    def __shed(self, ticket, reason, message):
+        self.shed += 1
+        metrics.inc("etc_admission_shed_total", command=ticket.command, reason=reason)
+        log.info(f"Shed {ticket.command} from user {ticket.user_id} ({reason})")
+        raise Overloaded(reason, message)
+
+    async def acquire(self, command, user_id, guild_id=None):
+        """
+        Wait until command can run. Returns a Ticket to release() once it is done, or raises Overloaded.
+        """
+        ticket = Ticket(command, self.weight(command), user_id, guild_id)
+        if ticket.weight <= 0:
+            return ticket
+        if self.__per_user[user_id] >= self.max_per_user:
+            self.__shed(ticket, "user", "You already have commands running, try again once they are done.")
+        if guild_id is not None and self.__per_guild[guild_id] >= self.max_per_guild:
+            self.__shed(ticket, "guild", "Too many commands are running in this server, try again in a few seconds.")
+
+        start = time.monotonic()
+        self.__track(ticket, 1)
+        try:
+            await self.__acquire_weight(ticket)
+        except BaseException:
+            self.__track(ticket, -1)
+            raise
+        self.admitted += 1
+        metrics.observe("etc_admission_wait_seconds", time.monotonic() - start, buckets=WAIT_BUCKETS, command=command)
+        return ticket
+
+    async def __acquire_weight(self, ticket):
+        if len(self.__queue) == 0 and self.available >= ticket.weight:
+            self.available -= ticket.weight
+            return
+        if len(self.__queue) >= self.max_queue:
+            self.__shed(ticket, "queue_full", "The bot is busy, try again in a few seconds.")
+        ticket.admitted = asyncio.get_event_loop().create_future()
+        self.__queue.append(ticket)
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket.admitted), timeout=self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if ticket.admitted.done():
+                self.__release_weight(ticket.weight)  # admitted just as the wait ended
+            else:
+                self.__queue.remove(ticket)
+                ticket.admitted.cancel()
+                self.__wake()  # a heavier ticket at the head may have been holding back lighter ones
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self.__shed(ticket, "timeout", "The bot is busy, try again in a few seconds.")
+
+    def __track(self, ticket, delta):
+        self.__per_user[ticket.user_id] += delta
+        if self.__per_user[ticket.user_id] <= 0:
+            del self.__per_user[ticket.user_id]
+        if ticket.guild_id is not None:
+            self.__per_guild[ticket.guild_id] += delta
+            if self.__per_guild[ticket.guild_id] <= 0:
+                del self.__per_guild[ticket.guild_id]
+
+    def release(self, ticket: Ticket):
+        if ticket.weight <= 0:
+            return
+        self.__track(ticket, -1)
+        self.__release_weight(ticket.weight)
+
+    def __release_weight(self, weight):
+        self.available += weight
+        self.__wake()
+
+    def __wake(self):
+        # Admit queued tickets in order while they fit (FIFO, so a heavy command isn't starved by light ones)
+        while len(self.__queue) > 0 and self.__queue[0].weight <= self.available:
+            ticket = self.__queue.popleft()
+            self.available -= ticket.weight
+            ticket.admitted.set_result(True)
+
+    def stats(self):
+        return {'queue_depth': len(self.__queue), 'in_use': self.capacity - self.available, 'capacity': self.capacity,
+                'admitted': self.admitted, 'shed': self.shed}
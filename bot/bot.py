@@ -1,27 +1,84 @@
 import discord
 from discord.ext import commands
 from embeds import VideoEmbed, VideoListingEmbed
-from etcdatabase import ETCDatabase
+from searchbackend import SearchBackend, open_database
+from query import build_search_query, parse_window_days
 import argparse
+import asyncio
+import typing
 import logging
 import yaml
+import json
 import datetime
 from dateutil.parser import parse
 from thumbnail import IPFSThumbnailHandler
+from gateways import GatewaySelector, TRUSTED_PUBLIC_IPFS_GATEWAYS, PROBE_CID, PROBE_INTERVAL_S
+from statscache import StatsSnapshot, merge_phrase_stats
+from cache import QueryCache
+from selection import Selection, SelectionStore
+from kvstore import open_kv_store
+from metrics import metrics, METRICS_HOST, METRICS_PORT
+from timeline import Timeline, PREFILTER_MAX_IDS, TIMELINE_REFRESH_INTERVAL_S
+from suggest import TitleSuggester, SUGGEST_REFRESH_INTERVAL_S
+from leader import LeaderElection, LEASE_TTL_S
+from startup import (
+    Startup,
+    warm_queries,
+    load_warm_queries,
+    start_warm_queries_saver,
+    FIRST_COMMAND_TARGET_S,
+    WARM_QUERIES
+)
+from admission import (
+    AdmissionController,
+    Overloaded,
+    ADMISSION_CAPACITY,
+    ADMISSION_MAX_PER_USER,
+    ADMISSION_MAX_PER_GUILD,
+    ADMISSION_MAX_QUEUE,
+    ADMISSION_QUEUE_TIMEOUT_S
+)
+from video import ETCVideo
 from const import (
     PREFIX,
-    MAX_LIST,
-    TITLE_PHRASES,
-    MERGE_PHRASE
+    ID_FIELD,
+    MARKDOWN_CHARACTERS,
+    TITLE_FIELDS,
+    SEARCHR_WINDOW_DAYS,
+    SEARCHR_MAX_WINDOW_DAYS,
+    SHARD_IDS,
+    SHARD_COUNT,
+    WORKER_ID
 )
 
-bot = commands.Bot(command_prefix=PREFIX)
-db: ETCDatabase
+startup = Startup()
+
+if SHARD_COUNT > 0:
+    bot = commands.AutoShardedBot(command_prefix=PREFIX, shard_ids=SHARD_IDS or None, shard_count=SHARD_COUNT)
+else:
+    bot = commands.Bot(command_prefix=PREFIX)
+db: SearchBackend
+stats_snapshot: StatsSnapshot
+query_cache = None
+timeline = None
+suggester = None
+leader_election: LeaderElection
+admission = None
+searchr_window_days = SEARCHR_WINDOW_DAYS
 log = logging.getLogger('root')
 
 
-# format: 'userid: {videos to choose}
-user_choose = {}
+selections = SelectionStore()
+
+
+async def set_selection(user, videos: list, query=None, cursor=None):
+    """
+    Store the videos a user can choose from, and start prefetching their thumbnails
+    """
+    selection = Selection(videos, query=query, cursor=cursor)
+    await selections.set(user.id, selection)
+    selection.prefetch_thumbs(get_thumb)
+    return selection
 
 
 @bot.command()
@@ -31,105 +88,167 @@ async def choose(ctx, num):
     """
     embed = None
     async with ctx.typing():
-        if ctx.message.author in user_choose:
+        selection = selections.get(ctx.message.author.id)
+        if selection is not None:
             try:
                 index = int(num) - 1
-                if index in [a for a in range(0, len(user_choose[ctx.message.author]))]:
-                    embed = VideoEmbed(user_choose[ctx.message.author][index])
-                    thumb = await get_thumb(user_choose[ctx.message.author][index].id)
+                if index in [a for a in range(0, len(selection.videos))]:
+                    video_id = selection.videos[index].id
+                    video, thumb = await asyncio.gather(get_video_detail(video_id), selection.get_thumb(video_id, get_thumb))
+                    embed = VideoEmbed(video if video is not None else selection.videos[index])
                     embed.set_image(url=thumb)
-                    user_choose.pop(ctx.message.author)
+                    await selections.pop(ctx.message.author.id)
 
             except ValueError:
-                user_choose.pop(ctx.message.author)
+                await selections.pop(ctx.message.author.id)
     if isinstance(embed, VideoEmbed):
         await ctx.send(embed=embed)
 
 
-async def search_intermediate(query=None, field=None, match_phrase=True, sort_by_field=None, sort=0, extra_querys=None):
+async def change_page(ctx, step: int):
+    """
+    Move the user's selection to the next/previous page of results
+    """
+    selection = selections.get(ctx.message.author.id)
+    if selection is None:
+        return discord.Embed(title="Error", description="No search results to page through", colour=0xff0000)
 
-    if extra_querys is None:
-        extra_querys = []
-    if sort == 1:
-        sort_order = "desc"
-    else:
-        sort_order = "asc"
+    page = selection.page + step
+    if page < 0 or (page not in selection.pages and page not in selection.cursors):
+        return discord.Embed(title="Error", description="No more results", colour=0xff0000)
+
+    if page not in selection.pages:
+        search_data, cursor = await run_search({**selection.query, 'search_after': selection.cursors[page]}, profile='listing')
+        if len(search_data) == 0:
+            return discord.Embed(title="Error", description="No more results", colour=0xff0000)
+        selection.add_page(page, search_data, cursor)
+
+    selection.page = page
+    await selections.set(ctx.message.author.id, selection)
+    selection.prefetch_thumbs(get_thumb)
+    return VideoListingEmbed(selection.videos, page=selection.page, has_next=selection.has_next())
+
+
+@bot.command(name="next")
+async def next_page(ctx):
+    """
+    Show the next page of search results
+    """
+    async with ctx.typing():
+        embed = await change_page(ctx, 1)
+    await ctx.send(embed=embed)
+
+
+@bot.command(name="prev")
+async def prev_page(ctx):
+    """
+    Show the previous page of search results
+    """
+    async with ctx.typing():
+        embed = await change_page(ctx, -1)
+    await ctx.send(embed=embed)
 
-    if sort_by_field is not None:
-        sort_item = {'sort':[{sort_by_field:{'order': sort_order}}, '_score']}
-    else:
-        sort_item = {}
-    size_item = {"size": MAX_LIST}
-
-    queries = []
-    query_bool_dict = {}
-    source_filters = []
-
-    if len(extra_querys) != 0:
-        queries.extend(extra_querys)
-        log.info("Added extra queries")
-
-    if query is None and field is None:  # Just get everything
-        queries.append({"match_all": {}})
-        log.info("Getting everything")
-
-    elif query is None and field is not None:  # Get all of a particular field
-        queries.append({"match_all": {}})
-        source_filters.append(field)
-        log.info("Getting everything for a particular field")
-    elif match_phrase is not None and field is not None: # Search a field and match a phrase
-        queries.append({'match_phrase': {field: query}})
-        log.info("Searching a field and matching a phrase")
-    elif match_phrase is not None and field is None:  # Match a phrase but search globally
-        queries.append({'multi_match': {"type": "phrase", "query": query}})
-        log.info("Match a phrase but search globally")
-    elif match_phrase is None and field is not None:  #  Do not match phrase, search by field (remember this one includes a query)
-        queries.append({'match': {field: query}})
-        log.info("Do not match a phrase but search by field")
-    elif match_phrase is None and field is None:
-        queries.append({'multi_match': {"type": "best_fields", "query": query}})
-        log.info("Search globally but don't match phrase")
-    else:
-        log.error("Invalid combination for searching.")
-        queries.append({"match_none": {}})
 
-    if len(source_filters) > 0:
-        source_item = {"_source": source_filters}
+async def build_search_embed(ctx, search_results, error_description, suggest_query=None):
+    """
+    Build the embed for a search: an error, the single video found or a listing to choose from
+
+    suggest_query: text to suggest similar titles for if nothing was found
+    """
+    search_object, search_data, cursor = search_results
+    if len(search_data) == 0:
+        embed = discord.Embed(title="Error", description=error_description, colour=0xff0000)
+        suggestions = suggest_titles(suggest_query)
+        if len(suggestions) > 0:
+            embed.add_field(name="Did you mean", inline=False,
+                            value="\n".join(f'{PREFIX}search "{title}"' for title in suggestions))
+    elif len(search_data) == 1:
+        # the whole document of a single hit comes with the listing (see SearchBackend.search_page)
+        embed = VideoEmbed(search_data[0])
+        embed.set_image(url=await get_thumb(search_data[0].id))
     else:
-        source_item = {}
+        selection = await set_selection(ctx.message.author, search_data, query=search_object, cursor=cursor)
+        embed = VideoListingEmbed(search_data, page=0, has_next=selection.has_next())
+    return embed
+
 
-    if len(queries) > 0:
-        query_bool_dict.setdefault("must", []).extend(queries)
+def suggest_titles(query):
+    """
+    Titles close to query (e.g with a typo fixed), if the title suggestions are loaded
+    """
+    if suggester is None or not suggester.is_ready() or query is None:
+        return []
+    titles = [title for title, _, _ in suggester.suggest(query)]
+    # keep the suggested commands copyable
+    return [VideoListingEmbed.replace_multi(title, MARKDOWN_CHARACTERS + ['"'], "") for title in titles]
 
-    query_item = {"query": {"bool": query_bool_dict}}
 
-    search_object = {**size_item, **source_item, **query_item, **sort_item}
+async def run_search(search_object, profile='detail'):
+    """
+    Returns a tuple of (videos, cursor for the next page)
+    """
+    if timeline is not None and timeline.is_ready():
+        if profile == 'listing':
+            answer = timeline.answer(search_object)
+            if answer is not None:
+                return answer
+        search_object = timeline.prefilter(search_object)
+    if query_cache is None:
+        return await db.search_page(search_object, profile=profile)
+    return await query_cache.get_or_load({'profile': profile, 'query': search_object},
+                                         lambda: db.search_page(search_object, profile=profile))
+
+
+async def get_video_detail(video_id):
+    """
+    Fetch the full document of a video, e.g one picked from a listing
+    """
+    videos, _ = await run_search({"size": 1, "query": {"match_phrase": {ID_FIELD: video_id}}}, profile='detail')
+    return videos[0] if len(videos) > 0 else None
+
+
+async def search_intermediate(query=None, field=None, match_phrase=True, sort_by_field=None, sort=0, extra_querys=None,
+                              profile='listing'):
+    """
+    Build and run a search. Returns a tuple of (search object, videos, cursor for the next page)
+
+    profile: fields to fetch for each video (see searchbackend.SOURCE_PROFILES). Listings only need the id and title,
+    except for a single video, which is returned in full.
+    The full document of a video picked from a listing can be fetched with get_video_detail.
+    """
+
+    # Listings of several videos can be paged through with !next
+    search_object = build_search_query(query=query, field=field, match_phrase=match_phrase,
+                                       sort_by_field=sort_by_field, sort=sort, extra_querys=extra_querys, paged=True)
     log.info(search_object)
-    return await db.search(search_object)
+    return (search_object, *await run_search(search_object, profile=profile))
+
+
+class WindowDays(commands.Converter):
+
+    async def convert(self, ctx, argument):
+        days = parse_window_days(argument)
+        if days is None:
+            raise commands.BadArgument(f"{argument} is not days=<number>")
+        return days
 
 
 @bot.command()
-async def searchr(ctx, date: str, query=None, field=None):
+async def searchr(ctx, date: str, days: typing.Optional[WindowDays] = None, query=None, field=None):
     """
-    Search by date. Range is +- 4 days from given.
+    Search by date, sorted by date. Range is +- 4 days from given, or a window of days=<number> around it.
     """
     async with ctx.typing():
         # Convert the date
         datetime_utc = parse(date, fuzzy=True).replace(tzinfo=datetime.timezone.utc).timestamp()
         log.info(f"Converted date to epoch: {datetime_utc}")
-        date_query = await db.get_date_range_query(datetime_utc, range=8)
+        days = searchr_window_days if days is None else max(1, min(days, SEARCHR_MAX_WINDOW_DAYS))
+        date_query = await db.get_date_range_query(datetime_utc, range=days)
 
-        search_data = await search_intermediate(query=query, field=field, extra_querys=[date_query])
+        search_results = await search_intermediate(query=query, field=field, extra_querys=[date_query],
+                                                   sort_by_field='date_published')
 
-        if len(search_data) == 0:
-            embed = discord.Embed(title="Error", description=f"No entries in database for date range:{date}", colour=0xff0000)
-        elif len(search_data) == 1:
-            embed = VideoEmbed(search_data[0])
-            thumb = await get_thumb(search_data[0].id)
-            embed.set_image(url=thumb)
-        else:
-            embed = VideoListingEmbed(search_data)
-            user_choose[ctx.message.author] = search_data
+        embed = await build_search_embed(ctx, search_results, f"No entries in database for date range:{date}")
 
     await ctx.send(embed=embed)
 
@@ -140,17 +259,10 @@ async def search(ctx, query: str, field=None):
     Search the database by phrase. Make sure it is in quotes.
     """
     async with ctx.typing():
-        search_data = await search_intermediate(query=query, field=field)
+        search_results = await search_intermediate(query=query, field=field)
 
-        if len(search_data) == 0:
-            embed = discord.Embed(title="Error", description=f"No entries in database for query:{query}", colour=0xff0000)
-        elif len(search_data) == 1:
-            embed = VideoEmbed(search_data[0])
-            thumb = await get_thumb(search_data[0].id)
-            embed.set_image(url=thumb)
-        else:
-            embed = VideoListingEmbed(search_data)
-            user_choose[ctx.message.author] = search_data
+        embed = await build_search_embed(ctx, search_results, f"No entries in database for query:{query}",
+                                         suggest_query=query if field in TITLE_FIELDS else None)
 
     await ctx.send(embed=embed)
 
@@ -161,17 +273,10 @@ async def searchda(ctx, query: str, field=None):
     Search database, sorted by date ascending
     """
     async with ctx.typing():
-        search_data = await search_intermediate(query=query, sort_by_field='date_published', sort=0, field=field)
+        search_results = await search_intermediate(query=query, sort_by_field='date_published', sort=0, field=field)
 
-        if len(search_data) == 0:
-            embed = discord.Embed(title="Error", description=f"No entries in database for query:{query}", colour=0xff0000)
-        elif len(search_data) == 1:
-            embed = VideoEmbed(search_data[0])
-            thumb = await get_thumb(search_data[0].id)
-            embed.set_image(url=thumb)
-        else:
-            embed = VideoListingEmbed(search_data)
-            user_choose[ctx.message.author] = search_data
+        embed = await build_search_embed(ctx, search_results, f"No entries in database for query:{query}",
+                                         suggest_query=query if field in TITLE_FIELDS else None)
 
     await ctx.send(embed=embed)
 
@@ -182,17 +287,10 @@ async def searchdd(ctx, query: str, field=None):
     Search database, sorted by date descending
     """
     async with ctx.typing():
-        search_data = await search_intermediate(query=query, sort_by_field='date_published', sort=1, field=field)
+        search_results = await search_intermediate(query=query, sort_by_field='date_published', sort=1, field=field)
 
-        if len(search_data) == 0:
-            embed = discord.Embed(title="Error", description=f"No entries in database for query:{query}", colour=0xff0000)
-        elif len(search_data) == 1:
-            embed = VideoEmbed(search_data[0])
-            thumb = await get_thumb(search_data[0].id)
-            embed.set_image(url=thumb)
-        else:
-            embed = VideoListingEmbed(search_data)
-            user_choose[ctx.message.author] = search_data
+        embed = await build_search_embed(ctx, search_results, f"No entries in database for query:{query}",
+                                         suggest_query=query if field in TITLE_FIELDS else None)
 
     await ctx.send(embed=embed)
 
@@ -234,25 +332,11 @@ async def stats(ctx, series=None):
         embed = discord.Embed(title="ETC Database Statistics")
 
         if series is not None:
-            phrases = TITLE_PHRASES
             embed.description = "Note: that the numbers for series are estimates based off keywords in the video title." \
                                 "**They are far from accurate**, " \
                                 "but give an idea of how many videos we *at least* have."
-        else:
-            phrases = []
-        stats_received = await db.get_stats(phrases=phrases)
-        for merge_pair in MERGE_PHRASE:
-            _data = {}
-            for merge in MERGE_PHRASE[merge_pair]:
-                try:
-                    for key in stats_received['phrase'][merge]:
-                        _data.setdefault(key, 0)
-                        _data[key] += int(stats_received['phrase'][merge][key])
-                    del stats_received['phrase'][merge]
-                except KeyError:
-                    continue
-            if len(_data) != 0:
-                stats_received['phrase'][merge_pair] = _data
+        stats_received, as_of = await stats_snapshot.get(series=series is not None)
+        merge_phrase_stats(stats_received['phrase'])
         total_archived_string = f"{stats_received['total_archived']} ({stats_received['total_modern']} + {stats_received['total_classic']})"
 
         embed.add_field(name="Total Entries", value=stats_received['total'], inline=False)
@@ -263,6 +347,33 @@ async def stats(ctx, series=None):
             embed.add_field(name=phrase_stat, inline=True, value=f"Total: {stats_received['phrase'][phrase_stat]['total']}"
                                                     f"\nTotal Re-uploaded: {stats_received['phrase'][phrase_stat]['total_reuploaded']}"
                                                     f"\nTotal Archived: {stats_received['phrase'][phrase_stat]['total_archived']}")
+        embed.set_footer(text=f"Stats as of {datetime.datetime.fromtimestamp(as_of, tz=datetime.timezone.utc).strftime('%Y-%m-%d %H:%M')} UTC")
+    await ctx.send(embed=embed)
+
+
+@bot.command(hidden=True)
+@commands.is_owner()
+async def flushcache(ctx):
+    """
+    Flush the search result cache (e.g after a reindex)
+    """
+    if query_cache is not None:
+        await query_cache.flush()
+    await ctx.send(embed=discord.Embed(title="Search cache flushed"))
+
+
+@bot.command(hidden=True)
+@commands.is_owner()
+async def gateways(ctx):
+    """
+    Show IPFS gateway health
+    """
+    embed = discord.Embed(title="IPFS Gateways")
+    for gateway in thumbdb.gateway_selector.stats():
+        latency = "-" if gateway['latency'] is None else f"{round(gateway['latency'] * 1000)}ms"
+        embed.add_field(name=gateway['url'], inline=False,
+                        value=f"Latency: {latency}, Error rate: {gateway['error_rate']}, "
+                              f"Circuit: {'Open' if gateway['open'] else 'Closed'}, Probes: {gateway['probes']}")
     await ctx.send(embed=embed)
 
 
@@ -272,20 +383,107 @@ async def about(ctx):
     await ctx.send(embed=embed)
 
 
+def dump_search_page(page):
+    videos, cursor = page
+    return json.dumps({'videos': [video.raw() for video in videos], 'cursor': cursor})
+
+
+def load_search_page(data):
+    data = json.loads(data)
+    return [ETCVideo(**video) for video in data['videos']], data['cursor']
+
+
+async def run_leader_tasks():
+    """
+    Tasks run by only one of the bot processes: resolving and pinning the thumbnail folder, refreshing the stats
+    """
+    await asyncio.gather(thumbdb.start_ipns_checker(), stats_snapshot.start_refresher())
+
+
 async def print_info():
-    client = await db.get_client()
-    info = await client.info()
+    info = await db.info()
     log.info(info)
 
 
+async def initialize():
+    """
+    Startup pipeline, run while connecting to Discord: load the persisted caches and open the Elasticsearch
+    and IPFS connections concurrently, then replay the most used queries of the last run into the query cache.
+    Commands wait for the first step (see before_command), not for the queries to be warmed.
+    """
+    await startup.run({'caches': thumbdb.load_caches(), 'elasticsearch': print_info(), 'ipfs': thumbdb.warm_up()},
+                      warm=warm_up_queries)
+
+
+async def warm_up_queries():
+    """
+    Replay the most used queries of the last run into the query cache, then keep saving the most used ones
+    """
+    startup_config = config.get('startup', {})
+    warm_queries_file = startup_config.get('warm_queries_file')
+    if query_cache is None or not warm_queries_file:
+        return
+    count = startup_config.get('warm_queries', WARM_QUERIES)
+    queries = load_warm_queries(warm_queries_file)[:count]
+    await warm_queries(queries, lambda query: run_search(query['query'], profile=query['profile']))
+    startup.mark("warm_queries")
+    await start_warm_queries_saver(warm_queries_file, query_cache.top_queries, count=count)
+
+
+@bot.before_invoke
+async def before_command(ctx):
+    await startup.wait_ready()
+    if admission is not None:
+        # raises Overloaded (handled in on_command_error) if the command is shed
+        ctx.admission_ticket = await admission.acquire(ctx.command.qualified_name, ctx.author.id,
+                                                       None if ctx.guild is None else ctx.guild.id)
+    ctx.command_trace = metrics.start_command(ctx.command.qualified_name)
+
+
+@bot.after_invoke
+async def after_command(ctx):
+    metrics.finish_command(ctx.command_trace, failed=ctx.command_failed)
+    startup.command_finished()
+    if admission is not None:
+        admission.release(ctx.admission_ticket)
+
+
+@bot.event
+async def on_command_error(ctx, error):
+    if isinstance(error, Overloaded):
+        await ctx.send(embed=discord.Embed(title="Busy", description=str(error), colour=0xffa500))
+        return
+    await type(bot).on_command_error(bot, ctx, error)  # default handling of every other error
+
+
 @bot.event
 async def on_ready():
     log.info('Logged in as')
     log.info(bot.user.name)
     log.info(bot.user.id)
     log.info('------')
-
-    bot.loop.create_task(thumbdb.start_ipns_checker())
+    startup.mark("discord_ready")
+
+    if not hasattr(bot, 'leader_task'):
+        bot.leader_task = bot.loop.create_task(leader_election.run(run_leader_tasks, thumbdb.start_folder_follower))
+    if not hasattr(bot, 'prober_task'):
+        bot.prober_task = bot.loop.create_task(thumbdb.gateway_selector.start_prober())
+    if not hasattr(bot, 'purger_task'):
+        bot.purger_task = bot.loop.create_task(selections.start_purger())
+    if config.get('elasticsearch', {}).get('enrichment_map', {}).get('enabled', False) and not hasattr(bot, 'enrichment_task'):
+        bot.enrichment_task = bot.loop.create_task(db.start_enrichment_refresher())
+    timeline_config = config.get('timeline', {})
+    if timeline is not None and not hasattr(bot, 'timeline_task'):
+        bot.timeline_task = bot.loop.create_task(
+            timeline.start_refresher(db, refresh_interval=timeline_config.get('refresh_interval', TIMELINE_REFRESH_INTERVAL_S)))
+    if suggester is not None and not hasattr(bot, 'suggester_task'):
+        bot.suggester_task = bot.loop.create_task(
+            suggester.start_refresher(db, refresh_interval=config['suggestions'].get('refresh_interval', SUGGEST_REFRESH_INTERVAL_S)))
+    metrics_config = config.get('metrics', {})
+    if metrics_config.get('enabled', False) and not hasattr(bot, 'metrics_runner'):
+        # one port per worker process
+        bot.metrics_runner = await metrics.start_server(host=metrics_config.get('host', METRICS_HOST),
+                                                        port=metrics_config.get('port', METRICS_PORT) + WORKER_ID)
 
 if __name__ == '__main__':
     # Load the config
@@ -298,12 +496,73 @@ if __name__ == '__main__':
         config = yaml.load(f, Loader=yaml.FullLoader)
     logging.basicConfig(level=config['discord']['log_level'])
 
-    db = ETCDatabase(config['elasticsearch']['main_index'],
-                     config['elasticsearch']['yt_index'],
-                     config['elasticsearch']['local_index'], hosts=config['elasticsearch']['hosts'])
+    db = open_database(config)
+    cluster_config = config.get('cluster', {})
+    # shared by the worker processes started by launcher.py (None for a single process)
+    shared_store = open_kv_store(cluster_config['store']) if cluster_config.get('store') else None
+    leader_election = LeaderElection(shared_store if shared_store is not None else open_kv_store(),
+                                     lease_ttl=cluster_config.get('lease_ttl', LEASE_TTL_S))
+    query_cache_config = config.get('query_cache', {})
+    if query_cache_config.get('enabled', True):
+        query_cache = QueryCache(ttl=query_cache_config.get('ttl', 300), stale_ttl=query_cache_config.get('stale_ttl', 3600),
+                                 max_entries=query_cache_config.get('max_entries', 512),
+                                 max_memory_mb=query_cache_config.get('max_memory_mb', 16),
+                                 size_of=lambda page: sum(video.estimated_size() for video in page[0]),
+                                 shared_store=shared_store,
+                                 dumps=dump_search_page, loads=load_search_page)
+    selections_config = config.get('selections', {})
+    selections_store = selections_config.get('store')
+    selections = SelectionStore(backend=open_kv_store(selections_store) if selections_store else shared_store,
+                                ttl=selections_config.get('ttl', 600),
+                                max_entries=selections_config.get('max_entries', 1000),
+                                max_memory_mb=selections_config.get('max_memory_mb', 8))
+    stats_config = config.get('stats', {})
+    stats_snapshot = StatsSnapshot(db, cache_file=stats_config.get('cache'), ttl=stats_config.get('ttl', 3600),
+                                   refresh_interval=stats_config.get('refresh_interval', 3600),
+                                   shared_store=shared_store)
     thumbdb = IPFSThumbnailHandler(ipns_hash=config['thumbnails']['ipns'], cache_file=config['thumbnails']['cache'],
-                                   ipfs_host=config['thumbnails']['host'], ipfs_port=config['thumbnails']['port'])
-
+                                   ipfs_host=config['thumbnails']['host'], ipfs_port=config['thumbnails']['port'],
+                                   thumb_path_cache_size=config['thumbnails'].get('path_cache_size', 10000),
+                                   persist_thumb_paths=config['thumbnails'].get('persist_paths', True),
+                                   manifest_file=config['thumbnails'].get('manifest'),
+                                   gateway_selector=GatewaySelector(gateways=config['thumbnails'].get('gateways', TRUSTED_PUBLIC_IPFS_GATEWAYS),
+                                                                    probe_cid=config['thumbnails'].get('probe_cid', PROBE_CID),
+                                                                    probe_interval=config['thumbnails'].get('probe_interval', PROBE_INTERVAL_S)),
+                                   shared_store=shared_store)
+
+    admission_config = config.get('admission', {})
+    if admission_config.get('enabled', True):
+        admission = AdmissionController(capacity=admission_config.get('capacity', ADMISSION_CAPACITY),
+                                        max_per_user=admission_config.get('max_per_user', ADMISSION_MAX_PER_USER),
+                                        max_per_guild=admission_config.get('max_per_guild', ADMISSION_MAX_PER_GUILD),
+                                        max_queue=admission_config.get('max_queue', ADMISSION_MAX_QUEUE),
+                                        queue_timeout=admission_config.get('queue_timeout', ADMISSION_QUEUE_TIMEOUT_S),
+                                        weights=admission_config.get('weights'))
+        metrics.register_stats("admission", admission.stats)
+
+    timeline_config = config.get('timeline', {})
+    searchr_window_days = timeline_config.get('window_days', SEARCHR_WINDOW_DAYS)
+    if timeline_config.get('enabled', False):
+        timeline = Timeline(prefilter_max_ids=timeline_config.get('prefilter_max_ids', PREFILTER_MAX_IDS))
+        metrics.register_stats("timeline", timeline.stats)
+
+    if config.get('suggestions', {}).get('enabled', False):
+        suggester = TitleSuggester()
+        metrics.register_stats("suggestions", suggester.stats)
+
+    if config.get('metrics', {}).get('tracing', False):
+        metrics.enable_tracing()
+    if query_cache is not None:
+        metrics.register_stats("query_cache", query_cache.stats)
+    metrics.register_stats("selections", selections.stats)
+    metrics.register_stats("search_single_flight", db.single_flight.stats)
+    metrics.register_stats("thumb_single_flight", thumbdb.single_flight.stats)
+    metrics.register_stats("thumb_path_cache", thumbdb.thumb_paths.stats)
+    metrics.register_stats("leader", leader_election.stats)
+
+    startup.target_first_command = config.get('startup', {}).get('target_first_command', FIRST_COMMAND_TARGET_S)
+    metrics.register_stats("startup", startup.stats)
+    bot.loop.create_task(initialize())
     bot.run(config['discord']['token'])
 
 
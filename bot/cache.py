@@ -0,0 +1,227 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from collections import Counter, OrderedDict
+from kvstore import EVICT_EVERY_SETS
+log = logging.getLogger('root')
+
+"""
+
+In-process caches used by the bot.
+
+LRUCache is a bounded (by entry count and estimated size) least recently used cache.
+QueryCache sits on top of it to cache search results with a TTL and stale-while-revalidate.
+Given a shared key-value store (see kvstore), results are also shared with the other bot processes.
+
+"""
+
+
+class LRUCache:
+
+    def __init__(self, max_entries=1024, max_bytes=None, size_of=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.__size_of = size_of if size_of is not None else (lambda value: 1)
+        self.__entries = OrderedDict()  # key -> (value, size)
+        self.__bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __contains__(self, key):
+        return key in self.__entries
+
+    def get(self, key, default=None):
+        try:
+            value, _ = self.__entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.__entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.pop(key)
+        size = self.__size_of(value)
+        self.__entries[key] = (value, size)
+        self.__bytes += size
+        self.__evict()
+
+    def pop(self, key, default=None):
+        try:
+            value, size = self.__entries.pop(key)
+        except KeyError:
+            return default
+        self.__bytes -= size
+        return value
+
+    def clear(self):
+        self.__entries.clear()
+        self.__bytes = 0
+
+    def keys(self):
+        return list(self.__entries.keys())
+
+    def items(self):
+        return [(key, value) for key, (value, _) in self.__entries.items()]
+
+    def memory_bytes(self):
+        return self.__bytes
+
+    def __evict(self):
+        while len(self.__entries) > self.max_entries or \
+                (self.max_bytes is not None and self.__bytes > self.max_bytes and len(self.__entries) > 1):
+            _, (_, size) = self.__entries.popitem(last=False)
+            self.__bytes -= size
+            self.evictions += 1
+
+    def stats(self):
+        return {'entries': len(self.__entries), 'bytes': self.__bytes, 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions}
+
+
+class QueryCache:
+
+    NAMESPACE = "query_cache"
+    GENERATION_NAMESPACE = "query_cache_generation"  # bumped by flush(), to flush the other processes too
+
+    def __init__(self, ttl=300, stale_ttl=3600, max_entries=512, max_memory_mb=16, size_of=None,
+                 shared_store=None, dumps=None, loads=None):
+        """
+        ttl: seconds an entry is fresh for
+        stale_ttl: seconds after the ttl an entry can still be served while it is refreshed in the background
+        shared_store: key-value store to share results through, with dumps/loads to convert a result to/from a string
+        """
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.max_bytes = int(max_memory_mb * 1024 * 1024)
+        self.__cache = LRUCache(max_entries=max_entries, max_bytes=self.max_bytes,
+                                size_of=(lambda entry: size_of(entry[0])) if size_of is not None else None)
+        self.__revalidating = {}
+        self.__shared_store = shared_store
+        self.__dumps = dumps
+        self.__loads = loads
+        self.__generation = None if shared_store is None else shared_store.get(self.GENERATION_NAMESPACE, "generation")
+        self.__shared_sets = 0  # since the shared store was last evicted
+        self.stale_hits = 0
+        self.served_on_error = 0
+        self.shared_hits = 0
+        self.__uses = Counter()  # key -> lookups, for top_queries()
+
+    @staticmethod
+    def make_key(query):
+        return json.dumps(query, sort_keys=True, default=str)
+
+    async def get_or_load(self, query, loader):
+        """
+        Return the cached result for query, otherwise await loader() and cache the result.
+        If loader fails and there is any cached entry (even an expired one), that is returned instead.
+        """
+        key = self.make_key(query)
+        self.__count_use(key)
+        if self.__shared_store is not None:
+            self.__check_generation()
+        entry = self.__cache.get(key)
+        if entry is None and self.__shared_store is not None:
+            entry = self.__get_shared(key)
+        if entry is not None:
+            value, stored_at = entry
+            age = time.monotonic() - stored_at
+            if age <= self.ttl:
+                return value
+            if age <= self.ttl + self.stale_ttl:
+                self.stale_hits += 1
+                self.__revalidate(key, loader)
+                return value
+
+        try:
+            value = await loader()
+        except Exception as e:
+            if entry is None:
+                raise
+            log.warning(f"Failed to load query, serving expired cache entry instead: {e}")
+            self.served_on_error += 1
+            return entry[0]
+
+        await self.__set(key, value)
+        return value
+
+    def __check_generation(self):
+        generation = self.__shared_store.get(self.GENERATION_NAMESPACE, "generation")
+        if generation != self.__generation:
+            log.info("Query cache flushed by another process")
+            self.__cache.clear()
+            self.__generation = generation
+
+    def __get_shared(self, key):
+        data = self.__shared_store.get(self.NAMESPACE, key)
+        if data is None:
+            return None
+        try:
+            data = json.loads(data)
+            # stored with the wall clock, as the monotonic clock is per process
+            entry = (self.__loads(data['value']), time.monotonic() - max(0.0, time.time() - data['stored_at']))
+        except (ValueError, KeyError, TypeError) as e:
+            log.warning(f"Ignoring invalid shared query cache entry: {e}")
+            return None
+        self.shared_hits += 1
+        self.__cache.set(key, entry)
+        return entry
+
+    async def __set(self, key, value):
+        self.__cache.set(key, (value, time.monotonic()))
+        if self.__shared_store is not None:
+            await self.__shared_store.set(self.NAMESPACE, key, json.dumps({'stored_at': time.time(), 'value': self.__dumps(value)}),
+                                          ttl=self.ttl + self.stale_ttl)
+            self.__shared_sets += 1
+            if self.__shared_sets >= EVICT_EVERY_SETS:
+                self.__shared_sets = 0
+                await self.__shared_store.evict(self.NAMESPACE, max_entries=self.max_entries, max_bytes=self.max_bytes)
+
+    def __revalidate(self, key, loader):
+        if key in self.__revalidating:
+            return
+
+        async def _revalidate():
+            try:
+                await self.__set(key, await loader())
+            except Exception as e:
+                log.warning(f"Failed to revalidate cached query: {e}")
+            finally:
+                self.__revalidating.pop(key, None)
+
+        self.__revalidating[key] = asyncio.ensure_future(_revalidate())
+
+    def __count_use(self, key):
+        self.__uses[key] += 1
+        if len(self.__uses) > 4 * self.max_entries:
+            # keep the counts of the most used half, so one-off queries don't grow the counter forever
+            self.__uses = Counter(dict(self.__uses.most_common(2 * self.max_entries)))
+
+    def top_queries(self, count):
+        """
+        The count most looked up queries, most used first (e.g to warm the cache with on the next start)
+        """
+        return [json.loads(key) for key, _ in self.__uses.most_common(count)]
+
+    async def flush(self):
+        """
+        Drop every cached entry, e.g after a reindex, in every process sharing the cache.
+        """
+        log.info(f"Flushing query cache ({len(self.__cache)} entries)")
+        self.__cache.clear()
+        if self.__shared_store is not None:
+            await self.__shared_store.clear(self.NAMESPACE)
+            self.__generation = uuid.uuid4().hex
+            await self.__shared_store.set(self.GENERATION_NAMESPACE, "generation", self.__generation)
+
+    def stats(self):
+        return {**self.__cache.stats(), 'stale_hits': self.stale_hits, 'served_on_error': self.served_on_error,
+                'shared_hits': self.shared_hits}
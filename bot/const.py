@@ -16,7 +16,12 @@ EMBED_TITLE_MAX_LENGTH = 256
 EMBED_DESCRIPTION_MAX_LENGTH = 2048
 EMBED_FIELD_NAME_MAX_LENGTH = 256
 EMBED_FIELD_VALUE_MAX_LENGTH = 1024
+EMBED_FOOTER_MAX_LENGTH = 2048
 EMBED_MAX_FIELDS = 25
+# Fields of a VideoEmbed in the order they get their share of EMBED_MAX_LENGTH. Anything not listed comes last.
+EMBED_FIELD_PRIORITY = ['id', 'title', 'date_published', 'uploader', 'duration', 'archived', 'archived_resolution',
+                        'on_youtube', 'reupload_url', 'uploader_ids', 'description', 'alternate_titles',
+                        'alternate_uploaders', 'duplicate_of', 'tags', 'alternate_descriptions']
 STR_SHORTED_SUFFIX = " [...]"
 
 
@@ -25,6 +30,17 @@ INVALID_STRINGS = (None, "", " ", "NA")
 MARKDOWN_CHARACTERS = ["_", "*"]
 
 PREFIX = os.getenv("BOT_PREFIX", "!")
+# Set by launcher.py for each worker process: the Discord shards it connects to, out of SHARD_COUNT
+SHARD_IDS = [int(shard_id) for shard_id in os.getenv("BOT_SHARD_IDS", "").split(",") if shard_id != ""]
+SHARD_COUNT = int(os.getenv("BOT_SHARD_COUNT", "0"))
+WORKER_ID = int(os.getenv("BOT_WORKER_ID", "0"))
 MAX_LIST = 20
+SEARCHR_WINDOW_DAYS = 8  # default date window of !searchr
+SEARCHR_MAX_WINDOW_DAYS = 366
+ID_FIELD = "id"  # field holding the video id in every index
+# keyword subfield of ID_FIELD added by Elasticsearch's dynamic mapping (ID_FIELD itself is analyzed text).
+# Used for exact id filters, aggregations, and as a sort tiebreaker
+ID_KEYWORD_FIELD = "id.keyword"
+TITLE_FIELDS = (None, "title", "alternate_titles")  # search fields a "did you mean" title suggestion applies to
 TITLE_PHRASES = ['Weekly Weird News', 'News Dump', 'Tech Newsday', 'Tech Tuesday', 'Tech Tuesday', 'TechNewsday', 'ETC Podcast', 'T.U.G.S', 'TUGS', 'Creepy Text Theatre', 'Ask Us Anything!', 'ETC Live', 'Spacebar']
 MERGE_PHRASE = {'Tech Tuesday/Newsday': ('Tech Newsday', 'Tech Tuesday', 'TechNewsday', 'Tech Tuesday'), 'T.U.G.S.': ('T.U.G.S', 'TUGS')}
\ No newline at end of file
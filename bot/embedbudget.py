@@ -0,0 +1,113 @@
+from const import (
+    EMBED_MAX_LENGTH,
+    EMBED_TITLE_MAX_LENGTH,
+    EMBED_FIELD_NAME_MAX_LENGTH,
+    EMBED_FIELD_VALUE_MAX_LENGTH,
+    EMBED_FOOTER_MAX_LENGTH,
+    EMBED_MAX_FIELDS,
+    EMBED_FIELD_PRIORITY,
+    STR_SHORTED_SUFFIX
+)
+
+"""
+
+Fits the fields of an embed into discord's limits.
+
+Every field is first capped to the per-field limits, then the total embed budget (EMBED_MAX_LENGTH,
+minus the title and footer) is handed out to the fields in order of priority (EMBED_FIELD_PRIORITY).
+A field that doesn't fully fit in what is left is shortened, or dropped if not even its name fits.
+
+Lists are shortened by whole items as they are displayed (", ".join()), using prefix sums of the item lengths,
+so everything is linear in the size of the fields.
+
+"""
+
+LIST_SEPARATOR = ", "
+# Don't bother keeping a shortened field with less than this many characters of its value left
+MIN_SHORTENED_LENGTH = len(STR_SHORTED_SUFFIX) + 16
+
+
+def list_length(items: list):
+    if len(items) == 0:
+        return 0
+    return sum(len(str(item)) for item in items) + len(LIST_SEPARATOR) * (len(items) - 1)
+
+
+def value_length(value):
+    return list_length(value) if isinstance(value, list) else len(str(value))
+
+
+def shorten_str(s: str, max_length: int):
+    if len(s) <= max_length:
+        return s
+
+    if s.endswith(STR_SHORTED_SUFFIX):
+        s = s[:-len(STR_SHORTED_SUFFIX)]
+
+    return s[:max(max_length - len(STR_SHORTED_SUFFIX), 0)] + STR_SHORTED_SUFFIX
+
+
+def shorten_list(items: list, max_length: int):
+    """
+    Keep as many leading items as fit in max_length when joined, followed by STR_SHORTED_SUFFIX if any were dropped.
+    """
+    lengths = [len(str(item)) for item in items]
+    if sum(lengths) + len(LIST_SEPARATOR) * (len(items) - 1) <= max_length:
+        return list(items)
+
+    # joined length of the first k items plus the suffix: prefix(k) + k separators + suffix
+    available = max_length - len(STR_SHORTED_SUFFIX)
+    prefix = 0
+    keep = 0
+    for length in lengths:
+        if prefix + length + len(LIST_SEPARATOR) * (keep + 1) > available:
+            break
+        prefix += length
+        keep += 1
+    return list(items[:keep]) + [STR_SHORTED_SUFFIX]
+
+
+def shorten_value(value, max_length: int):
+    if isinstance(value, list):
+        return shorten_list(value, max_length)
+    return shorten_str(str(value), max_length)
+
+
+def field_priority(name):
+    try:
+        return EMBED_FIELD_PRIORITY.index(name)
+    except ValueError:
+        return len(EMBED_FIELD_PRIORITY)
+
+
+def fit_embed(title: str, fields: dict, footer: str = None):
+    """
+
+    Returns (title, fields, footer) shortened so the embed satisfies discord's limits.
+    The fields keep their order; only their share of the budget depends on priority.
+
+    """
+    title = shorten_str(title, EMBED_TITLE_MAX_LENGTH) if title is not None else None
+    footer = shorten_str(footer, EMBED_FOOTER_MAX_LENGTH) if footer is not None else None
+    remaining = EMBED_MAX_LENGTH - len(title or "") - len(footer or "")
+
+    # Per field limits first
+    capped = {}
+    for name, value in fields.items():
+        name = shorten_str(name, EMBED_FIELD_NAME_MAX_LENGTH)
+        capped[name] = shorten_value(value, EMBED_FIELD_VALUE_MAX_LENGTH)
+
+    kept = {}
+    for name in sorted(capped, key=field_priority):  # stable, so equal priorities keep their order
+        if len(kept) == EMBED_MAX_FIELDS:
+            break
+        value = capped[name]
+        length = value_length(value)
+        if len(name) + length <= remaining:
+            kept[name] = value
+            remaining -= len(name) + length
+        elif remaining - len(name) >= MIN_SHORTENED_LENGTH:
+            kept[name] = shorten_value(value, remaining - len(name))
+            remaining -= len(name) + value_length(kept[name])
+
+    return title, {name: kept[name] for name in capped if name in kept}, footer
@@ -1,16 +1,11 @@
 import discord
 import datetime
 from video import ETCVideo
+from embedbudget import fit_embed
 from const import (
     CHANNEL_AVATARS,
-    EMBED_MAX_LENGTH,
-    EMBED_TITLE_MAX_LENGTH,
-    EMBED_DESCRIPTION_MAX_LENGTH,
-    EMBED_FIELD_NAME_MAX_LENGTH,
-    EMBED_FIELD_VALUE_MAX_LENGTH,
-    EMBED_MAX_FIELDS,
-    STR_SHORTED_SUFFIX,
-    MARKDOWN_CHARACTERS
+    MARKDOWN_CHARACTERS,
+    PREFIX
 )
 
 import logging
@@ -18,7 +13,7 @@ log = logging.getLogger('root')
 
 
 class VideoListingEmbed(discord.Embed):
-    def __init__(self, videos: list):
+    def __init__(self, videos: list, page=None, has_next=False):
 
         description = ""
 
@@ -43,6 +38,11 @@ class VideoListingEmbed(discord.Embed):
                          colour=self.colour,
                          description=description)
 
+        if page is not None:
+            navigation = [f"{PREFIX}prev" if page > 0 else None, f"{PREFIX}next" if has_next else None]
+            navigation = " | ".join(n for n in navigation if n is not None)
+            self.set_footer(text=f"Page {page + 1}" + (f" - {navigation}" if navigation else ""))
+
     @staticmethod
     def replace_multi(string: str, old: list, new: str):
 
@@ -54,16 +54,19 @@ class VideoListingEmbed(discord.Embed):
 
 class VideoEmbed(discord.Embed):
 
-    def __init__(self, video: ETCVideo):
+    def __init__(self, video: ETCVideo, footer=None):
+
+        fields = video.as_dict()
+        self.__process_fields(fields)
+        title, fields, footer = fit_embed(f"Video {video.id}", fields, footer=footer)
 
         self.colour = 0xff0000
-        super().__init__(title=f"Video {video.id}",
+        super().__init__(title=title,
                          colour=self.colour, url=video.reupload_url)
 
-        fields = video.as_dict()
-        self.__process_fields(fields)
-        self.__shorten_fields(fields)
         self.__add_fields(fields)
+        if footer is not None:
+            self.set_footer(text=footer)
         self.__add_thumbnail(video)
 
     def set_image(self, url):
@@ -128,81 +131,3 @@ class VideoEmbed(discord.Embed):
         for field in fields:
             self.add_field(name=field.replace("_", " ").title(),
                             value=', '.join([str(f) for f in fields[field]]) if isinstance(fields[field], list) else fields[field], inline=False)
-
-    @staticmethod
-    def __list_as_string(l: list):
-        return ", ".join([str(a) for a in l])
-
-    def __shorten_list_str(self, l: list, max_length: int):
-
-        list_copy = list(l)
-        length = len(self.__list_as_string(l + [STR_SHORTED_SUFFIX]))
-
-        if length <= max_length:
-            return list_copy
-
-        while length > max_length:  # do 1 character less
-            list_copy.pop(len(list_copy)-1)
-            length = len(self.__list_as_string(list_copy + [STR_SHORTED_SUFFIX]))
-        return list_copy + [STR_SHORTED_SUFFIX]
-
-    @staticmethod
-    def __shorten_str(s: str, max_length: int):
-        if len(s) <= max_length:
-            return s
-
-        if s.endswith(STR_SHORTED_SUFFIX):
-            s = s[:-len(STR_SHORTED_SUFFIX)]
-
-        return s[:max_length-len(STR_SHORTED_SUFFIX)] + STR_SHORTED_SUFFIX
-
-    def __shorten_fields(self, fields):
-
-        """
-
-        Shortens fields to meet discord's requirements. This should work most of the time.
-
-        Currently doesn't take into account other elements are that not fields e.g url for thumbnail.
-
-        """
-
-        balanced_fields = fields
-
-        # Check if they are already balanced
-        def check_length():
-            total_fn_length = 0
-            total_f_length = 0
-
-            for field in balanced_fields:
-                total_fn_length += len(field)
-
-                total_f_length += len(self.__list_as_string(balanced_fields[field]) if isinstance(balanced_fields[field], list) else balanced_fields[field])
-
-            log.debug(f"Total length of field names: {total_fn_length}")
-            log.debug(f"Total length of fields: {total_f_length}")
-
-            if (total_length := (total_fn_length + total_f_length)) <= EMBED_MAX_LENGTH:
-                log.debug(f"Total Length is {total_length}, which satisfies the max length of {EMBED_MAX_LENGTH}")
-                return balanced_fields
-            else:
-                log.debug(f"Total Length is {total_length}, which DOES NOT satisfies the max length of {EMBED_MAX_LENGTH}")
-
-        # Ensure each field complies with discord embed limits
-        for field_name in list(balanced_fields.keys()):
-
-            log.debug(f"Checking field {field_name}")
-            # Shorten the list based on how it will be printed with  , .join()
-            if isinstance(balanced_fields[field_name], list):
-                log.debug(f"Shortening by list")
-                balanced_fields[field_name] = self.__shorten_list_str(balanced_fields[field_name], EMBED_FIELD_VALUE_MAX_LENGTH)
-            else:
-                # shorten everything else by string representation
-                balanced_fields[field_name] = self.__shorten_str(str(balanced_fields[field_name]), EMBED_FIELD_VALUE_MAX_LENGTH)
-
-            # Check field name length
-            if len(field_name) >= EMBED_FIELD_NAME_MAX_LENGTH:
-                log.debug("Field name is too long")
-                balanced_fields[self.__shorten_str(field_name, EMBED_FIELD_NAME_MAX_LENGTH)] = balanced_fields[field_name]
-                del balanced_fields[field_name]
-
-        return check_length()
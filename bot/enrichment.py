@@ -0,0 +1,72 @@
+import logging
+import sys
+import time
+log = logging.getLogger('root')
+
+"""
+
+In-memory copy of the small re-upload and local archive indexes.
+
+Maps video id -> reupload id and video id -> (width, height) so that search
+results can be enriched without any extra requests to the database.
+
+"""
+
+# Rough per entry overhead of a dict slot + tuple, on top of the key/value objects
+ENTRY_OVERHEAD_BYTES = 100
+
+
+class EnrichmentMap:
+
+    def __init__(self, max_memory_mb=64, max_age=1800):
+        self.max_memory_bytes = int(max_memory_mb * 1024 * 1024)
+        self.max_age = max_age
+        self.reuploads = {}
+        self.archived = {}
+        self.last_change = {}
+        self.doc_counts = {}  # index -> documents in it when last streamed, to notice deletions
+        self.loaded_at = None
+        self.full_loaded_at = None
+        self.__memory_bytes = 0
+        self.overflowed = False
+
+    @staticmethod
+    def __entry_size(key, value):
+        return sys.getsizeof(key) + sys.getsizeof(value) + ENTRY_OVERHEAD_BYTES
+
+    def memory_bytes(self):
+        return self.__memory_bytes
+
+    def add_reupload(self, video_id, reupload_id):
+        if video_id in self.reuploads:
+            return
+        self.reuploads[video_id] = reupload_id
+        self.__add_memory(video_id, reupload_id)
+
+    def add_archived(self, video_id, width, height):
+        quality = (width, height)
+        if video_id not in self.archived:
+            self.__add_memory(video_id, quality)
+        self.archived[video_id] = quality
+
+    def __add_memory(self, key, value):
+        self.__memory_bytes += self.__entry_size(key, value)
+        if self.__memory_bytes > self.max_memory_bytes and not self.overflowed:
+            log.warning(f"Enrichment map exceeded memory ceiling of {self.max_memory_bytes} bytes, disabling it")
+            self.overflowed = True
+
+    def mark_loaded(self, full=False):
+        self.loaded_at = time.monotonic()
+        if full:
+            self.full_loaded_at = self.loaded_at
+
+    def is_ready(self):
+        if self.loaded_at is None or self.overflowed:
+            return False
+        return time.monotonic() - self.loaded_at <= self.max_age
+
+    def lookup(self, video_id):
+        """
+        Returns a tuple of (reupload id or None, (width, height) or None)
+        """
+        return self.reuploads.get(video_id), self.archived.get(video_id)
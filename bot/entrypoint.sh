@@ -1,3 +1,3 @@
 #!/bin/sh
 echo "Launching ETC Archive Bot"
-python3 bot.py --config /config/config.yml
\ No newline at end of file
+python3 launcher.py --config /config/config.yml
\ No newline at end of file
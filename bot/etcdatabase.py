@@ -1,7 +1,13 @@
 from elasticsearch import AsyncElasticsearch
-from video import ETCVideo
+from elasticsearch.exceptions import TransportError
+from elasticsearch.helpers import async_scan
+from enrichment import EnrichmentMap
+from searchbackend import SearchBackend, MODERN_ETC_MAIN_CHANNEL_QUERY, SINGLE_HIT_AGG
+from const import ID_KEYWORD_FIELD
+from metrics import metrics
+import asyncio
 import logging
-import math
+import time
 log = logging.getLogger('root')
 
 """
@@ -13,13 +19,29 @@ as well gathering data from all 3 databases.
 
 """
 
+# Stats page through the ids matching a query this many at a time (composite aggregation),
+# and count the documents of at most this many ids per terms aggregation, to stay under search.max_buckets
+STATS_ID_PAGE_SIZE = 5000
+STATS_TERMS_BATCH = 10000
+# keyword subfield of the youtube index field holding the id of the reuploaded video
+REUPLOAD_ORIGINAL_ID_FIELD = "original_id.keyword"
+ITER_PAGE_SIZE = 1000
+ITER_KEEP_ALIVE = "2m"
+# Incremental refreshes don't see deleted documents, so the enrichment map is fully reloaded this often
+ENRICHMENT_FULL_REFRESH_INTERVAL_S = 21600
 
-class ETCDatabase:
 
-    def __init__(self, etc_index, youtube_index, local_index, **kwargs):
+class ETCDatabase(SearchBackend):
+
+    DATE_SORT_SCALE = 1000  # Elasticsearch sorts date fields in epoch ms
+
+    def __init__(self, etc_index, youtube_index, local_index, enrichment_map=None, **kwargs):
+        super().__init__()
         self._etc_index = etc_index
         self._youtube_index = youtube_index
         self._local_index = local_index
+        self._enrichment_config = enrichment_map if enrichment_map is not None else {}
+        self._enrichment = None
         self.__es_object = None
         self.connect(**kwargs)
 
@@ -29,78 +51,309 @@ class ETCDatabase:
     async def get_client(self):
         return self.__es_object
 
-    async def search(self, query):
+    async def info(self):
+        return await self.__es_object.info()
+
+    async def _search(self, query):
         # Search main database for query
         try:
-            videos_raw = await self.__es_object.search(index=self._etc_index, body=query)
+            async with metrics.track("es", "search"):
+                response = await self.__es_object.search(index=self._etc_index, body=query)
 
-            videos_raw = videos_raw['hits']['hits']
+            videos_raw = response['hits']['hits']
+            if len(videos_raw) == 1:
+                top_hits = response.get('aggregations', {}).get(SINGLE_HIT_AGG, {}).get('hits', {}).get('hits', [])
+                if len(top_hits) == 1 and top_hits[0]['_id'] == videos_raw[0]['_id']:
+                    videos_raw[0]['_source'] = top_hits[0]['_source']
+
+            cursor = None
+            if len(videos_raw) > 0 and len(videos_raw) >= query.get('size', 10):
+                cursor = videos_raw[-1].get('sort')
 
             # Inject data about the videos from the other databases
-            for index, item in enumerate(videos_raw):
-                video_id = item['_source']['id']
-
-                reupload_vid = await self.get_reupload_vid(video_id)
-                local_yt_vid = await self.get_archived_vid(video_id)
-
-                if len(reupload_vid) > 0:
-                    videos_raw[index]['_source'].update({'on_youtube': True, 'reupload_url': f"https://www.youtube.com/watch?v={reupload_vid['id']}"})
-                if len(local_yt_vid) > 0:
-                    videos_raw[index]['_source'].update({'archived': True,
-                                   'local_quality_width': local_yt_vid['width'],
-                                    'local_quality_height': local_yt_vid['height']})
-            return await self._convert_to_etcvideo(videos_raw)
+            await self._enrich(videos_raw)
+            return await self._convert_to_etcvideo(videos_raw), cursor
         except ValueError:
             log.error("KeyError while searching database")
 
-        return []
+        return [], None
+
+    async def _enrich(self, videos_raw: list):
+        """
+
+        Inject reupload and archive data into the raw hits.
+
+        All the hit ids are resolved against the youtube and local indexes with
+        one batched request per index, instead of 2 requests per hit.
+        If the in-memory enrichment map is loaded and fresh, no requests are made at all.
+
+        """
+        video_ids = list(dict.fromkeys(item['_source']['id'] for item in videos_raw))
+        if len(video_ids) == 0:
+            return videos_raw
+
+        if self._enrichment is not None and self._enrichment.is_ready():
+            reupload_vids, local_yt_vids = self.__lookup_enrichment(video_ids)
+        else:
+            reupload_vids, local_yt_vids = await asyncio.gather(self.get_reupload_vids(video_ids),
+                                                                self.get_archived_vids(video_ids))
+
+        for item in videos_raw:
+            video_id = item['_source']['id']
+            reupload_vid = reupload_vids.get(video_id, {})
+            local_yt_vid = local_yt_vids.get(video_id, {})
+
+            if len(reupload_vid) > 0:
+                item['_source'].update({'on_youtube': True, 'reupload_url': f"https://www.youtube.com/watch?v={reupload_vid['id']}"})
+            if len(local_yt_vid) > 0:
+                item['_source'].update({'archived': True,
+                                        'local_quality_width': local_yt_vid['width'],
+                                        'local_quality_height': local_yt_vid['height']})
+        return videos_raw
+
+    def __lookup_enrichment(self, video_ids: list):
+        reupload_vids = {}
+        local_yt_vids = {}
+        for video_id in video_ids:
+            reupload_id, quality = self._enrichment.lookup(video_id)
+            if reupload_id is not None:
+                reupload_vids[video_id] = {'id': reupload_id}
+            if quality is not None:
+                local_yt_vids[video_id] = {'width': quality[0], 'height': quality[1]}
+        return reupload_vids, local_yt_vids
+
+    async def load_enrichment_map(self):
+        """
+        Stream both the youtube and local indexes into a new enrichment map, and swap it in once complete.
+        """
+        enrichment = EnrichmentMap(max_memory_mb=self._enrichment_config.get('max_memory_mb', 64),
+                                   max_age=self._enrichment_config.get('max_age', 1800))
+        if await self.__stream_enrichment(enrichment, incremental=False):
+            enrichment.mark_loaded(full=True)
+            self._enrichment = enrichment
+            log.info(f"Loaded enrichment map: {len(enrichment.reuploads)} reuploads, "
+                     f"{len(enrichment.archived)} archived, ~{enrichment.memory_bytes()} bytes")
+        else:
+            self._enrichment = None
+
+    async def refresh_enrichment_map(self):
+        """
+        Add documents that have changed since the last pass to the current enrichment map.
+        Requires enrichment_map.changed_field, otherwise a full reload is done.
+        Deleted documents are only dropped by a full reload, done if an index has fewer documents than
+        at the last pass, and at least every full_refresh_interval.
+        """
+        if self._enrichment is None or not self._enrichment_config.get('changed_field'):
+            return await self.load_enrichment_map()
+        full_refresh_interval = self._enrichment_config.get('full_refresh_interval', ENRICHMENT_FULL_REFRESH_INTERVAL_S)
+        if time.monotonic() - self._enrichment.full_loaded_at >= full_refresh_interval:
+            return await self.load_enrichment_map()
+        if await self.__enrichment_documents_deleted(self._enrichment):
+            log.info("Documents were deleted from the reupload/archive indexes, reloading the enrichment map")
+            return await self.load_enrichment_map()
+
+        if await self.__stream_enrichment(self._enrichment, incremental=True):
+            self._enrichment.mark_loaded()
+        else:
+            self._enrichment = None
+
+    async def __enrichment_documents_deleted(self, enrichment: EnrichmentMap):
+        for index in (self._youtube_index, self._local_index):
+            count = await self.get_count(index)
+            if count < enrichment.doc_counts.get(index, 0):
+                return True
+            enrichment.doc_counts[index] = count
+        return False
+
+    async def __stream_enrichment(self, enrichment: EnrichmentMap, incremental: bool):
+        changed_field = self._enrichment_config.get('changed_field')
+        if not incremental:
+            # counted before streaming, so documents added meanwhile can only make the next count higher
+            enrichment.doc_counts = {index: await self.get_count(index) for index in (self._youtube_index, self._local_index)}
+
+        for index, source_fields in ((self._youtube_index, ['original_id', 'id']),
+                                     (self._local_index, ['id', 'width', 'height'])):
+            query = None
+            if changed_field:
+                source_fields = source_fields + [changed_field]
+                if incremental and index in enrichment.last_change:
+                    query = {"range": {changed_field: {"gt": enrichment.last_change[index]}}}
+
+            documents = self.iter_documents(index=index, query=query, source=source_fields)
+            async for hit in documents:
+                source = hit['_source']
+                try:
+                    if index == self._youtube_index:
+                        enrichment.add_reupload(source['original_id'], source['id'])
+                    else:
+                        enrichment.add_archived(source['id'], source['width'], source['height'])
+                except KeyError:
+                    continue
+
+                if changed_field and source.get(changed_field) is not None:
+                    last = enrichment.last_change.get(index)
+                    if last is None or source[changed_field] > last:
+                        enrichment.last_change[index] = source[changed_field]
+
+                if enrichment.overflowed:
+                    await documents.aclose()
+                    return False
+        return True
+
+    async def start_enrichment_refresher(self):
+        """
+        Load the enrichment map and keep it refreshed. Searches fall back to
+        live queries whenever the map is not loaded or is older than max_age.
+        """
+        refresh_interval = self._enrichment_config.get('refresh_interval', 600)
+        while True:
+            try:
+                await self.refresh_enrichment_map()
+            except Exception as e:
+                log.error(f"Failed to refresh enrichment map: {e}")
+            await asyncio.sleep(refresh_interval)
+
+    async def get_reupload_vids(self, video_ids: list):
+        """
+        Batched get_reupload_vid. Returns {video_id: reupload video} for the ids that have one.
+        """
+        return await self.__first_hit_by_id(index=self._youtube_index, field="original_id", video_ids=video_ids)
+
+    async def get_archived_vids(self, video_ids: list):
+        """
+        Batched get_archived_vid. Returns {video_id: archived video} for the ids that have one.
+        """
+        return await self.__first_hit_by_id(index=self._local_index, field="id", video_ids=video_ids)
+
+    async def __first_hit_by_id(self, index, field, video_ids: list):
+        # One msearch round trip, with the same per-id query (and first hit) as the single lookups
+        if len(video_ids) == 0:
+            return {}
+        list_of_queries = []
+        for video_id in video_ids:
+            list_of_queries.append({"index": index})
+            list_of_queries.append({"size": 1, "query": {"match_phrase": {field: video_id}}})
+
+        async with metrics.track("es", "first_hit_by_id"):
+            data = await self.__es_object.msearch(body=list_of_queries)
+
+        found = {}
+        for video_id, response in zip(video_ids, data['responses']):
+            try:
+                found[video_id] = response['hits']['hits'][0]['_source']
+            except (KeyError, IndexError):
+                continue
+        return found
 
     # Returns the reupload video
     # Note: this will return 1 result only
     async def get_reupload_vid(self, video_id):
         try:
-            s = await self.__es_object.search(index=self._youtube_index, body={'query': {'match_phrase': {"original_id": video_id}}})
+            async with metrics.track("es", "get_reupload_vid"):
+                s = await self.__es_object.search(index=self._youtube_index, body={'query': {'match_phrase': {"original_id": video_id}}})
             return s['hits']['hits'][0]['_source']
         except (KeyError, IndexError):
             return {}
 
     async def get_archived_vid(self, video_id):
         try:
-            s = await self.__es_object.search(index=self._local_index, body={'query': {'match_phrase': {"id": video_id}}})
+            async with metrics.track("es", "get_archived_vid"):
+                s = await self.__es_object.search(index=self._local_index, body={'query': {'match_phrase': {"id": video_id}}})
             return s['hits']['hits'][0]['_source']
         except (KeyError, IndexError):
             return {}
 
-    @staticmethod
-    async def _convert_to_etcvideo(videos: list):
-        return [ETCVideo(**v['_source']) for v in videos]
+    async def iter_documents(self, index, query=None, source=None, page_size=ITER_PAGE_SIZE):
+        """
 
-    async def get_stats(self, phrases=None):
+        Iterate over every document matching query, in constant memory.
 
-        if phrases is None:
-            phrases = []
-        # Generates statistics about the database
-        total_db = await self.get_count(index=self._etc_index)
-        total_reuploaded = await self.get_count(index=self._youtube_index)
-        total_classic = await self.get_count_by_field(index=self._local_index, field="collection", phrase="Classic ETC")
-        total_modern = await self.get_count_by_field(index=self._local_index, field="collection", phrase="Modern ETC")
+        Pages through a point in time with search_after, falling back to a scroll
+        if the cluster doesn't support point in time. Not limited to 10,000 hits.
 
-        num_video_archived = total_classic + total_modern
+        query: the query clause (defaults to match_all)
+        source: _source projection, e.g ['id']
 
-        phrase_stats = {}
+        """
+        if query is None:
+            query = {"match_all": {}}
 
-        for phrase in set(phrases):
-            phrase_stats[phrase] = await self.get_stats_by_phrase(phrase)
+        try:
+            async with metrics.track("es", "iter_documents"):
+                pit = await self.__es_object.open_point_in_time(index=index, keep_alive=ITER_KEEP_ALIVE)
+        except (AttributeError, TransportError) as e:
+            log.debug(f"Point in time not available ({e}), falling back to scroll")
+            async for hit in async_scan(self.__es_object, index=index, query={"query": query},
+                                        _source=source, size=page_size):
+                yield hit
+            return
+
+        pit_id = pit['id']
+        search_after = None
+        try:
+            while True:
+                body = {"size": page_size, "query": query, "sort": ["_shard_doc"],
+                        "pit": {"id": pit_id, "keep_alive": ITER_KEEP_ALIVE}}
+                if source is not None:
+                    body["_source"] = source
+                if search_after is not None:
+                    body["search_after"] = search_after
+
+                async with metrics.track("es", "iter_documents"):
+                    page = await self.__es_object.search(body=body)
+                pit_id = page.get('pit_id', pit_id)
+                hits = page['hits']['hits']
+                for hit in hits:
+                    yield hit
+
+                if len(hits) < page_size:
+                    break
+                search_after = hits[-1]['sort']
+        finally:
+            try:
+                async with metrics.track("es", "iter_documents"):
+                    await self.__es_object.close_point_in_time(body={"id": pit_id})
+            except TransportError:
+                log.debug("Failed to close point in time")
+
+    async def _get_stats(self, phrases=None):
+        """
+
+        Generates statistics about the database, from aggregations only:
+        the totals of every index, phrase and of the modern ETC main channel videos in one msearch,
+        the ids matching each phrase (paged composite aggregations), then how many youtube and local documents
+        each of those ids has (terms aggregations).
+
+        """
+        if phrases is None:
+            phrases = []
+        phrases = sorted(set(phrases))
+        queries = [{"match_phrase": {'title': phrase}} for phrase in phrases] + [MODERN_ETC_MAIN_CHANNEL_QUERY]
+
+        responses = await self.__msearch_counts(
+            [(self._etc_index, self.__count_body(query)) for query in queries] + [
+                (self._etc_index, {"size": 0, "track_total_hits": True}),
+                (self._youtube_index, {"size": 0, "track_total_hits": True}),
+                (self._local_index, {"size": 0, "aggs": {"collection": {"filters": {"filters": {
+                    collection: {"match_phrase": {"collection": collection}} for collection in ("Classic ETC", "Modern ETC")}}}}})
+            ])
+        query_totals = [response['hits']['total']['value'] for response in responses[:len(queries)]]
+        main_db, yt_db, local_db = responses[len(queries):]
+        main_counts = await asyncio.gather(*(self.__id_doc_counts(self._etc_index, query) for query in queries))
+        reupload_counts, archive_counts = await self.__id_counts(set().union(*main_counts))
+
+        total_classic = local_db['aggregations']['collection']['buckets']['Classic ETC']['doc_count']
+        total_modern = local_db['aggregations']['collection']['buckets']['Modern ETC']['doc_count']
 
-        pure_modern_etc_archived = await self.modern_etc_main_channel()
         return {
-            'total': total_db,
-            'total_archived': num_video_archived,
-            'total_reuploaded': total_reuploaded,
+            'total': main_db['hits']['total']['value'],
+            'total_archived': total_classic + total_modern,
+            'total_reuploaded': yt_db['hits']['total']['value'],
             'total_classic': total_classic,
             'total_modern': total_modern,
-            'pure_modern_etc_archived': pure_modern_etc_archived,
-            'phrase': phrase_stats
+            'pure_modern_etc_archived': (self.__archived(main_counts[-1], archive_counts), query_totals[-1]),
+            'phrase': {phrase: self.__phrase_stats(total, counts, reupload_counts, archive_counts)
+                       for phrase, total, counts in zip(phrases, query_totals, main_counts)}
         }
 
     async def get_stats_by_phrase(self, phrase: str):
@@ -113,139 +366,131 @@ class ETCDatabase:
         2. Get number of videos in youtube db by those id [total uploaded to yt]
         3. Get number of videos in local db by those ids [total archived]
 
-        returns a tuple
-        (total, total_yt, total_archived)
+        returns a dict
+        {total, total_reuploaded, total_archived}
         """
         log.info(f"Getting stats for phrase {phrase}")
-        videos_main_db = await self.__es_object.search(index=self._etc_index, size=10000, body={"_source": ['id'], "query": {
-            "match_phrase": {'title': phrase}}})
-
-        videos_yt_db = await self.multi_search(index=self._youtube_index, field="original_id",
-                                    items=[a['_source']['id'] for a in videos_main_db['hits']['hits']])
-
-        videos_lcl_db = await self.multi_search(index=self._local_index, field="id",
-                                    items=list(set([a['_source']['id'] for a in videos_main_db['hits']['hits']])))
-        videos_on_yt = 0
-        for response in videos_yt_db['responses']:
-            videos_on_yt += response['hits']['total']['value']
-
-        videos_archived = 0
-        hits = []
-        for a in videos_lcl_db['responses']:
-            if a['hits']['total']['value'] == 1:
-                try:
-                    hits.append(a['hits']['hits'][0]['_source']['id'])
-                except KeyError:
-                    raise KeyError
-        videos_archived += len(set(hits))
+        query = {"match_phrase": {'title': phrase}}
+        (main_db,), main_counts = await asyncio.gather(self.__msearch_counts([(self._etc_index, self.__count_body(query))]),
+                                                       self.__id_doc_counts(self._etc_index, query))
+        reupload_counts, archive_counts = await self.__id_counts(set(main_counts))
+        return self.__phrase_stats(main_db['hits']['total']['value'], main_counts, reupload_counts, archive_counts)
 
-        return {'total': videos_main_db['hits']['total']['value'], 'total_reuploaded': videos_on_yt, 'total_archived':videos_archived}
+    async def modern_etc_main_channel(self):
+        """
+        Returns a tuple of (archived, total) videos uploaded to the main ETC channel in the modern era
+        """
+        query = MODERN_ETC_MAIN_CHANNEL_QUERY
+        (main_db,), main_counts = await asyncio.gather(self.__msearch_counts([(self._etc_index, self.__count_body(query))]),
+                                                       self.__id_doc_counts(self._etc_index, query))
+        _, archive_counts = await self.__id_counts(set(main_counts))
+        return self.__archived(main_counts, archive_counts), main_db['hits']['total']['value']
 
-    async def multi_search(self, index, field, items: list):
-        if len(items) == 0:
-            return []
-        list_of_queries = []
-        for thing in items:
-            list_of_queries.append({"index": index})
-            list_of_queries.append({"_source": True, "query": {"match_phrase": {field: thing}}})
+    async def get_membership_ids(self):
+        """
+        Returns a tuple of (ids of videos reuploaded to youtube, ids of videos archived locally).
+        Uses the enrichment map when available, otherwise only the id fields are streamed from the indexes.
+        """
+        if self._enrichment is not None and self._enrichment.is_ready():
+            return set(self._enrichment.reuploads), set(self._enrichment.archived)
+
+        reuploaded_ids = set()
+        async for hit in self.iter_documents(index=self._youtube_index, source=['original_id']):
+            reuploaded_ids.add(hit['_source'].get('original_id'))
 
-        return await self.__es_object.msearch(list_of_queries[:-1])
+        archived_ids = set()
+        async for hit in self.iter_documents(index=self._local_index, source=['id']):
+            archived_ids.add(hit['_source'].get('id'))
+
+        reuploaded_ids.discard(None)
+        archived_ids.discard(None)
+        return reuploaded_ids, archived_ids
+
+    async def iter_videos(self, source=None):
+        async for hit in self.iter_documents(index=self._etc_index, source=source):
+            yield hit['_source']
+
+    @staticmethod
+    def __count_body(query):
+        return {"size": 0, "track_total_hits": True, "query": query}
+
+    async def __id_doc_counts(self, index, query):
+        """
+        Returns {video id: number of documents} for the documents of index matching query,
+        paging through a composite aggregation on the keyword id (not limited to 10,000 hits)
+        """
+        counts = {}
+        after = None
+        while True:
+            composite = {"size": STATS_ID_PAGE_SIZE, "sources": [{"id": {"terms": {"field": ID_KEYWORD_FIELD}}}]}
+            if after is not None:
+                composite["after"] = after
+            async with metrics.track("es", "stats"):
+                response = await self.__es_object.search(index=index, body={"size": 0, "query": query,
+                                                                            "aggs": {"ids": {"composite": composite}}})
+            aggregation = response['aggregations']['ids']
+            for bucket in aggregation['buckets']:
+                counts[bucket['key']['id']] = bucket['doc_count']
+            after = aggregation.get('after_key')
+            if after is None or len(aggregation['buckets']) < STATS_ID_PAGE_SIZE:
+                return counts
+
+    @staticmethod
+    def __id_counts_body(field, video_ids: list):
+        return {"size": 0, "query": {"terms": {field: video_ids}},
+                "aggs": {"ids": {"terms": {"field": field, "size": len(video_ids)}}}}
+
+    async def __id_counts(self, video_ids: set):
+        """
+        Returns ({video id: number of youtube reuploads}, {video id: number of local documents}) for video_ids.
+        Ids without any document are left out.
+        """
+        reupload_counts = {}
+        archive_counts = {}
+        if len(video_ids) == 0:
+            return reupload_counts, archive_counts
+        video_ids = sorted(video_ids)
+        searches = []
+        for i in range(0, len(video_ids), STATS_TERMS_BATCH):
+            batch = video_ids[i:i + STATS_TERMS_BATCH]
+            searches.append((self._youtube_index, self.__id_counts_body(REUPLOAD_ORIGINAL_ID_FIELD, batch)))
+            searches.append((self._local_index, self.__id_counts_body(ID_KEYWORD_FIELD, batch)))
+        responses = await self.__msearch_counts(searches)
+        for i, response in enumerate(responses):
+            counts = reupload_counts if i % 2 == 0 else archive_counts
+            for bucket in response['aggregations']['ids']['buckets']:
+                counts[bucket['key']] = bucket['doc_count']
+        return reupload_counts, archive_counts
+
+    @staticmethod
+    def __archived(main_counts, archive_counts):
+        # An id with several local documents is ambiguous, and isn't counted as archived
+        return sum(1 for video_id in main_counts if archive_counts.get(video_id) == 1)
+
+    def __phrase_stats(self, total, main_counts, reupload_counts, archive_counts):
+        # every main document of an id counts the reuploads of that id
+        return {'total': total,
+                'total_reuploaded': sum(count * reupload_counts.get(video_id, 0) for video_id, count in main_counts.items()),
+                'total_archived': self.__archived(main_counts, archive_counts)}
+
+    async def __msearch_counts(self, searches: list):
+        body = []
+        for index, query in searches:
+            body.append({"index": index})
+            body.append(query)
+        async with metrics.track("es", "stats"):
+            data = await self.__es_object.msearch(body=body)
+        for response in data['responses']:
+            if 'error' in response:
+                raise ValueError(f"Error while getting stats from database: {response['error']}")
+        return data['responses']
 
     async def get_count_by_field(self, index, field, phrase):
-        data = await self.__es_object.count(index=index, body={'query': {'match_phrase': {field: phrase}}})
+        async with metrics.track("es", "get_count_by_field"):
+            data = await self.__es_object.count(index=index, body={'query': {'match_phrase': {field: phrase}}})
         return data['count']
 
     async def get_count(self, index):
-        data = await self.__es_object.cat.count(index=index, params={"format": "json"})
+        async with metrics.track("es", "get_count"):
+            data = await self.__es_object.cat.count(index=index, params={"format": "json"})
         return int(data[0]['count'])
-
-    async def get_date_range_query(self, date_epoch, range):
-        query = {"range": {"date_published": {"format": "epoch_second", "gte": f"{date_epoch - (math.floor(range/2) * 86400)}", "lte": f"{date_epoch + (math.ceil(range/2)*86400)}"}}}
-        return query
-
-    async def modern_etc_main_channel(self):
-        query = {"query": {
-            "bool": {
-                "filter": [
-                    {
-                        "bool": {
-                            "should": [
-                                {
-                                    "bool": {
-                                        "should": [
-                                            {
-                                                "match_phrase": {
-                                                    "uploader_ids": "MachinimaETC"
-                                                }
-                                            }
-                                        ],
-                                        "minimum_should_match": 1
-                                    }
-                                },
-                                {
-                                    "bool": {
-                                        "should": [
-                                            {
-                                                "bool": {
-                                                    "should": [
-                                                        {
-                                                            "match_phrase": {
-                                                                "uploader_ids": "UCdIaNUarhzLSXGoItz7BHVA"
-                                                            }
-                                                        }
-                                                    ],
-                                                    "minimum_should_match": 1
-                                                }
-                                            },
-                                            {
-                                                "bool": {
-                                                    "should": [
-                                                        {
-                                                            "match_phrase": {
-                                                                "uploader": "etc show"
-                                                            }
-                                                        }
-                                                    ],
-                                                    "minimum_should_match": 1
-                                                }
-                                            }
-                                        ],
-                                        "minimum_should_match": 1
-                                    }
-                                }
-                            ],
-                            "minimum_should_match": 1
-                        }
-                    },
-                    {
-                        "range": {
-                            "date_published": {
-                                "format": "strict_date_optional_time",
-                                "gte": "2014-06-01T00:00:00.000Z",
-                                "lte": "2019-01-24T23:21:13.800Z"
-                            }
-                        }
-                    }
-                ],
-            }
-        }}
-
-        videos_main_db = await self.__es_object.search(index=self._etc_index, size=10000,
-                                                       body={"_source": ['id'], **query})
-
-        videos_main_db_set = [a['_source']['id'] for a in videos_main_db['hits']['hits']]
-        videos_lcl_db = await self.multi_search(index=self._local_index, field="id",
-                                                items=videos_main_db_set)
-
-        hits = []
-        try:
-            for a in videos_lcl_db['responses']:
-                if a['hits']['total']['value'] == 1:
-                    try:
-                        hits.append(a['hits']['hits'][0]['_source']['id'])
-                    except KeyError:
-                        raise KeyError
-        except TypeError:
-            pass
-
-        return len(set(hits)), len(videos_main_db_set)
\ No newline at end of file
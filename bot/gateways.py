@@ -0,0 +1,113 @@
+import asyncio
+import aiohttp
+import logging
+import random
+import time
+log = logging.getLogger("root")
+
+"""
+
+Picks the public IPFS gateway used for thumbnail links.
+
+Each gateway is probed periodically by fetching a known small CID. The latency (EWMA) and error rate
+of the probes are tracked per gateway, and a gateway that keeps failing has its circuit opened
+(it is not handed out) until a probe succeeds again.
+
+"""
+
+TRUSTED_PUBLIC_IPFS_GATEWAYS = ("https://ipfs.io", "https://dweb.link", "https://gateway.ipfs.io", "https://cloudflare-ipfs.com")
+PROBE_CID = "QmUNLLsPACCz1vLxQVkXqqLX5R1X345qqfHbsf67hvA3Nn"  # empty directory
+PROBE_INTERVAL_S = 300
+PROBE_TIMEOUT_S = 5
+EWMA_ALPHA = 0.3
+FAILURE_THRESHOLD = 3
+
+
+class GatewayStats:
+
+    def __init__(self, url):
+        self.url = url
+        self.latency = None  # EWMA of successful probe latency, seconds
+        self.error_rate = 0.0  # EWMA of probe failures
+        self.consecutive_failures = 0
+        self.probes = 0
+        self.failures = 0
+        self.last_probe = None
+
+    def is_open(self):
+        return self.consecutive_failures >= FAILURE_THRESHOLD
+
+    def record(self, latency=None):
+        """
+        Record a probe result. latency is None if the probe failed.
+        """
+        self.probes += 1
+        self.last_probe = time.time()
+        failed = latency is None
+        self.error_rate = EWMA_ALPHA * (1.0 if failed else 0.0) + (1 - EWMA_ALPHA) * self.error_rate
+        if failed:
+            self.failures += 1
+            self.consecutive_failures += 1
+            if self.consecutive_failures == FAILURE_THRESHOLD:
+                log.warning(f"IPFS gateway {self.url} failed {FAILURE_THRESHOLD} probes in a row, opening circuit")
+            return
+        if self.is_open():
+            log.info(f"IPFS gateway {self.url} is responding again, closing circuit")
+        self.consecutive_failures = 0
+        self.latency = latency if self.latency is None else EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * self.latency
+
+    def score(self):
+        # Lower is better. Errors are charged as if the request had timed out.
+        return self.latency * (1 - self.error_rate) + PROBE_TIMEOUT_S * self.error_rate
+
+    def as_dict(self):
+        return {'url': self.url, 'latency': self.latency, 'error_rate': round(self.error_rate, 3),
+                'open': self.is_open(), 'probes': self.probes, 'failures': self.failures, 'last_probe': self.last_probe}
+
+
+class GatewaySelector:
+
+    def __init__(self, gateways=TRUSTED_PUBLIC_IPFS_GATEWAYS, probe_cid=PROBE_CID,
+                 probe_interval=PROBE_INTERVAL_S, probe_timeout=PROBE_TIMEOUT_S):
+        self.__gateways = {url.rstrip("/"): GatewayStats(url.rstrip("/")) for url in gateways}
+        self.probe_cid = probe_cid
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+
+    async def probe(self, session: aiohttp.ClientSession, gateway: GatewayStats):
+        start = time.monotonic()
+        try:
+            async with session.get(f"{gateway.url}/ipfs/{self.probe_cid}",
+                                   timeout=aiohttp.ClientTimeout(total=self.probe_timeout)) as response:
+                await response.read()
+                if response.status >= 400:
+                    raise aiohttp.ClientResponseError(response.request_info, response.history, status=response.status)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            log.debug(f"Probe of IPFS gateway {gateway.url} failed: {e!r}")
+            gateway.record(None)
+            return
+        gateway.record(time.monotonic() - start)
+
+    async def probe_all(self):
+        async with aiohttp.ClientSession() as session:
+            await asyncio.gather(*[self.probe(session, gateway) for gateway in self.__gateways.values()])
+
+    async def start_prober(self):
+        while True:
+            await self.probe_all()
+            log.debug(f"IPFS gateway stats: {self.stats()}")
+            await asyncio.sleep(self.probe_interval)
+
+    def best(self):
+        """
+        Returns the gateway with the best score with a closed circuit.
+        Before any probe has succeeded (or if every circuit is open), a random gateway is returned.
+        """
+        candidates = [g for g in self.__gateways.values() if not g.is_open() and g.latency is not None]
+        if len(candidates) == 0:
+            candidates = [g for g in self.__gateways.values() if not g.is_open()] or list(self.__gateways.values())
+            return random.choice(candidates).url
+        return min(candidates, key=lambda g: g.score()).url
+
+    def stats(self):
+        return [gateway.as_dict() for gateway in self.__gateways.values()]
@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+log = logging.getLogger('root')
+
+"""
+
+Small key-value stores, used to hold bot state that can be shared between bot processes.
+
+Values are strings, grouped by namespace. Entries can have a TTL, and evict() trims a namespace
+down to a maximum entry count/total size, least recently used first. As evict() goes through the whole
+namespace, callers evict every EVICT_EVERY_SETS sets rather than after each one.
+
+Reads (get, contains, stats) are plain methods, writes are coroutines.
+
+MemoryKVStore is local to the process. SQLiteKVStore keeps everything in a local SQLite file,
+so every process pointed at the same file shares the same entries. Its reads don't write: (in WAL mode)
+they never wait for another process's write, and the access times they update are written in batches.
+Its writes run on a thread of their own, so waiting for another process's write lock doesn't block the event loop.
+
+acquire_lease() takes or renews a named lease for an owner, e.g to elect one process to run a task (see leader).
+
+"""
+
+LEASE_NAMESPACE = "leases"
+ACCESS_FLUSH_SIZE = 256  # access times kept in memory by SQLiteKVStore before being written along with a set()
+EVICT_EVERY_SETS = 64
+
+
+class MemoryKVStore:
+
+    def __init__(self):
+        self.__namespaces = {}
+
+    def __namespace(self, namespace):
+        return self.__namespaces.setdefault(namespace, OrderedDict())
+
+    def get(self, namespace, key):
+        entries = self.__namespace(namespace)
+        try:
+            value, expires_at = entries[key]
+        except KeyError:
+            return None
+        if expires_at is not None and expires_at <= time.time():
+            del entries[key]
+            return None
+        entries.move_to_end(key)
+        return value
+
+    def contains(self, namespace, key):
+        entry = self.__namespace(namespace).get(key)
+        return entry is not None and (entry[1] is None or entry[1] > time.time())
+
+    async def set(self, namespace, key, value: str, ttl=None):
+        entries = self.__namespace(namespace)
+        entries.pop(key, None)
+        entries[key] = (value, None if ttl is None else time.time() + ttl)
+
+    async def delete(self, namespace, key):
+        return self.__namespace(namespace).pop(key, None) is not None
+
+    async def clear(self, namespace):
+        self.__namespace(namespace).clear()
+
+    async def evict(self, namespace, max_entries=None, max_bytes=None):
+        """
+        Remove expired entries, then the least recently used entries until within the limits.
+        Returns the evicted keys.
+        """
+        entries = self.__namespace(namespace)
+        now = time.time()
+        evicted = [key for key, (_, expires_at) in entries.items() if expires_at is not None and expires_at <= now]
+        for key in evicted:
+            del entries[key]
+
+        total_bytes = sum(len(value) for value, _ in entries.values()) if max_bytes is not None else 0
+        while len(entries) > 0 and ((max_entries is not None and len(entries) > max_entries) or
+                                    (max_bytes is not None and total_bytes > max_bytes)):
+            key, (value, _) = entries.popitem(last=False)
+            total_bytes -= len(value)
+            evicted.append(key)
+        return evicted
+
+    async def acquire_lease(self, name, owner, ttl):
+        """
+        Take the lease if it is free or expired, or renew it if owner holds it. Returns whether owner holds it.
+        """
+        holder = self.get(LEASE_NAMESPACE, name)
+        if holder is not None and holder != owner:
+            return False
+        await self.set(LEASE_NAMESPACE, name, owner, ttl=ttl)
+        return True
+
+    async def release_lease(self, name, owner):
+        if self.get(LEASE_NAMESPACE, name) == owner:
+            await self.delete(LEASE_NAMESPACE, name)
+
+    def stats(self, namespace):
+        entries = self.__namespace(namespace)
+        return {'entries': len(entries), 'bytes': sum(len(value) for value, _ in entries.values())}
+
+
+class SQLiteKVStore:
+
+    def __init__(self, path):
+        self.path = path
+        self.__conn = self.__connect(path)
+        self.__conn.execute("PRAGMA journal_mode=WAL")
+        self.__conn.execute("CREATE TABLE IF NOT EXISTS kv (namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+                            "expires_at REAL, accessed_at REAL NOT NULL, PRIMARY KEY (namespace, key))")
+        self.__conn.execute("CREATE INDEX IF NOT EXISTS kv_accessed_at ON kv (namespace, accessed_at)")
+        # writes are only made from the writer thread, one at a time and in order
+        self.__write_conn = self.__connect(path)
+        self.__writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="kvstore-writer")
+        self.__accessed = {}  # (namespace, key) -> last read time, not written yet
+
+    @staticmethod
+    def __connect(path):
+        return sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+
+    async def __write(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.__writer, fn, *args)
+
+    def get(self, namespace, key):
+        now = time.time()
+        row = self.__conn.execute("SELECT value FROM kv WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                                  (namespace, key, now)).fetchone()
+        if row is None:
+            return None
+        self.__accessed[(namespace, key)] = now
+        return row[0]
+
+    def __take_accessed(self):
+        accessed, self.__accessed = self.__accessed, {}
+        return accessed
+
+    def __flush_accessed(self, accessed):
+        if len(accessed) == 0:
+            return
+        self.__write_conn.executemany("UPDATE kv SET accessed_at = MAX(accessed_at, ?) WHERE namespace = ? AND key = ?",
+                                      [(accessed_at, namespace, key) for (namespace, key), accessed_at in accessed.items()])
+
+    def contains(self, namespace, key):
+        return self.__conn.execute("SELECT 1 FROM kv WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                                   (namespace, key, time.time())).fetchone() is not None
+
+    async def set(self, namespace, key, value: str, ttl=None):
+        now = time.time()
+        self.__accessed.pop((namespace, key), None)
+        accessed = self.__take_accessed() if len(self.__accessed) >= ACCESS_FLUSH_SIZE else {}
+        await self.__write(self.__set, accessed, (namespace, key, value, None if ttl is None else now + ttl, now))
+
+    def __set(self, accessed, row):
+        self.__flush_accessed(accessed)
+        self.__write_conn.execute("INSERT OR REPLACE INTO kv VALUES (?, ?, ?, ?, ?)", row)
+
+    async def delete(self, namespace, key):
+        return await self.__write(self.__execute, "DELETE FROM kv WHERE namespace = ? AND key = ?", (namespace, key))
+
+    async def clear(self, namespace):
+        await self.__write(self.__execute, "DELETE FROM kv WHERE namespace = ?", (namespace,))
+
+    def __execute(self, sql, params):
+        # whether any row changed
+        return self.__write_conn.execute(sql, params).rowcount > 0
+
+    async def evict(self, namespace, max_entries=None, max_bytes=None):
+        # the buffered access times are written first, so least recently used is up to date
+        return await self.__write(self.__evict, self.__take_accessed(), namespace, max_entries, max_bytes)
+
+    def __evict(self, accessed, namespace, max_entries, max_bytes):
+        self.__flush_accessed(accessed)
+        evicted = [key for key, in self.__write_conn.execute("SELECT key FROM kv WHERE namespace = ? AND expires_at IS NOT NULL AND expires_at <= ?",
+                                                             (namespace, time.time()))]
+        if max_entries is not None or max_bytes is not None:
+            rows = self.__write_conn.execute("SELECT key, LENGTH(value) FROM kv WHERE namespace = ? AND (expires_at IS NULL OR expires_at > ?) "
+                                             "ORDER BY accessed_at DESC", (namespace, time.time())).fetchall()
+            total_bytes = 0
+            for count, (key, size) in enumerate(rows, start=1):
+                total_bytes += size
+                if (max_entries is not None and count > max_entries) or (max_bytes is not None and total_bytes > max_bytes):
+                    evicted.append(key)
+        if len(evicted) > 0:
+            self.__write_conn.executemany("DELETE FROM kv WHERE namespace = ? AND key = ?", [(namespace, key) for key in evicted])
+        return evicted
+
+    async def acquire_lease(self, name, owner, ttl):
+        # A single upsert, so two processes can't both take an expired lease
+        now = time.time()
+        return await self.__write(self.__execute, "INSERT INTO kv VALUES (?, ?, ?, ?, ?) ON CONFLICT (namespace, key) DO UPDATE SET "
+                                                  "value = excluded.value, expires_at = excluded.expires_at, accessed_at = excluded.accessed_at "
+                                                  "WHERE kv.value = excluded.value OR kv.expires_at <= ?",
+                                  (LEASE_NAMESPACE, name, owner, now + ttl, now, now))
+
+    async def release_lease(self, name, owner):
+        await self.__write(self.__execute, "DELETE FROM kv WHERE namespace = ? AND key = ? AND value = ?", (LEASE_NAMESPACE, name, owner))
+
+    def stats(self, namespace):
+        count, size = self.__conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0) FROM kv WHERE namespace = ?",
+                                          (namespace,)).fetchone()
+        return {'entries': count, 'bytes': size}
+
+
+def open_kv_store(path=None):
+    """
+    Returns a SQLiteKVStore at path, or a MemoryKVStore if no path is given
+    """
+    if path:
+        log.info(f"Using shared key-value store at {path}")
+        return SQLiteKVStore(path)
+    return MemoryKVStore()
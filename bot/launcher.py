@@ -0,0 +1,137 @@
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import sys
+import time
+import yaml
+log = logging.getLogger('root')
+
+"""
+
+Runs the bot as several worker processes, each connected to a range of the Discord shards.
+
+    python3 launcher.py --config /config/config.yml
+
+cluster.processes workers are started, splitting cluster.shard_count shards (default one per process) into
+contiguous ranges. A worker that exits is restarted, with an exponential backoff if it keeps exiting.
+The workers share their caches and elect the process running the IPNS checker through cluster.store.
+
+Each worker gets its shards and number through the environment (see const.SHARD_IDS), and serves
+its metrics on metrics.port + its number.
+
+"""
+
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")
+# Discord allows one shard to identify every 5 seconds, so the workers are started that far apart per shard
+IDENTIFY_INTERVAL_S = 5
+RESTART_BACKOFF_S = 1
+RESTART_BACKOFF_MAX_S = 300
+STABLE_RUN_S = 600  # a worker that ran this long is restarted without backoff
+STOP_TIMEOUT_S = 30
+
+
+def shard_ranges(shard_count, processes):
+    """
+    Split shard ids 0..shard_count-1 into processes contiguous ranges, as evenly as possible
+    """
+    ranges = []
+    start = 0
+    for i in range(processes):
+        size = shard_count // processes + (1 if i < shard_count % processes else 0)
+        ranges.append(list(range(start, start + size)))
+        start += size
+    return ranges
+
+
+class Worker:
+
+    def __init__(self, worker_id, shard_ids, shard_count, config_path):
+        self.worker_id = worker_id
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.config_path = config_path
+        self.process = None
+        self.restarts = 0
+        self.stopping = False
+
+    def environment(self):
+        env = dict(os.environ, BOT_WORKER_ID=str(self.worker_id))
+        if self.shard_count > 0:
+            env.update(BOT_SHARD_IDS=",".join(str(shard_id) for shard_id in self.shard_ids),
+                       BOT_SHARD_COUNT=str(self.shard_count))
+        return env
+
+    async def run(self, delay=0):
+        await asyncio.sleep(delay)
+        backoff = RESTART_BACKOFF_S
+        while not self.stopping:
+            started = time.monotonic()
+            self.process = await asyncio.create_subprocess_exec(sys.executable, BOT_SCRIPT, "--config", self.config_path,
+                                                                env=self.environment())
+            log.info(f"Started worker {self.worker_id} (pid {self.process.pid}, shards {self.shard_ids or 'all'})")
+            if self.stopping:
+                self.process.terminate()  # stopped while starting
+            code = await self.process.wait()
+            if self.stopping:
+                break
+            if time.monotonic() - started >= STABLE_RUN_S:
+                backoff = RESTART_BACKOFF_S
+            log.error(f"Worker {self.worker_id} exited with code {code}, restarting in {backoff}s")
+            self.restarts += 1
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, RESTART_BACKOFF_MAX_S)
+
+    async def stop(self):
+        self.stopping = True
+        if self.process is None or self.process.returncode is not None:
+            return
+        self.process.terminate()
+        try:
+            await asyncio.wait_for(self.process.wait(), timeout=STOP_TIMEOUT_S)
+        except asyncio.TimeoutError:
+            log.error(f"Worker {self.worker_id} did not stop in {STOP_TIMEOUT_S}s, killing it")
+            self.process.kill()
+
+
+async def main(config_path, config):
+    cluster_config = config.get('cluster', {})
+    processes = max(1, cluster_config.get('processes', 1))
+    shard_count = cluster_config.get('shard_count', 0) or (processes if processes > 1 else 0)
+    if 0 < shard_count < processes:
+        raise SystemExit(f"cluster.shard_count ({shard_count}) must be at least cluster.processes ({processes})")
+    if processes > 1 and not cluster_config.get('store'):
+        log.warning("Running several workers without cluster.store: every worker will resolve and pin the thumbnails")
+
+    ranges = shard_ranges(shard_count, processes) if shard_count > 0 else [[]]
+    workers = [Worker(worker_id, shard_ids, shard_count, config_path) for worker_id, shard_ids in enumerate(ranges)]
+
+    loop = asyncio.get_event_loop()
+    stopped = asyncio.Event()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signal_number, stopped.set)
+
+    delay = 0
+    tasks = []
+    for worker in workers:
+        tasks.append(asyncio.ensure_future(worker.run(delay)))
+        delay += IDENTIFY_INTERVAL_S * max(1, len(worker.shard_ids))
+
+    await stopped.wait()
+    log.info("Stopping workers...")
+    await asyncio.gather(*(worker.stop() for worker in workers))
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the bot as several sharded worker processes")
+    parser.add_argument("--config", help="Configuration file", required=True)
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+    logging.basicConfig(level=config['discord']['log_level'])
+    asyncio.get_event_loop().run_until_complete(main(args.config, config))
@@ -0,0 +1,92 @@
+import asyncio
+import logging
+import os
+import socket
+import sqlite3
+log = logging.getLogger('root')
+
+"""
+
+Elects one bot process to run the tasks that must only run once, e.g the IPNS checker and pinning.
+
+Every process tries to take (or renew) the same lease in the shared key-value store every renew_interval.
+The holder runs the leader role, the others run the follower role. If the leader stops renewing (it exited,
+or lost the store), another process takes over once the lease expires, after at most lease_ttl seconds.
+
+With a MemoryKVStore (a single process) the lease is always held.
+
+A role task that ends (e.g crashed) while its role is unchanged is restarted at the next renewal.
+
+"""
+
+LEASE_TTL_S = 30
+LEASE_NAME = "leader"
+
+
+def default_owner():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class LeaderElection:
+
+    def __init__(self, store, name=LEASE_NAME, owner=None, lease_ttl=LEASE_TTL_S, renew_interval=None):
+        """
+        renew_interval: seconds between lease renewals (default a third of lease_ttl)
+        """
+        self.__store = store
+        self.name = name
+        self.owner = default_owner() if owner is None else owner
+        self.lease_ttl = lease_ttl
+        self.renew_interval = lease_ttl / 3 if renew_interval is None else renew_interval
+        self.is_leader = False
+        self.elections_won = 0
+        self.role_restarts = 0
+
+    async def __acquire(self):
+        try:
+            return await self.__store.acquire_lease(self.name, self.owner, self.lease_ttl)
+        except sqlite3.Error as e:
+            # Can't renew: step down, as another process will take the lease once it expires
+            log.error(f"Failed to renew leader lease: {e}")
+            return False
+
+    async def run(self, leader, follower=None):
+        """
+        Run leader() while holding the lease and follower() otherwise (both coroutine functions, run until
+        cancelled). The running role is cancelled when the role changes, and restarted if it ends.
+        """
+        task = None
+        role = None
+        try:
+            while True:
+                is_leader = await self.__acquire()
+                if is_leader != role:
+                    if task is not None:
+                        task.cancel()
+                    role = self.is_leader = is_leader
+                    if is_leader:
+                        self.elections_won += 1
+                    log.info(f"{self.owner} is {'now' if is_leader else 'not'} the leader of {self.name}")
+                    coroutine = leader if is_leader else follower
+                    task = None if coroutine is None else asyncio.ensure_future(coroutine())
+                elif task is not None and task.done():
+                    self.__log_role_end(task, role)
+                    self.role_restarts += 1
+                    task = asyncio.ensure_future((leader if role else follower)())
+                await asyncio.sleep(self.renew_interval)
+        finally:
+            if task is not None:
+                task.cancel()
+            if self.is_leader:
+                self.is_leader = False
+                await self.__store.release_lease(self.name, self.owner)
+
+    def __log_role_end(self, task, role):
+        name = 'leader' if role else 'follower'
+        if not task.cancelled() and task.exception() is not None:
+            log.error(f"The {name} role of {self.name} crashed, restarting it", exc_info=task.exception())
+        else:
+            log.error(f"The {name} role of {self.name} ended, restarting it")
+
+    def stats(self):
+        return {'is_leader': int(self.is_leader), 'elections_won': self.elections_won, 'role_restarts': self.role_restarts}
@@ -0,0 +1,237 @@
+import asyncio
+import contextvars
+import logging
+import time
+from aiohttp import web
+log = logging.getLogger('root')
+
+try:
+    from opentelemetry import trace as otel_trace
+    from opentelemetry import context as otel_context
+except ImportError:
+    otel_trace = None
+    otel_context = None
+
+"""
+
+Metrics and tracing for commands and the calls they make to Elasticsearch and IPFS.
+
+    - etc_command_seconds{command}: latency histogram of each command
+    - etc_command_round_trips{command,backend}: requests made to each backend per command
+    - etc_command_errors_total{command}: commands that raised
+    - etc_call_seconds{backend,method}: latency histogram of each Elasticsearch/SQLite/IPFS request
+    - etc_call_errors_total{backend,method,error} / etc_call_timeouts_total{backend,method}
+    - etc_<component>_<stat>: anything returned by a registered stats() (cache hits/misses, coalesced calls, ...)
+
+They are served in the Prometheus text format by start_server(). The current command is kept in a context var,
+so every request made while handling it (including in tasks it starts) is counted as one of its round trips.
+Requests shared between commands (see SingleFlight) are counted for the command that started them.
+
+If tracing is enabled and opentelemetry is installed, each command is a span, with a child span per request.
+
+"""
+
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9464
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+ROUND_TRIP_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21)
+TRACER_NAME = "etc-archive-bot"
+
+_current_command = contextvars.ContextVar('current_command', default=None)
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield bound, total
+
+
+class CommandTrace:
+
+    def __init__(self, command):
+        self.command = command
+        self.start = time.monotonic()
+        self.round_trips = {}  # backend -> requests made
+        self.span = None
+        self.token = None
+        self.otel_token = None
+
+
+def _format_labels(labels):
+    if len(labels) == 0:
+        return ""
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+class Metrics:
+
+    def __init__(self, tracing=False):
+        self.__counters = {}  # (name, labels) -> value
+        self.__histograms = {}  # (name, labels) -> Histogram
+        self.__collectors = {}  # component -> stats() function
+        self.tracer = None
+        if tracing:
+            self.enable_tracing()
+
+    def enable_tracing(self):
+        if otel_trace is None:
+            log.warning("Tracing is enabled but opentelemetry is not installed, spans will not be recorded")
+            return
+        self.tracer = otel_trace.get_tracer(TRACER_NAME)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.__counters[key] = self.__counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.__histograms.get(key)
+        if histogram is None:
+            histogram = self.__histograms[key] = Histogram(buckets)
+        histogram.observe(value)
+
+    def register_stats(self, component, stats):
+        """
+        Export the numbers returned by stats() (called on every scrape) as etc_<component>_<key> gauges
+        """
+        self.__collectors[component] = stats
+
+    def start_command(self, command):
+        trace = CommandTrace(command)
+        trace.token = _current_command.set(trace)
+        if self.tracer is not None:
+            trace.span = self.tracer.start_span(f"command.{command}")
+            trace.otel_token = otel_context.attach(otel_trace.set_span_in_context(trace.span))
+        return trace
+
+    def finish_command(self, trace: CommandTrace, failed=False):
+        elapsed = time.monotonic() - trace.start
+        self.observe("etc_command_seconds", elapsed, command=trace.command)
+        for backend in sorted({"es", "ipfs"} | set(trace.round_trips)):
+            self.observe("etc_command_round_trips", trace.round_trips.get(backend, 0), buckets=ROUND_TRIP_BUCKETS,
+                         command=trace.command, backend=backend)
+        if failed:
+            self.inc("etc_command_errors_total", command=trace.command)
+        if trace.span is not None:
+            for backend, count in trace.round_trips.items():
+                trace.span.set_attribute(f"round_trips.{backend}", count)
+            otel_context.detach(trace.otel_token)
+            trace.span.end()
+        try:
+            _current_command.reset(trace.token)
+        except ValueError:
+            _current_command.set(None)  # finished in a different context than it was started in
+        log.debug(f"Command {trace.command} took {elapsed * 1000:.1f}ms, round trips: {trace.round_trips}")
+
+    def track(self, backend, method):
+        """
+        Async context manager timing one request to a backend ("es" or "ipfs")
+        """
+        return _TrackedCall(self, backend, method)
+
+    def render(self):
+        """
+        Returns every metric in the Prometheus text format
+        """
+        lines = []
+        typed = set()
+
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in sorted(self.__counters.items()):
+            declare(name, "counter")
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+
+        for (name, labels), histogram in sorted(self.__histograms.items(), key=lambda item: item[0]):
+            declare(name, "histogram")
+            for bound, count in histogram.cumulative():
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', bound),))} {count}")
+            lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {histogram.count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+
+        for component, stats in self.__collectors.items():
+            try:
+                values = stats()
+            except Exception as e:
+                log.error(f"Failed to collect stats for {component}: {e}")
+                continue
+            for key, value in values.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    name = f"etc_{component}_{key}"
+                    declare(name, "gauge")
+                    lines.append(f"{name} {value}")
+
+        return "\n".join(lines) + "\n"
+
+    async def start_server(self, host=METRICS_HOST, port=METRICS_PORT):
+        """
+        Serve the metrics at http://host:port/metrics
+        """
+        async def handle(request):
+            return web.Response(text=self.render(), content_type="text/plain", charset="utf-8")
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        log.info(f"Serving metrics at http://{host}:{port}/metrics")
+        return runner
+
+
+class _TrackedCall:
+
+    def __init__(self, metrics: Metrics, backend, method):
+        self.metrics = metrics
+        self.backend = backend
+        self.method = method
+        self.start = None
+        self.span = None
+
+    async def __aenter__(self):
+        trace = _current_command.get()
+        if trace is not None:
+            trace.round_trips[self.backend] = trace.round_trips.get(self.backend, 0) + 1
+        if self.metrics.tracer is not None:
+            self.span = self.metrics.tracer.start_as_current_span(f"{self.backend}.{self.method}")
+            self.span.__enter__()
+        self.start = time.monotonic()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        elapsed = time.monotonic() - self.start
+        self.metrics.observe("etc_call_seconds", elapsed, backend=self.backend, method=self.method)
+        if exc_type is not None and not issubclass(exc_type, asyncio.CancelledError):
+            if issubclass(exc_type, asyncio.TimeoutError):
+                self.metrics.inc("etc_call_timeouts_total", backend=self.backend, method=self.method)
+            else:
+                self.metrics.inc("etc_call_errors_total", backend=self.backend, method=self.method, error=exc_type.__name__)
+        if self.span is not None:
+            self.span.__exit__(exc_type, exc, tb)
+        return False
+
+
+metrics = Metrics()
+
@@ -0,0 +1,89 @@
+import logging
+import re
+from const import MAX_LIST, ID_KEYWORD_FIELD
+log = logging.getLogger('root')
+
+"""
+
+Builds the Elasticsearch queries for the search commands.
+
+"""
+
+# !searchr argument setting the date window, given as a keyword so a numeric query isn't mistaken for it
+WINDOW_DAYS_ARGUMENT = re.compile(r"days=(\d+)", re.IGNORECASE)
+
+
+def parse_window_days(argument: str):
+    """
+    Returns the number of days of a days=<number> argument, or None if argument isn't one
+    """
+    match = WINDOW_DAYS_ARGUMENT.fullmatch(argument)
+    return None if match is None else int(match.group(1))
+
+
+def build_search_query(query=None, field=None, match_phrase=True, sort_by_field=None, sort=0, extra_querys=None,
+                       paged=False):
+    """
+    paged: the results may be paged through with search_after, which needs the sort to end in a unique tiebreaker
+    """
+
+    if extra_querys is None:
+        extra_querys = []
+    if sort == 1:
+        sort_order = "desc"
+    else:
+        sort_order = "asc"
+
+    if sort_by_field is not None:
+        sort_item = {'sort':[{sort_by_field:{'order': sort_order}}, '_score']}
+    elif paged:
+        sort_item = {'sort': ['_score']}
+    else:
+        sort_item = {}
+    if paged:
+        sort_item['sort'].append({ID_KEYWORD_FIELD: 'asc'})
+    size_item = {"size": MAX_LIST}
+
+    queries = []
+    query_bool_dict = {}
+    source_filters = []
+
+    if len(extra_querys) != 0:
+        queries.extend(extra_querys)
+        log.info("Added extra queries")
+
+    if query is None and field is None:  # Just get everything
+        queries.append({"match_all": {}})
+        log.info("Getting everything")
+
+    elif query is None and field is not None:  # Get all of a particular field
+        queries.append({"match_all": {}})
+        source_filters.append(field)
+        log.info("Getting everything for a particular field")
+    elif match_phrase is not None and field is not None: # Search a field and match a phrase
+        queries.append({'match_phrase': {field: query}})
+        log.info("Searching a field and matching a phrase")
+    elif match_phrase is not None and field is None:  # Match a phrase but search globally
+        queries.append({'multi_match': {"type": "phrase", "query": query}})
+        log.info("Match a phrase but search globally")
+    elif match_phrase is None and field is not None:  #  Do not match phrase, search by field (remember this one includes a query)
+        queries.append({'match': {field: query}})
+        log.info("Do not match a phrase but search by field")
+    elif match_phrase is None and field is None:
+        queries.append({'multi_match': {"type": "best_fields", "query": query}})
+        log.info("Search globally but don't match phrase")
+    else:
+        log.error("Invalid combination for searching.")
+        queries.append({"match_none": {}})
+
+    if len(source_filters) > 0:
+        source_item = {"_source": source_filters}
+    else:
+        source_item = {}
+
+    if len(queries) > 0:
+        query_bool_dict.setdefault("must", []).extend(queries)
+
+    query_item = {"query": {"bool": query_bool_dict}}
+
+    return {**size_item, **source_item, **query_item, **sort_item}
@@ -0,0 +1,217 @@
+import abc
+import json
+import logging
+import math
+from singleflight import SingleFlight
+from video import ETCVideo
+log = logging.getLogger('root')
+
+"""
+
+Interface of the databases the bot searches, and picking one from the config.
+
+The queries are Elasticsearch query DSL (see query.build_search_query); every backend answers them with
+ETCVideo objects enriched with the reupload/archive data, and produces the same stats.
+
+    - ETCDatabase (etcdatabase.py): an Elasticsearch cluster
+    - SQLiteDatabase (sqlitedatabase.py): a local SQLite FTS5 index, for small read-mostly deployments
+
+"""
+
+# _source projections for search results. None = the whole document
+SOURCE_PROFILES = {
+    'listing': ['id', 'title'],
+    'detail': None
+}
+# Aggregation asking for the whole document of the top hit of a listing, shown in full if it is the only hit
+SINGLE_HIT_AGG = "single_hit"
+
+MODERN_ETC_MAIN_CHANNEL_QUERY = {
+    "bool": {
+        "filter": [
+            {
+                "bool": {
+                    "should": [
+                        {
+                            "bool": {
+                                "should": [
+                                    {
+                                        "match_phrase": {
+                                            "uploader_ids": "MachinimaETC"
+                                        }
+                                    }
+                                ],
+                                "minimum_should_match": 1
+                            }
+                        },
+                        {
+                            "bool": {
+                                "should": [
+                                    {
+                                        "bool": {
+                                            "should": [
+                                                {
+                                                    "match_phrase": {
+                                                        "uploader_ids": "UCdIaNUarhzLSXGoItz7BHVA"
+                                                    }
+                                                }
+                                            ],
+                                            "minimum_should_match": 1
+                                        }
+                                    },
+                                    {
+                                        "bool": {
+                                            "should": [
+                                                {
+                                                    "match_phrase": {
+                                                        "uploader": "etc show"
+                                                    }
+                                                }
+                                            ],
+                                            "minimum_should_match": 1
+                                        }
+                                    }
+                                ],
+                                "minimum_should_match": 1
+                            }
+                        }
+                    ],
+                    "minimum_should_match": 1
+                }
+            },
+            {
+                "range": {
+                    "date_published": {
+                        "format": "strict_date_optional_time",
+                        "gte": "2014-06-01T00:00:00.000Z",
+                        "lte": "2019-01-24T23:21:13.800Z"
+                    }
+                }
+            }
+        ],
+    }
+}
+
+
+class SearchBackend(abc.ABC):
+
+    # sort values of a date field (and so the search_after of a cursor) are epoch seconds times this
+    DATE_SORT_SCALE = 1
+
+    def __init__(self):
+        self.single_flight = SingleFlight()
+
+    async def search(self, query, profile='detail'):
+        videos, _ = await self.search_page(query, profile=profile)
+        return videos
+
+    async def search_page(self, query, profile='detail'):
+        """
+        Search the main database. Returns a tuple of (videos, cursor), where cursor is the
+        search_after to fetch the next page with, or None if there are no more results.
+        For the cursor to be usable, the query needs a sort ending in a unique tiebreaker.
+
+        profile: which fields of the documents to fetch (see SOURCE_PROFILES). 'listing' only fetches what a
+        VideoListingEmbed shows, unless the query has its own _source. If the first page of a listing
+        has a single video, its whole document is returned, so it can be shown without searching again.
+        """
+        source_fields = SOURCE_PROFILES[profile]
+        if source_fields is not None and '_source' not in query:
+            query = {**query, '_source': source_fields}
+            if 'search_after' not in query:
+                query['aggs'] = {**query.get('aggs', {}),
+                                 SINGLE_HIT_AGG: {"top_hits": {"size": 1, "sort": query.get('sort', ['_score'])}}}
+
+        # Identical concurrent searches share one request
+        key = ('search', json.dumps(query, sort_keys=True, default=str))
+        return await self.single_flight.do(key, lambda: self._search(query))
+
+    @abc.abstractmethod
+    async def _search(self, query):
+        """
+        Returns a tuple of (enriched videos, cursor) for the query
+        """
+
+    async def get_stats(self, phrases=None):
+        key = ('stats', tuple(sorted(set(phrases if phrases is not None else []))))
+        return await self.single_flight.do(key, lambda: self._get_stats(phrases))
+
+    @abc.abstractmethod
+    async def _get_stats(self, phrases=None):
+        """
+        Returns a dict of {total, total_archived, total_reuploaded, total_classic, total_modern,
+        pure_modern_etc_archived: (archived, total), phrase: {phrase: {total, total_reuploaded, total_archived}}}
+        """
+
+    @abc.abstractmethod
+    async def get_stats_by_phrase(self, phrase: str):
+        """
+        Returns {total, total_reuploaded, total_archived} for the videos whose title has phrase
+        """
+
+    @abc.abstractmethod
+    async def modern_etc_main_channel(self):
+        """
+        Returns a tuple of (archived, total) videos uploaded to the main ETC channel in the modern era
+        """
+
+    @abc.abstractmethod
+    async def get_reupload_vids(self, video_ids: list):
+        """
+        Returns {video_id: reupload video} for the ids that have one.
+        """
+
+    @abc.abstractmethod
+    async def get_archived_vids(self, video_ids: list):
+        """
+        Returns {video_id: archived video} for the ids that have one.
+        """
+
+    @abc.abstractmethod
+    async def get_membership_ids(self):
+        """
+        Returns a tuple of (ids of videos reuploaded to youtube, ids of videos archived locally)
+        """
+
+    @abc.abstractmethod
+    def iter_videos(self, source=None):
+        """
+        Async iterator over the documents of the main index (only the source fields, if given)
+        """
+
+    @abc.abstractmethod
+    async def info(self):
+        """
+        Returns information about the database server, logged at startup
+        """
+
+    async def start_enrichment_refresher(self):
+        # Only needed by backends that can't join the reupload/archive data locally
+        return
+
+    @staticmethod
+    async def _convert_to_etcvideo(videos: list):
+        return [ETCVideo(**v['_source']) for v in videos]
+
+    async def get_date_range_query(self, date_epoch, range):
+        query = {"range": {"date_published": {"format": "epoch_second", "gte": f"{date_epoch - (math.floor(range/2) * 86400)}", "lte": f"{date_epoch + (math.ceil(range/2)*86400)}"}}}
+        return query
+
+
+def open_database(config: dict):
+    """
+    Create the backend selected by database.backend in the config ("elasticsearch" or "sqlite").
+    Imported here so a deployment only needs the dependencies of the backend it uses.
+    """
+    backend = config.get('database', {}).get('backend', 'elasticsearch')
+    if backend == 'sqlite':
+        from sqlitedatabase import SQLiteDatabase
+        return SQLiteDatabase(config['database']['sqlite']['path'])
+    if backend == 'elasticsearch':
+        from etcdatabase import ETCDatabase
+        return ETCDatabase(config['elasticsearch']['main_index'],
+                           config['elasticsearch']['yt_index'],
+                           config['elasticsearch']['local_index'],
+                           enrichment_map=config['elasticsearch'].get('enrichment_map'),
+                           hosts=config['elasticsearch']['hosts'])
+    raise ValueError(f"Unknown database backend {backend}")
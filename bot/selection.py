@@ -0,0 +1,206 @@
+import asyncio
+import json
+import logging
+import uuid
+from kvstore import MemoryKVStore, EVICT_EVERY_SETS
+from video import ETCVideo
+log = logging.getLogger('root')
+
+"""
+
+A user's pending search selection (the videos listed by a VideoListingEmbed, for !choose).
+
+Further pages of the search are fetched with the stored search_after cursor only when requested (!next),
+and are kept so going back a page (!prev) doesn't search again.
+
+As the user will most likely !choose one of the listed videos, the thumbnails of every listed video
+are fetched in the background while the selection is pending.
+
+Selections are kept in a SelectionStore, keyed by user id.
+
+"""
+
+THUMB_PREFETCH_CONCURRENCY = 4
+SELECTION_TTL_S = 600
+SELECTION_MAX_ENTRIES = 1000
+SELECTION_MAX_MEMORY_MB = 8
+SELECTION_PURGE_INTERVAL_S = 60
+
+
+class Selection:
+
+    def __init__(self, videos: list, token=None, query=None, cursor=None):
+        """
+        videos: the first page of results
+        query: the search the videos came from, to fetch further pages with
+        cursor: search_after for the next page (None if there are no more results)
+        """
+        self.token = uuid.uuid4().hex if token is None else token
+        self.query = query
+        self.pages = {0: videos}
+        self.cursors = {} if cursor is None else {1: cursor}  # page number -> search_after to fetch it with
+        self.page = 0
+        self.__thumb_tasks = {}
+
+    @property
+    def videos(self):
+        return self.pages[self.page]
+
+    def has_next(self):
+        return self.page + 1 in self.pages or self.page + 1 in self.cursors
+
+    def add_page(self, page, videos: list, cursor=None):
+        self.pages[page] = videos
+        if cursor is not None:
+            self.cursors[page + 1] = cursor
+
+    def dumps(self):
+        return json.dumps({'token': self.token, 'query': self.query, 'page': self.page,
+                           'cursors': {str(page): cursor for page, cursor in self.cursors.items()},
+                           'pages': {str(page): [video.raw() for video in videos] for page, videos in self.pages.items()}})
+
+    @classmethod
+    def loads(cls, data: str):
+        data = json.loads(data)
+        selection = cls([], token=data['token'], query=data['query'])
+        selection.pages = {int(page): [ETCVideo(**video) for video in videos] for page, videos in data['pages'].items()}
+        selection.cursors = {int(page): cursor for page, cursor in data['cursors'].items()}
+        selection.page = data['page']
+        return selection
+
+    def prefetch_thumbs(self, get_thumb, concurrency=THUMB_PREFETCH_CONCURRENCY):
+        """
+        Start fetching the thumbnail of every video in the selection, at most concurrency at a time.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def _prefetch(video_id):
+            async with semaphore:
+                try:
+                    return await get_thumb(video_id)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    log.debug(f"Failed to prefetch thumbnail for {video_id}: {e}")
+                    return None
+
+        for video in self.videos:
+            if video.id not in self.__thumb_tasks:
+                self.__thumb_tasks[video.id] = asyncio.ensure_future(_prefetch(video.id))
+
+    async def get_thumb(self, video_id, get_thumb):
+        """
+        Get the prefetched thumbnail for video_id (waiting on it if still in flight),
+        or fetch it with get_thumb if it wasn't prefetched (or the prefetch was cancelled).
+        """
+        task = self.__thumb_tasks.get(video_id)
+        if task is not None and not task.cancelled():
+            try:
+                thumb = await asyncio.shield(task)
+            except asyncio.CancelledError:
+                # The selection was evicted or replaced while waiting: only the prefetch was cancelled, not the caller
+                if not task.cancelled():
+                    raise
+                thumb = None
+            if thumb is not None:
+                return thumb
+        return await get_thumb(video_id)
+
+    def cancel(self):
+        """
+        Cancel any prefetches still in flight. Called when the selection is used, replaced or expires.
+        """
+        for task in self.__thumb_tasks.values():
+            if not task.done():
+                task.cancel()
+
+
+class SelectionStore:
+    """
+
+    Bounded store of pending selections, keyed by user id.
+
+    Entries expire after ttl, and the least recently used entries are evicted past max_entries or max_memory_mb
+    (every EVICT_EVERY_SETS selections, and by the purger).
+    The selections are kept in a key-value store backend (see kvstore), so a shared backend lets several bot
+    processes see the same selections. Thumbnail prefetches only exist in the process that made the selection.
+
+    """
+
+    NAMESPACE = "selections"
+
+    def __init__(self, backend=None, ttl=SELECTION_TTL_S, max_entries=SELECTION_MAX_ENTRIES,
+                 max_memory_mb=SELECTION_MAX_MEMORY_MB):
+        self.__backend = MemoryKVStore() if backend is None else backend
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = int(max_memory_mb * 1024 * 1024)
+        self.__local = {}  # user id -> Selection made by this process (with its prefetches)
+        self.__sets = 0  # since the last eviction
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, user_id):
+        return self.__backend.contains(self.NAMESPACE, str(user_id))
+
+    def get(self, user_id):
+        key = str(user_id)
+        data = self.__backend.get(self.NAMESPACE, key)
+        if data is None:
+            self.misses += 1
+            self.__drop_local(key)
+            return None
+        self.hits += 1
+        selection = self.__local.get(key)
+        if selection is not None and selection.token == json.loads(data)['token']:
+            return selection
+        return Selection.loads(data)
+
+    async def set(self, user_id, selection: Selection):
+        key = str(user_id)
+        if self.__local.get(key) is not selection:
+            self.__drop_local(key)
+        self.__local[key] = selection
+        await self.__backend.set(self.NAMESPACE, key, selection.dumps(), ttl=self.ttl)
+        self.__sets += 1
+        if self.__sets >= EVICT_EVERY_SETS:
+            await self.__evict()
+
+    async def pop(self, user_id):
+        key = str(user_id)
+        self.__drop_local(key)
+        await self.__backend.delete(self.NAMESPACE, key)
+
+    def __drop_local(self, key):
+        selection = self.__local.pop(key, None)
+        if selection is not None:
+            selection.cancel()
+
+    async def __evict(self):
+        self.__sets = 0
+        evicted = await self.__backend.evict(self.NAMESPACE, max_entries=self.max_entries, max_bytes=self.max_bytes)
+        self.evictions += len(evicted)
+        for key in evicted:
+            self.__drop_local(key)
+
+    async def purge(self):
+        """
+        Evict expired and least recently used selections, and cancel the prefetches of
+        selections that are no longer stored (e.g removed by another process).
+        """
+        await self.__evict()
+        for key in list(self.__local):
+            if not self.__backend.contains(self.NAMESPACE, key):
+                self.__drop_local(key)
+
+    async def start_purger(self, interval=SELECTION_PURGE_INTERVAL_S):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.purge()
+            except Exception as e:
+                log.error(f"Failed to purge selections: {e}")
+
+    def stats(self):
+        return {**self.__backend.stats(self.NAMESPACE), 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
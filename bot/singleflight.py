@@ -0,0 +1,61 @@
+import asyncio
+import logging
+log = logging.getLogger('root')
+
+"""
+
+Request coalescing: concurrent calls with the same key share one in-flight call.
+
+If a caller is cancelled only that caller is cancelled, the shared call keeps running
+for the others. The shared call is only cancelled once every caller has gone away.
+Exceptions raised by the shared call are raised to every caller.
+
+"""
+
+
+class _Call:
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+
+    def __init__(self):
+        self.__calls = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def __forget(self, key, call):
+        if self.__calls.get(key) is call:
+            del self.__calls[key]
+
+    async def do(self, key, coro_fn):
+        """
+        Await coro_fn(), or the already in-flight call for key.
+        """
+        call = self.__calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(coro_fn()))
+            call.task.add_done_callback(lambda _: self.__forget(key, call))
+            self.__calls[key] = call
+            self.calls += 1
+        else:
+            self.coalesced += 1
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                log.debug(f"All callers for {key} cancelled, cancelling shared call")
+                call.task.cancel()
+                self.__forget(key, call)
+
+    def in_flight(self):
+        return len(self.__calls)
+
+    def stats(self):
+        return {'calls': self.calls, 'coalesced': self.coalesced, 'in_flight': self.in_flight()}
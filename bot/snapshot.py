@@ -0,0 +1,328 @@
+import argparse
+import asyncio
+import datetime
+import gzip
+import hashlib
+import json
+import logging
+import os
+import resource
+import time
+log = logging.getLogger('root')
+
+"""
+
+Snapshots of the three archive indexes, for offline replay, benchmarking or disaster recovery.
+
+A snapshot is a directory of gzipped JSON lines chunks (one {"_id", "_source"} per line), plus a manifest.json
+with the document count and sha256 of every chunk. Both directions stream, so memory use is bounded by the
+chunk writer on export and by batch_size * concurrency documents on import.
+
+    python3 snapshot.py export --config config.yml --path snapshot/
+    python3 snapshot.py verify --path snapshot/
+    python3 snapshot.py import --config config.yml --path snapshot/ [--index main=etc_main_restored]
+    python3 snapshot.py import --config config.yml --path snapshot/ --sqlite etc_archive.sqlite
+
+export_snapshot/import_snapshot only need a document iterator and a sink, so they can be run against
+a stand-in for Elasticsearch.
+
+"""
+
+MANIFEST_FILE = "manifest.json"
+FORMAT_VERSION = 1
+CHUNK_SIZE = 50000
+BULK_BATCH_SIZE = 500
+BULK_CONCURRENCY = 4
+HASH_BLOCK_SIZE = 1 << 20
+# gzip level 9 is ~4.5x slower to write than 6 for ~8% smaller chunks
+COMPRESS_LEVEL = 6
+# snapshot name -> key of the index in the elasticsearch config
+INDEXES = {'main': 'main_index', 'youtube': 'yt_index', 'local': 'local_index'}
+
+
+class SnapshotError(Exception):
+    pass
+
+
+class Progress:
+    """
+    Documents per second and peak RSS of a run
+    """
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.documents = 0
+
+    def rate(self):
+        elapsed = time.monotonic() - self.start
+        return self.documents / elapsed if elapsed > 0 else 0.0
+
+    @staticmethod
+    def peak_rss_mb():
+        # ru_maxrss is in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    def report(self, action):
+        return (f"{action} {self.documents} documents in {time.monotonic() - self.start:.1f}s "
+                f"({self.rate():.0f} docs/s, peak RSS {self.peak_rss_mb():.0f}MB)")
+
+
+class _ChunkWriter:
+
+    def __init__(self, path, name, chunk_size):
+        self.path = path
+        self.name = name
+        self.chunk_size = chunk_size
+        self.chunks = []
+        self.__file = None
+        self.__count = 0
+
+    def write(self, hit):
+        if self.__file is None:
+            self.__file = gzip.open(os.path.join(self.path, self.__chunk_name()), "wt", encoding="utf-8",
+                                    compresslevel=COMPRESS_LEVEL)
+        self.__file.write(json.dumps({'_id': hit.get('_id'), '_source': hit['_source']}, separators=(",", ":")) + "\n")
+        self.__count += 1
+        if self.__count >= self.chunk_size:
+            self.close()
+
+    def __chunk_name(self):
+        return f"{self.name}-{len(self.chunks):05d}.jsonl.gz"
+
+    def close(self):
+        if self.__file is None:
+            return
+        self.__file.close()
+        file_name = self.__chunk_name()
+        self.chunks.append({'file': file_name, 'count': self.__count, 'sha256': file_sha256(os.path.join(self.path, file_name))})
+        self.__file = None
+        self.__count = 0
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+async def export_snapshot(iter_documents, indexes: dict, path, chunk_size=CHUNK_SIZE):
+    """
+    Write every document of indexes ({snapshot name: index}) to a snapshot at path.
+    iter_documents(index) is an async iterator of hits, e.g ETCDatabase.iter_documents.
+    Returns the manifest.
+    """
+    os.makedirs(path, exist_ok=True)
+    progress = Progress()
+    manifest = {'format_version': FORMAT_VERSION, 'created': datetime.datetime.now(tz=datetime.timezone.utc).isoformat(),
+                'indexes': {}}
+    for name, index in indexes.items():
+        writer = _ChunkWriter(path, name, chunk_size)
+        try:
+            async for hit in iter_documents(index):
+                writer.write(hit)
+                progress.documents += 1
+        finally:
+            writer.close()
+        count = sum(chunk['count'] for chunk in writer.chunks)
+        manifest['indexes'][name] = {'index': index, 'count': count, 'chunks': writer.chunks}
+        log.info(f"Exported {count} documents from {index}")
+
+    # The manifest is written last, so a snapshot with a manifest is complete
+    with open(os.path.join(path, MANIFEST_FILE + ".tmp"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(os.path.join(path, MANIFEST_FILE + ".tmp"), os.path.join(path, MANIFEST_FILE))
+    log.info(progress.report("Exported"))
+    return manifest
+
+
+def load_manifest(path):
+    try:
+        with open(os.path.join(path, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError) as e:
+        raise SnapshotError(f"No valid manifest in {path}: {e}")
+    if manifest.get('format_version') != FORMAT_VERSION:
+        raise SnapshotError(f"Unsupported snapshot format {manifest.get('format_version')}")
+    return manifest
+
+
+def verify_snapshot(path, names=None):
+    """
+    Check the checksum and document count of every chunk against the manifest. Raises SnapshotError on a mismatch.
+    """
+    manifest = load_manifest(path)
+    for name, entry in manifest['indexes'].items():
+        if names is not None and name not in names:
+            continue
+        for chunk in entry['chunks']:
+            chunk_path = os.path.join(path, chunk['file'])
+            if file_sha256(chunk_path) != chunk['sha256']:
+                raise SnapshotError(f"Checksum mismatch for {chunk['file']}")
+            with gzip.open(chunk_path, "rt", encoding="utf-8") as f:
+                count = sum(1 for _ in f)
+            if count != chunk['count']:
+                raise SnapshotError(f"{chunk['file']} has {count} documents, expected {chunk['count']}")
+    return manifest
+
+
+def iter_snapshot(path, name, manifest=None):
+    """
+    Yields the {"_id", "_source"} documents of one index of a snapshot, one chunk at a time
+    """
+    manifest = load_manifest(path) if manifest is None else manifest
+    for chunk in manifest['indexes'][name]['chunks']:
+        with gzip.open(os.path.join(path, chunk['file']), "rt", encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+
+
+async def import_snapshot(path, sink, names=None, batch_size=BULK_BATCH_SIZE, concurrency=BULK_CONCURRENCY, verify=True):
+    """
+    Stream the documents of a snapshot into sink(name, documents), at most concurrency batches at a time.
+    sink is a coroutine function, returning the number of documents that failed to import.
+    A batch for which sink raises is counted as failed. Returns {name: (imported, failed)}.
+    """
+    manifest = verify_snapshot(path, names) if verify else load_manifest(path)
+    progress = Progress()
+    semaphore = asyncio.Semaphore(concurrency)
+    results = {}
+
+    for name in manifest['indexes']:
+        if names is not None and name not in names:
+            continue
+        sent = 0
+        failed = 0
+        pending = set()
+
+        async def _send(batch):
+            nonlocal failed
+            try:
+                failed += await sink(name, batch)
+            except Exception as e:
+                log.error(f"Failed to import a batch of {len(batch)} documents into {name}: {e!r}")
+                failed += len(batch)
+            finally:
+                semaphore.release()
+            progress.documents += len(batch)
+
+        batch = []
+        for document in iter_snapshot(path, name, manifest):
+            batch.append(document)
+            if len(batch) >= batch_size:
+                await semaphore.acquire()
+                sent += len(batch)
+                pending.add(asyncio.ensure_future(_send(batch)))
+                pending = {task for task in pending if not task.done()}
+                batch = []
+        if len(batch) > 0:
+            await semaphore.acquire()
+            sent += len(batch)
+            pending.add(asyncio.ensure_future(_send(batch)))
+        await asyncio.gather(*pending)
+
+        results[name] = (sent - failed, failed)
+        log.info(f"Imported {results[name][0]} documents into {name} ({failed} failed)")
+    log.info(progress.report("Imported"))
+    return results
+
+
+def elasticsearch_sink(client, targets: dict):
+    """
+    Sink writing batches to Elasticsearch with bulk requests. targets: {snapshot name: index to write to}
+    """
+    async def sink(name, documents):
+        body = []
+        for document in documents:
+            action = {"_index": targets[name]}
+            if document.get('_id') is not None:
+                action["_id"] = document['_id']
+            body.append({"index": action})
+            body.append(document['_source'])
+        response = await client.bulk(body=body)
+        if not response.get('errors'):
+            return 0
+        failed = [item['index'] for item in response['items'] if 'error' in item['index']]
+        log.error(f"{len(failed)} documents failed to import into {targets[name]}, e.g {failed[0]['error']}")
+        return len(failed)
+    return sink
+
+
+def sqlite_sink(database):
+    """
+    Sink writing batches to a SQLiteDatabase
+    """
+    async def sink(name, documents):
+        database.import_documents(name, [document['_source'] for document in documents])
+        return 0
+    return sink
+
+
+async def main(args, config):
+    if args.command == "verify":
+        manifest = verify_snapshot(args.path)
+        for name, entry in manifest['indexes'].items():
+            print(f"{name}: {entry['count']} documents from {entry['index']} in {len(entry['chunks'])} chunks, checksums OK")
+        return
+
+    names = set(args.only) if args.only else None
+    if args.command == "export":
+        from etcdatabase import ETCDatabase
+        db = ETCDatabase(config['elasticsearch']['main_index'], config['elasticsearch']['yt_index'],
+                         config['elasticsearch']['local_index'], hosts=config['elasticsearch']['hosts'])
+        indexes = {name: config['elasticsearch'][key] for name, key in INDEXES.items() if names is None or name in names}
+        try:
+            await export_snapshot(lambda index: db.iter_documents(index=index), indexes, args.path, chunk_size=args.chunk_size)
+        finally:
+            await (await db.get_client()).close()
+        return
+
+    if args.sqlite:
+        from sqlitedatabase import SQLiteDatabase
+        database = SQLiteDatabase(args.sqlite)
+        try:
+            await import_snapshot(args.path, sqlite_sink(database), names=names, batch_size=args.batch_size, concurrency=1)
+            database.optimize()
+        finally:
+            database.close()
+        return
+
+    from elasticsearch import AsyncElasticsearch
+    targets = {name: config['elasticsearch'][key] for name, key in INDEXES.items()}
+    targets.update(dict(target.split("=", 1) for target in args.index))
+    client = AsyncElasticsearch(hosts=config['elasticsearch']['hosts'])
+    try:
+        await import_snapshot(args.path, elasticsearch_sink(client, targets), names=names,
+                              batch_size=args.batch_size, concurrency=args.concurrency)
+    finally:
+        await client.close()
+
+
+if __name__ == '__main__':
+    import yaml
+    parser = argparse.ArgumentParser(description="Export/import snapshots of the archive indexes")
+    parser.add_argument("command", choices=["export", "import", "verify"])
+    parser.add_argument("--path", help="Snapshot directory", required=True)
+    parser.add_argument("--config", help="Configuration file (export/import)")
+    parser.add_argument("--only", action="append", choices=list(INDEXES), help="Only this index (can be repeated)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Documents per chunk file (export)")
+    parser.add_argument("--index", action="append", default=[], metavar="NAME=INDEX",
+                        help="Import NAME (main, youtube, local) into INDEX instead of the configured index")
+    parser.add_argument("--sqlite", help="Import into this SQLite database instead of Elasticsearch")
+    parser.add_argument("--batch-size", type=int, default=BULK_BATCH_SIZE, help="Documents per bulk request (import)")
+    parser.add_argument("--concurrency", type=int, default=BULK_CONCURRENCY, help="Bulk requests in flight (import)")
+    args = parser.parse_args()
+
+    config = {}
+    if args.command == "export" or (args.command == "import" and not args.sqlite):
+        if args.config is None:
+            parser.error("--config is required to export from/import into Elasticsearch")
+        with open(args.config) as f:
+            config = yaml.load(f, Loader=yaml.FullLoader)
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.get_event_loop().run_until_complete(main(args, config))
+    except SnapshotError as e:
+        log.critical(f"Snapshot error: {e}")
+        raise SystemExit(1)
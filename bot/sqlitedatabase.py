@@ -0,0 +1,513 @@
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import re
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from searchbackend import SearchBackend, MODERN_ETC_MAIN_CHANNEL_QUERY, SINGLE_HIT_AGG
+from const import ID_FIELD
+from metrics import metrics
+log = logging.getLogger('root')
+
+"""
+
+Embedded backend: the three indexes in one local SQLite file, searched with an FTS5 full-text index.
+
+The subset of the Elasticsearch query DSL the bot generates is translated to SQL:
+
+    - bool (must/filter/should/must_not), match_all, match_none
+    - match_phrase, match, multi_match (phrase/best_fields) -> FTS5 MATCH expressions, scored with bm25
+    - range on date_published (epoch_second or ISO dates), terms on ids
+    - sort on _score, date_published, id or any document field, with search_after and from/size
+
+Reupload and archive data are joined in the same query, and the stats are plain aggregate queries.
+Text is tokenized by FTS5's unicode61 tokenizer rather than Elasticsearch's analyzers, so relevance
+and phrase matching are close to, but not exactly, what the cluster returns.
+
+Build the file from the Elasticsearch indexes with:
+
+    python3 sqlitedatabase.py --config /path/to/config.yml
+
+"""
+
+# Full-text columns, also the fields a best_fields/phrase multi_match searches
+TEXT_FIELDS = ('title', 'alternate_titles', 'description', 'alternate_descriptions', 'uploader',
+               'alternate_uploaders', 'uploader_ids', 'tags', 'id')
+LIST_SEPARATOR = "\n"
+# Elasticsearch sorts documents missing a numeric sort field last, in both orders
+MISSING_LAST = {'asc': 2 ** 63 - 1, 'desc': -2 ** 63}
+DEFAULT_SIZE = 10
+IMPORT_BATCH_SIZE = 1000
+ITER_PAGE_SIZE = 1000
+KEYWORD_SUFFIX = ".keyword"
+FIELD_NAME = re.compile(r"[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*")
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS videos (rowid INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE, "
+    "date_published REAL, document TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS videos_date_published ON videos (date_published)",
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS videos_fts USING fts5({', '.join(TEXT_FIELDS)}, "
+    "tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TABLE IF NOT EXISTS reuploads (id TEXT PRIMARY KEY, original_id TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS reuploads_original_id ON reuploads (original_id)",
+    "CREATE TABLE IF NOT EXISTS archived (id TEXT PRIMARY KEY, width INTEGER, height INTEGER, collection TEXT)",
+]
+
+
+def _fts_string(text):
+    return '"' + str(text).replace('"', '""') + '"'
+
+
+def _fts_any(text):
+    # OR of every word, like a match query with the default operator
+    words = str(text).split()
+    if len(words) == 0:
+        return None
+    return "(" + " OR ".join(_fts_string(word) for word in words) + ")"
+
+
+def _document_field(field):
+    # Elasticsearch keyword subfields ("id.keyword") hold the same value as the field in the stored document
+    return field[:-len(KEYWORD_SUFFIX)] if field.endswith(KEYWORD_SUFFIX) else field
+
+
+def _json_path(field):
+    # Field names end up in the SQL, so only plain (dotted) names are allowed
+    if FIELD_NAME.fullmatch(field) is None:
+        raise ValueError(f"Invalid field name {field}")
+    return f"$.{field}"
+
+
+def _to_epoch(value):
+    # epoch seconds, or an ISO 8601 date (UTC unless it has a timezone)
+    try:
+        return float(value)
+    except ValueError:
+        date = datetime.datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+        if date.tzinfo is None:
+            date = date.replace(tzinfo=datetime.timezone.utc)
+        return date.timestamp()
+
+
+class QueryTranslator:
+    """
+    Translates a query clause into a SQL condition on the videos table (aliased v).
+    Full-text clauses become rowid IN (FTS5 match) subqueries, except the ones given to the scorer.
+    """
+
+    def __init__(self):
+        self.params = []
+
+    def condition(self, clause: dict):
+        (kind, body), = clause.items()
+        if kind == "match_all":
+            return "1"
+        if kind == "match_none":
+            return "0"
+        if kind == "bool":
+            return self.__bool(body)
+        if kind == "range":
+            return self.__range(body)
+        if kind == "terms":
+            (field, values), = body.items()
+            if len(values) == 0:
+                return "0"
+            self.params.extend(values)
+            return f"{self.field(field)} IN ({', '.join('?' * len(values))})"
+        if kind in ("match_phrase", "match", "multi_match"):
+            field, value = self.__field_value(kind, body)
+            if field is not None and field not in TEXT_FIELDS:
+                self.params.append(value)
+                return f"{self.field(field)} = ?"
+            expression = self.fts_expression(clause)
+            if expression is None:
+                return "0"
+            self.params.append(expression)
+            return "v.rowid IN (SELECT rowid FROM videos_fts WHERE videos_fts MATCH ?)"
+        raise ValueError(f"Unsupported query clause {kind}")
+
+    @staticmethod
+    def __field_value(kind, body):
+        if kind == "multi_match":
+            return None, body["query"]
+        (field, value), = body.items()
+        if isinstance(value, dict):
+            value = value["query"]
+        return field, value
+
+    @classmethod
+    def is_full_text(cls, clause: dict):
+        (kind, body), = clause.items()
+        if kind not in ("match_phrase", "match", "multi_match"):
+            return False
+        field, _ = cls.__field_value(kind, body)
+        return field is None or field in TEXT_FIELDS
+
+    @classmethod
+    def fts_expression(cls, clause: dict):
+        """
+        Returns the FTS5 MATCH expression of a full-text clause (None if it can't match anything)
+        """
+        (kind, body), = clause.items()
+        field, value = cls.__field_value(kind, body)
+        if kind == "match" or (kind == "multi_match" and body.get("type", "best_fields") != "phrase"):
+            expression = _fts_any(value)
+        else:
+            expression = _fts_string(value) if str(value).strip() != "" else None
+        if expression is None:
+            return None
+        return expression if field is None else f"{{{field}}} : {expression}"
+
+    def __bool(self, body):
+        conditions = []
+        for key in ("must", "filter"):
+            conditions.extend(self.condition(clause) for clause in self.__clauses(body, key))
+        should = self.__clauses(body, "should")
+        if len(should) > 0 and (body.get("minimum_should_match", 1 if len(conditions) == 0 else 0)) > 0:
+            conditions.append("(" + " OR ".join(self.condition(clause) for clause in should) + ")")
+        conditions.extend(f"NOT ({self.condition(clause)})" for clause in self.__clauses(body, "must_not"))
+        return "(" + " AND ".join(conditions) + ")" if len(conditions) > 0 else "1"
+
+    @staticmethod
+    def __clauses(body, key):
+        clauses = body.get(key, [])
+        return clauses if isinstance(clauses, list) else [clauses]
+
+    def __range(self, body):
+        (field, bounds), = body.items()
+        operators = {"gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
+        conditions = []
+        for bound, operator in operators.items():
+            if bound in bounds:
+                value = bounds[bound]
+                if field == "date_published":
+                    value = _to_epoch(value)
+                self.params.append(value)
+                conditions.append(f"{self.field(field)} {operator} ?")
+        return "(" + " AND ".join(conditions) + ")" if len(conditions) > 0 else "1"
+
+    @staticmethod
+    def field(field):
+        field = _document_field(field)
+        if field == ID_FIELD:
+            return "v.id"
+        if field == "date_published":
+            return "v.date_published"
+        return f"json_extract(v.document, '{_json_path(field)}')"
+
+
+class SQLiteDatabase(SearchBackend):
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.__conn = sqlite3.connect(path, check_same_thread=False)
+        self.__conn.execute("PRAGMA journal_mode=WAL")
+        for statement in SCHEMA:
+            self.__conn.execute(statement)
+        self.__conn.commit()
+        # sqlite3 connections aren't safe to use from several threads at once
+        self.__executor = ThreadPoolExecutor(max_workers=1)
+
+    async def __run(self, method, fn, *args):
+        async with metrics.track("sqlite", method):
+            return await asyncio.get_event_loop().run_in_executor(self.__executor, fn, *args)
+
+    async def info(self):
+        return await self.__run("info", self.__info)
+
+    def __info(self):
+        counts = {table: self.__conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                  for table in ("videos", "reuploads", "archived")}
+        return {'backend': 'sqlite', 'path': self.path, 'sqlite_version': sqlite3.sqlite_version, **counts}
+
+    async def _search(self, query):
+        try:
+            hits = await self.__run("search", self.__search, query)
+        except (ValueError, KeyError, sqlite3.Error) as e:
+            log.error(f"Failed to search database: {e}")
+            return [], None
+        cursor = None
+        if len(hits) > 0 and len(hits) >= query.get('size', DEFAULT_SIZE):
+            cursor = hits[-1]['sort']
+        return await self._convert_to_etcvideo(hits), cursor
+
+    def __search(self, query):
+        translator = QueryTranslator()
+        clause = query.get("query", {"match_all": {}})
+
+        # Full-text clauses the document must match are scored (bm25) through a join on the FTS table
+        # and, as in Elasticsearch, every other clause the document must match adds 1 to the score
+        scored = []
+        constant_score = 1.0
+        if "bool" in clause:
+            must = clause["bool"].get("must", [])
+            must = must if isinstance(must, list) else [must]
+            scored = [c for c in must if QueryTranslator.is_full_text(c)]
+            clause = {"bool": {**clause["bool"], "must": [c for c in must if not QueryTranslator.is_full_text(c)]}}
+            constant_score = float(len(clause["bool"]["must"]))
+        elif QueryTranslator.is_full_text(clause):
+            scored, clause = [clause], {"match_all": {}}
+            constant_score = 0.0
+
+        match = None
+        if len(scored) > 0:
+            expressions = [QueryTranslator.fts_expression(c) for c in scored]
+            if None in expressions:
+                return []
+            match = " AND ".join(f"({expression})" for expression in expressions)
+
+        sort_columns, order_by = self.__sort(query.get("sort", ["_score"]))
+        inner = ["SELECT v.id AS id, v.document AS document, "
+                 f"{'-bm25(videos_fts) + ' if match is not None else ''}{constant_score!r} AS score, "
+                 "v.date_published AS date_published, "
+                 "(SELECT r.id FROM reuploads r WHERE r.original_id = v.id LIMIT 1) AS reupload_id, "
+                 "a.width AS width, a.height AS height",
+                 "FROM videos v"]
+        params = []
+        if match is not None:
+            inner.append("JOIN videos_fts ON videos_fts.rowid = v.rowid AND videos_fts MATCH ?")
+            params.append(match)
+        inner.append("LEFT JOIN archived a ON a.id = v.id")
+        inner.append(f"WHERE {translator.condition(clause)}")
+        params.extend(translator.params)
+
+        sql = f"SELECT *, {', '.join(f'{c} AS s{i}' for i, (c, _) in enumerate(sort_columns))} FROM ({' '.join(inner)})"
+        search_after = query.get("search_after")
+        if search_after is not None:
+            keyset, keyset_params = self.__search_after(sort_columns, search_after)
+            sql += f" WHERE {keyset}"
+            params.extend(keyset_params)
+        sql += f" ORDER BY {order_by} LIMIT ? OFFSET ?"
+        params.extend([query.get("size", DEFAULT_SIZE), query.get("from", 0)])
+
+        rows = self.__conn.execute(sql, params).fetchall()
+        source_fields = query.get("_source")
+        if len(rows) == 1 and SINGLE_HIT_AGG in query.get("aggs", {}):
+            source_fields = None  # the whole document of a single hit, see SearchBackend.search_page
+        return [self.__hit(row, source_fields, len(sort_columns)) for row in rows]
+
+    @staticmethod
+    def __sort(sort):
+        """
+        Returns ([(column, order)], ORDER BY clause), the columns being on the result of the inner search query
+        """
+        columns = []
+        for item in sort if isinstance(sort, list) else [sort]:
+            if isinstance(item, str):
+                field, order = item, "desc" if item == "_score" else "asc"
+            else:
+                (field, order), = item.items()
+                if isinstance(order, dict):
+                    order = order.get("order", "desc" if field == "_score" else "asc")
+            field = _document_field(field)
+            if field == "_score":
+                column = "score"
+            elif field == ID_FIELD:
+                column = "id"
+            elif field == "date_published":
+                column = f"COALESCE(date_published, {MISSING_LAST[order]})"
+            else:
+                column = f"json_extract(document, '{_json_path(field)}')"
+            columns.append((column, order))
+        return columns, ", ".join(f"s{i} {order.upper()}" for i, (_, order) in enumerate(columns))
+
+    @staticmethod
+    def __search_after(sort_columns, values):
+        # (s0, s1, ...) after (v0, v1, ...) in the sort order, expanded as directions can differ per column
+        alternatives = []
+        params = []
+        for i, (_, order) in enumerate(sort_columns[:len(values)]):
+            terms = [f"s{j} = ?" for j in range(i)] + [f"s{i} {'>' if order == 'asc' else '<'} ?"]
+            params.extend(values[:i + 1])
+            alternatives.append("(" + " AND ".join(terms) + ")")
+        return "(" + " OR ".join(alternatives) + ")", params
+
+    @staticmethod
+    def __hit(row, source_fields, sort_count):
+        video_id, document, score, _, reupload_id, width, height = row[:7]
+        source = json.loads(document)
+        if isinstance(source_fields, list):
+            source = {field: source[field] for field in source_fields if field in source}
+        source['id'] = video_id
+        if reupload_id is not None:
+            source.update({'on_youtube': True, 'reupload_url': f"https://www.youtube.com/watch?v={reupload_id}"})
+        if width is not None:
+            source.update({'archived': True, 'local_quality_width': width, 'local_quality_height': height})
+        return {'_id': video_id, '_score': score, '_source': source, 'sort': list(row[7:7 + sort_count])}
+
+    async def get_reupload_vids(self, video_ids: list):
+        return await self.__run("get_reupload_vids", self.__lookup,
+                                "SELECT original_id, id FROM reuploads WHERE original_id IN ({})", video_ids,
+                                lambda row: {'original_id': row[0], 'id': row[1]})
+
+    async def get_archived_vids(self, video_ids: list):
+        return await self.__run("get_archived_vids", self.__lookup,
+                                "SELECT id, width, height, collection FROM archived WHERE id IN ({})", video_ids,
+                                lambda row: {'id': row[0], 'width': row[1], 'height': row[2], 'collection': row[3]})
+
+    def __lookup(self, sql, video_ids, to_dict):
+        found = {}
+        video_ids = list(video_ids)
+        for i in range(0, len(video_ids), 500):
+            batch = video_ids[i:i + 500]
+            for row in self.__conn.execute(sql.format(", ".join("?" * len(batch))), batch):
+                found.setdefault(row[0], to_dict(row))
+        return found
+
+    async def get_membership_ids(self):
+        return await self.__run("get_membership_ids", self.__membership_ids)
+
+    def __membership_ids(self):
+        reuploaded_ids = {original_id for original_id, in self.__conn.execute("SELECT original_id FROM reuploads")}
+        archived_ids = {video_id for video_id, in self.__conn.execute("SELECT id FROM archived")}
+        return reuploaded_ids, archived_ids
+
+    async def iter_videos(self, source=None):
+        # Fetched a page at a time on the database thread, as the cursor belongs to its connection
+        cursor = await self.__run("iter_videos", self.__conn.execute, "SELECT document FROM videos ORDER BY rowid")
+        while True:
+            rows = await self.__run("iter_videos", cursor.fetchmany, ITER_PAGE_SIZE)
+            if len(rows) == 0:
+                break
+            for document, in rows:
+                document = json.loads(document)
+                if source is not None:
+                    document = {field: document[field] for field in source if field in document}
+                yield document
+
+    async def _get_stats(self, phrases=None):
+        return await self.__run("stats", self.__stats, sorted(set(phrases if phrases is not None else [])))
+
+    async def get_stats_by_phrase(self, phrase: str):
+        return await self.__run("stats", self.__phrase_stats, phrase)
+
+    async def modern_etc_main_channel(self):
+        return await self.__run("stats", self.__modern_etc_main_channel)
+
+    def __stats(self, phrases: list):
+        total, = self.__conn.execute("SELECT COUNT(*) FROM videos").fetchone()
+        total_reuploaded, = self.__conn.execute("SELECT COUNT(*) FROM reuploads").fetchone()
+        collections = dict(self.__conn.execute("SELECT collection, COUNT(*) FROM archived GROUP BY collection").fetchall())
+        total_classic = collections.get("Classic ETC", 0)
+        total_modern = collections.get("Modern ETC", 0)
+        return {
+            'total': total,
+            'total_archived': total_classic + total_modern,
+            'total_reuploaded': total_reuploaded,
+            'total_classic': total_classic,
+            'total_modern': total_modern,
+            'pure_modern_etc_archived': self.__modern_etc_main_channel(),
+            'phrase': {phrase: self.__phrase_stats(phrase) for phrase in phrases}
+        }
+
+    def __phrase_stats(self, phrase: str):
+        expression = QueryTranslator.fts_expression({"match_phrase": {"title": phrase}})
+        if expression is None:
+            return {'total': 0, 'total_reuploaded': 0, 'total_archived': 0}
+        total, reuploaded, archived = self.__conn.execute(
+            "SELECT COUNT(*), "
+            "COALESCE(SUM((SELECT COUNT(*) FROM reuploads r WHERE r.original_id = v.id)), 0), "
+            "COALESCE(SUM(EXISTS (SELECT 1 FROM archived a WHERE a.id = v.id)), 0) "
+            "FROM videos v WHERE v.rowid IN (SELECT rowid FROM videos_fts WHERE videos_fts MATCH ?)", (expression,)).fetchone()
+        return {'total': total, 'total_reuploaded': reuploaded, 'total_archived': archived}
+
+    def __modern_etc_main_channel(self):
+        translator = QueryTranslator()
+        condition = translator.condition(MODERN_ETC_MAIN_CHANNEL_QUERY)
+        total, archived = self.__conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(EXISTS (SELECT 1 FROM archived a WHERE a.id = v.id)), 0) "
+            f"FROM videos v WHERE {condition}", translator.params).fetchone()
+        return archived, total
+
+    def import_documents(self, kind, documents):
+        """
+        Insert (or replace) documents of one of the indexes: kind is "main", "youtube" or "local".
+        Returns the number of documents imported.
+        """
+        count = 0
+        with self.__conn:
+            for document in documents:
+                if kind == "main":
+                    self.__import_video(document)
+                elif kind == "youtube":
+                    self.__conn.execute("INSERT OR REPLACE INTO reuploads VALUES (?, ?)",
+                                        (document['id'], document['original_id']))
+                elif kind == "local":
+                    self.__conn.execute("INSERT OR REPLACE INTO archived VALUES (?, ?, ?, ?)",
+                                        (document['id'], document.get('width'), document.get('height'),
+                                         document.get('collection')))
+                else:
+                    raise ValueError(f"Unknown index {kind}")
+                count += 1
+        return count
+
+    def __import_video(self, document):
+        row = self.__conn.execute("SELECT rowid FROM videos WHERE id = ?", (document['id'],)).fetchone()
+        if row is not None:
+            self.__conn.execute("DELETE FROM videos_fts WHERE rowid = ?", row)
+            self.__conn.execute("DELETE FROM videos WHERE rowid = ?", row)
+        date_published = document.get('date_published')
+        try:
+            date_published = None if date_published is None else _to_epoch(date_published)
+        except ValueError:
+            date_published = None
+        rowid = self.__conn.execute("INSERT INTO videos (id, date_published, document) VALUES (?, ?, ?)",
+                                    (document['id'], date_published, json.dumps(document))).lastrowid
+        values = []
+        for field in TEXT_FIELDS:
+            value = document.get(field)
+            if isinstance(value, list):
+                value = LIST_SEPARATOR.join(str(v) for v in value)
+            values.append(None if value is None else str(value))
+        self.__conn.execute(f"INSERT INTO videos_fts (rowid, {', '.join(TEXT_FIELDS)}) "
+                            f"VALUES (?, {', '.join('?' * len(TEXT_FIELDS))})", [rowid] + values)
+
+    def optimize(self):
+        self.__conn.execute("INSERT INTO videos_fts(videos_fts) VALUES ('optimize')")
+        self.__conn.commit()
+
+    def close(self):
+        self.__executor.shutdown(wait=True)
+        self.__conn.close()
+
+
+async def import_from_elasticsearch(config: dict, path: str):
+    """
+    Copy the three Elasticsearch indexes into a SQLite database at path
+    """
+    from etcdatabase import ETCDatabase
+    es = ETCDatabase(config['elasticsearch']['main_index'], config['elasticsearch']['yt_index'],
+                     config['elasticsearch']['local_index'], hosts=config['elasticsearch']['hosts'])
+    database = SQLiteDatabase(path)
+    for kind, index in (("main", config['elasticsearch']['main_index']),
+                        ("youtube", config['elasticsearch']['yt_index']),
+                        ("local", config['elasticsearch']['local_index'])):
+        count = 0
+        batch = []
+        async for hit in es.iter_documents(index=index):
+            batch.append(hit['_source'])
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                count += database.import_documents(kind, batch)
+                batch = []
+        count += database.import_documents(kind, batch)
+        log.info(f"Imported {count} documents from {index}")
+    database.optimize()
+    database.close()
+    await (await es.get_client()).close()
+
+
+if __name__ == '__main__':
+    import yaml
+    parser = argparse.ArgumentParser(description="Build the SQLite database from the Elasticsearch indexes")
+    parser.add_argument("--config", help="Configuration file", required=True)
+    parser.add_argument("--path", help="SQLite file to write (defaults to database.sqlite.path in the config)")
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+    logging.basicConfig(level=logging.INFO)
+    asyncio.get_event_loop().run_until_complete(
+        import_from_elasticsearch(config, args.path or config['database']['sqlite']['path']))
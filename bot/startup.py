@@ -0,0 +1,146 @@
+import asyncio
+import json
+import logging
+import os
+import time
+log = logging.getLogger('root')
+
+"""
+
+Startup pipeline timings, and warming the bot up while it connects to Discord.
+
+The bot loads its persisted caches and opens its Elasticsearch/IPFS connections concurrently (run_phases),
+then replays the most used queries of its last run into the query cache. Commands wait for the first phases
+(wait_ready), so the first command doesn't hit cold connections or half-loaded caches.
+
+The time from process start to each phase, and to the first command completing, is exported as
+etc_startup_<phase>_seconds. If the first command completes later than target_first_command, a warning is logged.
+
+"""
+
+PHASE_TIMEOUT_S = 15
+READY_WAIT_TIMEOUT_S = 30
+FIRST_COMMAND_TARGET_S = 20
+WARM_QUERIES = 50
+WARM_QUERY_CONCURRENCY = 2
+WARM_QUERIES_SAVE_INTERVAL_S = 600
+
+
+class Startup:
+
+    def __init__(self, target_first_command=FIRST_COMMAND_TARGET_S):
+        self.started_at = time.monotonic()
+        self.target_first_command = target_first_command
+        self.phases = {}  # phase -> seconds from start to the end of the phase
+        self.__ready = asyncio.Event()
+
+    def mark(self, phase):
+        """
+        Record that phase ended now, if it wasn't recorded already. Returns the seconds since start.
+        """
+        if phase not in self.phases:
+            self.phases[phase] = time.monotonic() - self.started_at
+            log.info(f"Startup: {phase} after {self.phases[phase]:.2f}s")
+        return self.phases[phase]
+
+    async def run_phases(self, timeout=PHASE_TIMEOUT_S, **phases):
+        """
+        Run the phase coroutines ({name: coroutine}) concurrently, each for at most timeout seconds.
+        A phase that fails or times out is logged and doesn't stop the others.
+        """
+        async def _run(name, coroutine):
+            try:
+                await asyncio.wait_for(coroutine, timeout=timeout)
+            except asyncio.TimeoutError:
+                log.error(f"Startup: {name} timed out after {timeout}s")
+            except Exception as e:
+                log.error(f"Startup: {name} failed: {e}")
+            self.mark(name)
+
+        await asyncio.gather(*(_run(name, coroutine) for name, coroutine in phases.items()))
+
+    async def run(self, phases: dict, warm=None, timeout=PHASE_TIMEOUT_S):
+        """
+        Run the phases ({name: coroutine}, see run_phases), mark the bot ready, then await warm() if given:
+        the warm up that commands don't wait for.
+        """
+        await self.run_phases(timeout=timeout, **phases)
+        self.set_ready()
+        if warm is not None:
+            await warm()
+
+    def set_ready(self):
+        self.mark("ready")
+        self.__ready.set()
+
+    def is_ready(self):
+        return self.__ready.is_set()
+
+    async def wait_ready(self, timeout=READY_WAIT_TIMEOUT_S):
+        if self.__ready.is_set():
+            return
+        try:
+            await asyncio.wait_for(self.__ready.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            log.warning(f"Running a command before the bot is warmed up (waited {timeout}s)")
+
+    def command_finished(self):
+        if "first_command" in self.phases:
+            return
+        elapsed = self.mark("first_command")
+        if elapsed > self.target_first_command:
+            log.warning(f"First command completed {elapsed:.2f}s after startup, "
+                        f"over the target of {self.target_first_command}s")
+
+    def stats(self):
+        return {**{f"{phase}_seconds": seconds for phase, seconds in self.phases.items()},
+                'target_first_command_seconds': self.target_first_command}
+
+
+def load_warm_queries(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError, OSError):
+        return []
+
+
+def save_warm_queries(path, queries):
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(queries, f)
+        os.replace(tmp_path, path)
+    except OSError:
+        log.error("Failed to write warm queries file")
+
+
+async def warm_queries(queries, run_query, concurrency=WARM_QUERY_CONCURRENCY):
+    """
+    Run every query with run_query(query), at most concurrency at a time. Returns how many succeeded.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _warm(query):
+        async with semaphore:
+            try:
+                await run_query(query)
+                return True
+            except Exception as e:
+                log.debug(f"Failed to warm query {query}: {e}")
+                return False
+
+    warmed = sum(await asyncio.gather(*(_warm(query) for query in queries)))
+    log.info(f"Warmed {warmed}/{len(queries)} queries")
+    return warmed
+
+
+async def start_warm_queries_saver(path, top_queries, count=WARM_QUERIES, interval=WARM_QUERIES_SAVE_INTERVAL_S):
+    """
+    Save the count most used queries (top_queries(count)) to path every interval, to warm the next start with
+    """
+    while True:
+        await asyncio.sleep(interval)
+        queries = top_queries(count)
+        if len(queries) > 0:
+            save_warm_queries(path, queries)
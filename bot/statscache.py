@@ -0,0 +1,152 @@
+import asyncio
+import copy
+import json
+import logging
+import os
+import time
+from const import TITLE_PHRASES, MERGE_PHRASE
+log = logging.getLogger('root')
+
+"""
+
+Keeps a snapshot of the database statistics so !stats doesn't hit the database every time.
+
+The full snapshot (including the per-series phrase stats) is computed at startup and on a schedule,
+persisted to disk so restarts are warm, and refreshed in the background once it is older than the TTL.
+Given a shared key-value store, the snapshot is also published there, so the other bot processes pick up
+a refresh instead of each querying the database.
+
+"""
+
+
+class StatsSnapshot:
+
+    NAMESPACE = "stats"
+
+    def __init__(self, db, cache_file=None, ttl=3600, refresh_interval=3600, phrases=None, shared_store=None):
+        self.__db = db
+        self.__cache_file = cache_file
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self.__phrases = TITLE_PHRASES if phrases is None else phrases
+        self.__stats = None
+        self.as_of = None
+        self.__refresh_task = None
+        self.__shared_store = shared_store
+        self.__load()
+        self.__load_shared()
+
+    def __load(self):
+        if self.__cache_file is None:
+            return
+        try:
+            with open(self.__cache_file) as f:
+                data = json.load(f)
+            self.__stats = data['stats']
+            self.as_of = data['as_of']
+            log.debug(f"Loaded stats snapshot from cache (as of {self.as_of})")
+        except (FileNotFoundError, json.JSONDecodeError, OSError, KeyError):
+            pass
+
+    def __load_shared(self):
+        # Use the shared snapshot if it is newer than ours
+        if self.__shared_store is None:
+            return
+        data = self.__shared_store.get(self.NAMESPACE, "snapshot")
+        if data is None:
+            return
+        try:
+            data = json.loads(data)
+            if self.as_of is None or data['as_of'] > self.as_of:
+                self.__stats, self.as_of = data['stats'], data['as_of']
+                log.debug(f"Loaded shared stats snapshot (as of {self.as_of})")
+        except (json.JSONDecodeError, KeyError, TypeError):
+            log.error("Ignoring invalid shared stats snapshot")
+
+    async def __save(self):
+        if self.__shared_store is not None:
+            await self.__shared_store.set(self.NAMESPACE, "snapshot", json.dumps({'as_of': self.as_of, 'stats': self.__stats}))
+        if self.__cache_file is None:
+            return
+        tmp_file = self.__cache_file + ".tmp"
+        try:
+            with open(tmp_file, 'w') as f:
+                json.dump({'as_of': self.as_of, 'stats': self.__stats}, f)
+            os.replace(tmp_file, self.__cache_file)
+        except OSError:
+            log.error("Failed to write stats snapshot to cache file")
+
+    def is_stale(self):
+        return self.as_of is None or time.time() - self.as_of > self.ttl
+
+    async def __refresh(self):
+        log.info("Refreshing stats snapshot...")
+        stats = await self.__db.get_stats(phrases=self.__phrases)
+        self.__stats = json.loads(json.dumps(stats))  # same shape as when loaded from the cache file
+        self.as_of = time.time()
+        await self.__save()
+        log.info("Stats snapshot refreshed")
+
+    async def refresh(self):
+        """
+        Refresh the snapshot. Concurrent callers share the same refresh.
+        """
+        if self.__refresh_task is None or self.__refresh_task.done():
+            self.__refresh_task = asyncio.ensure_future(self.__refresh())
+        await asyncio.shield(self.__refresh_task)
+
+    def refresh_in_background(self):
+        if self.__refresh_task is not None and not self.__refresh_task.done():
+            return
+        self.__refresh_task = asyncio.ensure_future(self.__refresh())
+        self.__refresh_task.add_done_callback(self.__log_refresh_error)
+
+    @staticmethod
+    def __log_refresh_error(task):
+        if not task.cancelled() and task.exception() is not None:
+            log.error(f"Failed to refresh stats snapshot: {task.exception()}")
+
+    async def get(self, series=False):
+        """
+        Returns a tuple of (stats, as_of epoch).
+        Only waits on the database if there is no snapshot at all, otherwise a stale snapshot is
+        returned straight away and refreshed in the background.
+        """
+        if self.__stats is None or self.is_stale():
+            self.__load_shared()
+        if self.__stats is None:
+            await self.refresh()
+        elif self.is_stale():
+            self.refresh_in_background()
+
+        stats = copy.deepcopy(self.__stats)
+        if not series:
+            stats['phrase'] = {}
+        return stats, self.as_of
+
+    async def start_refresher(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                log.error(f"Failed to refresh stats snapshot: {e}")
+            await asyncio.sleep(self.refresh_interval)
+
+
+def merge_phrase_stats(phrase_stats: dict):
+    """
+    Merge the stats of phrases that are the same series (see MERGE_PHRASE)
+    """
+    for merge_pair in MERGE_PHRASE:
+        _data = {}
+        for merge in MERGE_PHRASE[merge_pair]:
+            try:
+                for key in phrase_stats[merge]:
+                    _data.setdefault(key, 0)
+                    _data[key] += int(phrase_stats[merge][key])
+                del phrase_stats[merge]
+            except KeyError:
+                continue
+        if len(_data) != 0:
+            phrase_stats[merge_pair] = _data
+    return phrase_stats
@@ -0,0 +1,176 @@
+import asyncio
+import bisect
+import logging
+import math
+import re
+import time
+from array import array
+from collections import Counter
+from const import ID_FIELD
+log = logging.getLogger('root')
+
+"""
+
+Typo tolerant "did you mean" suggestions for searches with no results.
+
+Every title and alternate title of the main index is split into trigrams, with a posting list (array of title
+numbers) per trigram. A lookup counts how many of the query's rarest trigrams each title has, then ranks
+the best of those by similarity (shared trigrams / union of the two trigram sets).
+Prefix completion, e.g for autocomplete, uses a sorted list of the normalized titles.
+
+"""
+
+SUGGEST_REFRESH_INTERVAL_S = 3600
+SUGGEST_MAX_RESULTS = 5
+SUGGEST_MIN_SIMILARITY = 0.3
+# Titles (by shared rare trigrams) whose exact similarity is computed, per result asked for
+CANDIDATES_PER_RESULT = 20
+# Bounds the lookup time: on 150k titles, counting at most 20k postings keeps typo recall the same
+# and takes the lookup from ~20ms to ~6ms (benchmarks/bench_suggest.py)
+MAX_COUNTED_POSTINGS = 20000
+_NON_WORD = re.compile(r"[\W_]+")
+
+
+def normalize(text):
+    return _NON_WORD.sub(" ", str(text).lower()).strip()
+
+
+def trigrams(normalized):
+    padded = f"  {normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TitleSuggester:
+
+    def __init__(self):
+        self.__titles = []  # title number -> original title
+        self.__video_ids = []  # title number -> video id
+        self.__sizes = array('H')  # title number -> trigram count
+        self.__postings = {}  # trigram -> array of title numbers
+        self.__sorted = []  # (normalized title, title number), for prefix completion
+        self.loaded_at = None
+        self.lookups = 0
+
+    def __len__(self):
+        return len(self.__titles)
+
+    def is_ready(self):
+        return self.loaded_at is not None
+
+    async def load(self, db):
+        """
+        Read the titles from the backend, and build the index off the event loop
+        """
+        entries = []
+        async for source in db.iter_videos(source=[ID_FIELD, 'title', 'alternate_titles']):
+            video_id = source.get(ID_FIELD)
+            titles = [source.get('title')] + list(source.get('alternate_titles') or [])
+            for title in dict.fromkeys(titles):
+                if title and normalize(title):
+                    entries.append((title, video_id))
+        await asyncio.get_event_loop().run_in_executor(None, self.build, entries)
+        log.info(f"Built title suggestions for {len(entries)} titles (~{self.memory_bytes()} bytes)")
+
+    def build(self, entries):
+        """
+        Build the index from (title, video id) pairs and swap it in
+        """
+        titles = []
+        video_ids = []
+        sizes = array('H')
+        postings = {}
+        normalized_titles = []
+        for number, (title, video_id) in enumerate(entries):
+            normalized = normalize(title)
+            grams = trigrams(normalized)
+            titles.append(title)
+            video_ids.append(video_id)
+            sizes.append(min(len(grams), 0xFFFF))
+            normalized_titles.append((normalized, number))
+            for gram in grams:
+                posting = postings.get(gram)
+                if posting is None:
+                    posting = postings[gram] = array('I')
+                posting.append(number)
+        normalized_titles.sort()
+        self.__titles, self.__video_ids, self.__sizes = titles, video_ids, sizes
+        self.__postings, self.__sorted = postings, normalized_titles
+        self.loaded_at = time.time()
+
+    async def start_refresher(self, db, refresh_interval=SUGGEST_REFRESH_INTERVAL_S):
+        while True:
+            try:
+                await self.load(db)
+            except Exception as e:
+                log.error(f"Failed to build title suggestions: {e}")
+            await asyncio.sleep(refresh_interval)
+
+    def suggest(self, query, k=SUGGEST_MAX_RESULTS, min_similarity=SUGGEST_MIN_SIMILARITY):
+        """
+        Returns up to k (title, video id, similarity) closest to query, best first, one per distinct title
+        """
+        self.lookups += 1
+        grams = trigrams(normalize(query))
+        if len(self.__titles) == 0 or len(grams) == 0:
+            return []
+
+        # A title with similarity >= min_similarity shares at least ceil(min_similarity * len(grams)) trigrams
+        # with the query, so it has one of the len(grams) - that + 1 rarest: only those postings are counted,
+        # rarest first, up to MAX_COUNTED_POSTINGS entries
+        postings = sorted((self.__postings.get(gram, ()) for gram in grams), key=len)
+        required = max(1, math.ceil(min_similarity * len(grams)))
+        shared = Counter()
+        counted = 0
+        for posting in postings[:len(grams) - required + 1]:
+            if counted > 0 and counted + len(posting) > MAX_COUNTED_POSTINGS:
+                break
+            shared.update(posting)
+            counted += len(posting)
+
+        # Then the best candidates are scored exactly
+        scored = []
+        for number, _ in shared.most_common(k * CANDIDATES_PER_RESULT):
+            count = len(grams & trigrams(normalize(self.__titles[number])))
+            scored.append((count / (len(grams) + self.__sizes[number] - count), number))
+        scored.sort(reverse=True)
+
+        results = []
+        seen = set()
+        for similarity, number in scored:
+            if similarity < min_similarity or len(results) == k:
+                break
+            key = normalize(self.__titles[number])
+            if key in seen:
+                continue
+            seen.add(key)
+            results.append((self.__titles[number], self.__video_ids[number], round(similarity, 3)))
+        return results
+
+    def complete(self, prefix, k=SUGGEST_MAX_RESULTS):
+        """
+        Returns up to k (title, video id) starting with prefix, e.g for autocomplete. Falls back to suggest().
+        """
+        prefix = normalize(prefix)
+        results = []
+        seen = set()
+        i = bisect.bisect_left(self.__sorted, (prefix, -1))
+        while i < len(self.__sorted) and len(results) < k and self.__sorted[i][0].startswith(prefix):
+            normalized, number = self.__sorted[i]
+            if normalized not in seen:
+                seen.add(normalized)
+                results.append((self.__titles[number], self.__video_ids[number]))
+            i += 1
+        if len(results) < k:
+            for title, video_id, _ in self.suggest(prefix, k=k):
+                if normalize(title) not in seen and len(results) < k:
+                    seen.add(normalize(title))
+                    results.append((title, video_id))
+        return results
+
+    def memory_bytes(self):
+        postings = sum(posting.itemsize * len(posting) for posting in self.__postings.values())
+        return (postings + self.__sizes.itemsize * len(self.__sizes) + sum(len(title) for title in self.__titles) +
+                sum(len(str(video_id)) for video_id in self.__video_ids) + sum(len(n) for n, _ in self.__sorted))
+
+    def stats(self):
+        return {'titles': len(self), 'trigrams': len(self.__postings), 'bytes': self.memory_bytes(), 'lookups': self.lookups}
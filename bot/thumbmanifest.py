@@ -0,0 +1,92 @@
+import hashlib
+import logging
+import math
+import os
+import sqlite3
+log = logging.getLogger("root")
+
+"""
+
+On-disk manifest of the thumbnail folder: video id -> IPFS path of the thumbnail.
+
+Built once per thumbnail folder hash by listing the folder tree, so looking up a thumbnail
+is a local SQLite lookup instead of an IPFS resolve. A bloom filter of the ids is kept in
+memory to answer "no thumbnail" without touching the database.
+
+"""
+
+BLOOM_FALSE_POSITIVE_RATE = 0.01
+
+
+class BloomFilter:
+
+    def __init__(self, capacity, false_positive_rate=BLOOM_FALSE_POSITIVE_RATE):
+        capacity = max(capacity, 1)
+        self.num_bits = max(8, int(-capacity * math.log(false_positive_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.__bits = bytearray((self.num_bits + 7) // 8)
+
+    def __positions(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.num_bits for i in range(self.num_hashes))
+
+    def add(self, item: str):
+        for position in self.__positions(item):
+            self.__bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str):
+        return all(self.__bits[position >> 3] & (1 << (position & 7)) for position in self.__positions(item))
+
+
+class ThumbManifest:
+
+    def __init__(self, path):
+        """
+        Open an existing manifest. Raises sqlite3.Error if it doesn't exist or is invalid.
+        """
+        self.path = path
+        self.__conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        try:
+            self.folder_hash = self.__conn.execute("SELECT value FROM meta WHERE key = 'folder_hash'").fetchone()[0]
+            count = self.__conn.execute("SELECT COUNT(*) FROM thumbs").fetchone()[0]
+            self.__filter = BloomFilter(count)
+            for video_id, in self.__conn.execute("SELECT video_id FROM thumbs"):
+                self.__filter.add(video_id)
+        except (sqlite3.Error, TypeError):
+            self.__conn.close()
+            raise sqlite3.DatabaseError(f"Invalid thumbnail manifest {path}")
+        self.count = count
+
+    def lookup(self, video_id):
+        """
+        Returns the IPFS path of the thumbnail for video_id, or None if there isn't one.
+        """
+        if video_id not in self.__filter:
+            return None
+        row = self.__conn.execute("SELECT path FROM thumbs WHERE video_id = ?", (video_id,)).fetchone()
+        return None if row is None else row[0]
+
+    def close(self):
+        self.__conn.close()
+
+    @staticmethod
+    def build(path, folder_hash, entries):
+        """
+        Write a new manifest for folder_hash from (video id, ipfs path) entries.
+        The manifest is written to a temporary file and swapped in atomically.
+        """
+        tmp_path = path + ".tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        conn = sqlite3.connect(tmp_path)
+        try:
+            conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+            conn.execute("CREATE TABLE thumbs (video_id TEXT PRIMARY KEY, path TEXT NOT NULL) WITHOUT ROWID")
+            conn.executemany("INSERT OR REPLACE INTO thumbs VALUES (?, ?)", entries)
+            conn.execute("INSERT INTO meta VALUES ('folder_hash', ?)", (folder_hash,))
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(tmp_path, path)
@@ -2,89 +2,355 @@ import asyncio
 import aioipfs
 import aiohttp
 import logging
-import random
 import json
+import sqlite3
+import time
+from cache import LRUCache
+from gateways import GatewaySelector
+from thumbmanifest import ThumbManifest
+from singleflight import SingleFlight
+from metrics import metrics
 log = logging.getLogger("root")
 
-TRUSTED_PUBLIC_IPFS_GATEWAYS = ("https://ipfs.io", "https://dweb.link", "https://gateway.ipfs.io", "https://cloudflare-ipfs.com")
 RECHECK_IPNS_TIME_S = 18000
 IPFS_THUMBNAIL_GET_TIMEOUT = 3
+THUMB_PATH_CACHE_SIZE = 10000
+MISSING_THUMB_TTL_S = 600  # how long a thumbnail that doesn't exist is remembered, as it may be added later
+# IPFS API error messages meaning the thumbnail doesn't exist, rather than a transient failure
+NOT_FOUND_MESSAGES = ("no link named", "not found")
+THUMB_PATH_CACHE_SAVE_EVERY = 50  # persist the thumb path cache after this many new entries
+FOLDER_FOLLOW_INTERVAL_S = 30
+THUMB_NAMESPACE = "thumbnails"  # shared store: the current thumb folder hash
+THUMB_PATH_NAMESPACE = "thumb_paths"  # shared store: "<folder hash>/<video id>" -> resolved path (JSON)
+
+_MISSING = object()
 
 
 class IPFSThumbnailHandler:
 
     def __init__(self, ipns_hash, cache_file=None,
                  ipfs_host=None,
-                 ipfs_port=None):
+                 ipfs_port=None,
+                 thumb_path_cache_size=THUMB_PATH_CACHE_SIZE,
+                 persist_thumb_paths=True,
+                 manifest_file=None,
+                 gateway_selector=None,
+                 shared_store=None):
+        """
+        shared_store: key-value store shared with the other bot processes (see kvstore). The process running
+        start_ipns_checker() publishes the thumb folder hash to it, the others run start_folder_follower().
+        Resolved thumbnail paths are shared through it instead of being persisted to cache_file.
+        """
         self.__ipns_hash = ipns_hash
         self.__ipfs_thumb_folder_hash = None
         self.__ipfs_client = aioipfs.AsyncIPFS(host='localhost' if ipfs_host is None else ipfs_host,
                                                port=5001 if ipfs_port is None else ipfs_port)
         self.__cache_file = cache_file
+        self.single_flight = SingleFlight()
+        self.gateway_selector = GatewaySelector() if gateway_selector is None else gateway_selector
+        # video id -> resolved thumbnail path, for the current thumb folder hash
+        self.thumb_paths = LRUCache(max_entries=thumb_path_cache_size)
+        # video id -> time.monotonic() until which the thumbnail is known not to exist. Never persisted
+        self.missing_thumbs = LRUCache(max_entries=thumb_path_cache_size)
+        self.__shared_store = shared_store
+        self.__thumb_path_cache_size = thumb_path_cache_size
+        self.__persist_thumb_paths = persist_thumb_paths and shared_store is None
+        self.__unsaved_thumb_paths = 0
+        self.__manifest_file = manifest_file
+        self.__manifest = None
+        self.__manifest_task = None
+        self.__pin_task = None
+        self.__pin_task_hash = None
+
+    def __read_caches(self):
+        # (cache file data, manifest), read off the event loop as building the manifest's filter takes a while
+        data = {}
+        manifest = None
         if self.__cache_file is not None:
             try:
                 with open(self.__cache_file) as f:
-                    self.__ipfs_thumb_folder_hash = json.load(f).get('thumb_folder_hash')
-                    log.debug(f"Loaded thumb_folder_hash from cache: {self.__ipfs_thumb_folder_hash}")
+                    data = json.load(f)
             except (FileNotFoundError, json.JSONDecodeError, OSError):
                 pass
+        if self.__manifest_file is not None:
+            try:
+                manifest = ThumbManifest(self.__manifest_file)
+            except sqlite3.Error:
+                pass
+        return data, manifest
+
+    async def load_caches(self):
+        """
+        Load the thumb folder hash and thumb paths saved in the cache file, and the thumbnail manifest
+        """
+        data, manifest = await asyncio.get_event_loop().run_in_executor(None, self.__read_caches)
+        if self.__ipfs_thumb_folder_hash is None and isinstance(data, dict):  # unless resolved in the meantime
+            self.__ipfs_thumb_folder_hash = data.get('thumb_folder_hash')
+            log.debug(f"Loaded thumb_folder_hash from cache: {self.__ipfs_thumb_folder_hash}")
+            if self.__persist_thumb_paths:
+                for video_id, path in data.get('thumb_paths', {}).items():
+                    if path is not None:
+                        self.thumb_paths.set(video_id, path)
+                log.debug(f"Loaded {len(self.thumb_paths)} thumb paths from cache")
+        if manifest is not None:
+            if self.__manifest is None:
+                self.__manifest = manifest
+                log.debug(f"Loaded thumbnail manifest for {manifest.folder_hash} ({manifest.count} thumbnails)")
+            else:
+                manifest.close()
+
+    async def warm_up(self):
+        """
+        Open the connection to the IPFS API
+        """
+        async with metrics.track("ipfs", "id"):
+            await self.__ipfs_client.core.id()
 
     async def __save_thumb_folder_hash(self, t_hash):
+        if self.__cache_file is None:
+            return
+        data = {'thumb_folder_hash': t_hash}
+        if self.__persist_thumb_paths and t_hash == self.__ipfs_thumb_folder_hash:
+            data['thumb_paths'] = dict(self.thumb_paths.items())
         try:
             with open(self.__cache_file, 'w') as f:
                 log.debug(f"Writing thumb_folder_hash to cache file: {self.__cache_file}")
-                json.dump({'thumb_folder_hash': t_hash}, f)
+                json.dump(data, f)
+            self.__unsaved_thumb_paths = 0
         except (FileNotFoundError, json.JSONDecodeError, OSError):
             log.error("Failed to write thumb_folder_hash to cache file")
 
-    async def __update_pins(self):
+    async def __set_thumb_folder_hash(self, t_hash, publish=True):
+        """
+        publish: save the hash to the cache file and the shared store (only done by the IPNS checker)
+        """
+        if t_hash != self.__ipfs_thumb_folder_hash:
+            log.info(f"Thumbnail folder changed to {t_hash}, clearing thumb path cache")
+            self.thumb_paths.clear()
+            self.missing_thumbs.clear()
+            if publish and self.__shared_store is not None:
+                await self.__shared_store.clear(THUMB_PATH_NAMESPACE)
+        self.__ipfs_thumb_folder_hash = t_hash
+        if publish:
+            if self.__shared_store is not None:
+                await self.__shared_store.set(THUMB_NAMESPACE, "folder_hash", t_hash)
+            await self.__save_thumb_folder_hash(t_hash)
+
+    async def __cache_thumb_path(self, folder_hash, video_id, path):
+        """
+        path: the resolved thumbnail path, or None if the thumbnail doesn't exist (remembered for MISSING_THUMB_TTL_S)
+        """
+        if folder_hash != self.__ipfs_thumb_folder_hash:
+            return  # folder changed while resolving
+        if path is None:
+            self.missing_thumbs.set(video_id, time.monotonic() + MISSING_THUMB_TTL_S)
+            if self.__shared_store is not None:
+                await self.__shared_store.set(THUMB_PATH_NAMESPACE, f"{folder_hash}/{video_id}", json.dumps(None),
+                                              ttl=MISSING_THUMB_TTL_S)
+            return
+        self.thumb_paths.set(video_id, path)
+        self.__unsaved_thumb_paths += 1
+        if self.__shared_store is not None:
+            await self.__shared_store.set(THUMB_PATH_NAMESPACE, f"{folder_hash}/{video_id}", json.dumps(path))
+            if self.__unsaved_thumb_paths >= THUMB_PATH_CACHE_SAVE_EVERY:
+                await self.__shared_store.evict(THUMB_PATH_NAMESPACE, max_entries=self.__thumb_path_cache_size)
+                self.__unsaved_thumb_paths = 0
+        elif self.__persist_thumb_paths and self.__unsaved_thumb_paths >= THUMB_PATH_CACHE_SAVE_EVERY:
+            await self.__save_thumb_folder_hash(folder_hash)
+
+    def __get_shared_thumb_path(self, folder_hash, video_id):
+        data = self.__shared_store.get(THUMB_PATH_NAMESPACE, f"{folder_hash}/{video_id}")
+        if data is None:
+            return _MISSING
+        path = json.loads(data)
+        if path is None:
+            self.missing_thumbs.set(video_id, time.monotonic() + MISSING_THUMB_TTL_S)
+        else:
+            self.thumb_paths.set(video_id, path)
+        return path
+
+    def __is_missing(self, video_id):
+        missing_until = self.missing_thumbs.get(video_id)
+        if missing_until is None:
+            return False
+        if missing_until <= time.monotonic():
+            self.missing_thumbs.pop(video_id)
+            return False
+        return True
+
+    async def __update_pins(self, folder_hash, after=None):
         """
         Ensure latest thumbnail folder to IPFS
+
+        after: pin task to wait for first
         """
+        if after is not None:
+            await asyncio.wait([after])
         log.info("Updating IPFS thumb folder pin...")
         current_prog = None
-        if self.__ipfs_thumb_folder_hash is None:
+        if folder_hash is None:
             log.error("Failed to update thumb folder pin: ipfs_thumb_folder_hash is yet to be resolved!")
-        async for status in self.__ipfs_client.pin.add(self.__ipfs_thumb_folder_hash, recursive=True, progress=True):
-            try:
-                if status['Progress'] != current_prog:
-                    current_prog = status['Progress']
-                    log.debug(f"Thumb folder pin adding progress: Fetched/Processed {current_prog} nodes.")
-            except (IndexError, KeyError):
-                continue
+            return
+        async with metrics.track("ipfs", "pin_add"):
+            async for status in self.__ipfs_client.pin.add(folder_hash, recursive=True, progress=True):
+                try:
+                    if status['Progress'] != current_prog:
+                        current_prog = status['Progress']
+                        log.debug(f"Thumb folder pin adding progress: Fetched/Processed {current_prog} nodes.")
+                except (IndexError, KeyError):
+                    continue
         log.info("Completed adding thumb folder to IPFS client pins.")
-        pinned = await self.__ipfs_client.pin.ls()
+        async with metrics.track("ipfs", "pin_ls"):
+            pinned = await self.__ipfs_client.pin.ls()
         log.debug(f"Pins: {pinned}")
 
+    def __pin_in_background(self):
+        # Pinning the whole folder takes a while, so it never holds up resolving the folder (or startup)
+        folder_hash = self.__ipfs_thumb_folder_hash
+        previous = None
+        if self.__pin_task is not None and not self.__pin_task.done():
+            if self.__pin_task_hash == folder_hash:
+                return
+            previous = self.__pin_task  # pin the new folder once the current pin is done
+        self.__pin_task = asyncio.ensure_future(self.__update_pins(folder_hash, after=previous))
+        self.__pin_task_hash = folder_hash
+        self.__pin_task.add_done_callback(self.__log_pin_error)
+
+    @staticmethod
+    def __log_pin_error(task):
+        if not task.cancelled() and task.exception() is not None:
+            log.critical(f"Failed to update thumb folder pin: {task.exception()}")
+
     async def start_ipns_checker(self):
-        await self.__update_pins()  # make sure cached file is pinned
+        try:
+            await self.__check_ipns()
+        finally:
+            if self.__pin_task is not None:
+                self.__pin_task.cancel()
+
+    async def __check_ipns(self):
+        self.__pin_in_background()  # make sure cached file is pinned
         while True:
             try:
                 # Resolve for the root folder
-                root_folder = await self.__ipfs_client.core.resolve("/ipns/" + self.__ipns_hash)
+                async with metrics.track("ipfs", "resolve_ipns"):
+                    root_folder = await self.__ipfs_client.core.resolve("/ipns/" + self.__ipns_hash)
                 log.debug(f"Resolved to {root_folder.get('Path')}")
                 # Now get the hash for the ETC_DATABASE_THUMBNAILS folder
-                thumb_folder = await self.__ipfs_client.core.resolve(root_folder.get('Path') + "/ETC_DATABASE_THUMBNAILS")
+                async with metrics.track("ipfs", "resolve_thumb_folder"):
+                    thumb_folder = await self.__ipfs_client.core.resolve(root_folder.get('Path') + "/ETC_DATABASE_THUMBNAILS")
                 log.debug(f"Resolved thumbnail folder {thumb_folder}")
-                self.__ipfs_thumb_folder_hash = thumb_folder.get('Path')
-                await self.__save_thumb_folder_hash(thumb_folder.get('Path'))
-                await self.__update_pins()
+                await self.__set_thumb_folder_hash(thumb_folder.get('Path'))
+                self.__schedule_manifest_rebuild()
+                self.__pin_in_background()
             except aioipfs.APIError:
                 log.critical("Failed to get latest thumbnail folder IPFS hash.")
             await asyncio.sleep(RECHECK_IPNS_TIME_S)
 
-    @staticmethod
-    async def get_random_gateway():
-        return random.choice(TRUSTED_PUBLIC_IPFS_GATEWAYS)
+    async def start_folder_follower(self, interval=FOLDER_FOLLOW_INTERVAL_S):
+        """
+        Follow the thumb folder hash published to the shared store by the process running the IPNS checker,
+        and open the manifest it builds, instead of resolving and pinning the folder again
+        """
+        while True:
+            try:
+                folder_hash = self.__shared_store.get(THUMB_NAMESPACE, "folder_hash")
+                if folder_hash is not None and folder_hash != self.__ipfs_thumb_folder_hash:
+                    await self.__set_thumb_folder_hash(folder_hash, publish=False)
+                if self.__manifest_file is not None and self.__ipfs_thumb_folder_hash is not None and \
+                        (self.__manifest is None or self.__manifest.folder_hash != self.__ipfs_thumb_folder_hash):
+                    await self.__reopen_manifest(self.__ipfs_thumb_folder_hash)
+            except sqlite3.Error as e:
+                log.error(f"Failed to follow the thumbnail folder: {e}")
+            await asyncio.sleep(interval)
+
+    async def __reopen_manifest(self, folder_hash):
+        try:
+            manifest = await asyncio.get_event_loop().run_in_executor(None, ThumbManifest, self.__manifest_file)
+        except sqlite3.Error:
+            return  # not built yet
+        if manifest.folder_hash != folder_hash:
+            manifest.close()
+            return
+        old_manifest, self.__manifest = self.__manifest, manifest
+        if old_manifest is not None:
+            old_manifest.close()
+        log.info(f"Opened thumbnail manifest for {folder_hash} ({manifest.count} thumbnails)")
+
+    def __schedule_manifest_rebuild(self):
+        folder_hash = self.__ipfs_thumb_folder_hash
+        if self.__manifest_file is None or folder_hash is None:
+            return
+        if self.__manifest is not None and self.__manifest.folder_hash == folder_hash:
+            return
+        if self.__manifest_task is not None and not self.__manifest_task.done():
+            return
+        self.__manifest_task = asyncio.ensure_future(self.__rebuild_manifest(folder_hash))
+
+    async def __rebuild_manifest(self, folder_hash):
+        """
+        List the thumbnail folder tree (<folder>/<first char>/<id>.jpg) and build a new manifest from it.
+        Lookups keep using the old manifest (or live resolves) until the new one is swapped in.
+        """
+        log.info(f"Building thumbnail manifest for {folder_hash}...")
+        entries = []
+        try:
+            async with metrics.track("ipfs", "ls"):
+                root = await self.__ipfs_client.core.ls(folder_hash)
+            for sub_folder in root['Objects'][0]['Links']:
+                async with metrics.track("ipfs", "ls"):
+                    listing = await self.__ipfs_client.core.ls(f"{folder_hash}/{sub_folder['Name']}")
+                for link in listing['Objects'][0]['Links']:
+                    if link['Name'].endswith(".jpg"):
+                        entries.append((link['Name'][:-len(".jpg")], "/ipfs/" + link['Hash']))
+        except (aioipfs.APIError, aiohttp.ClientError, KeyError, IndexError) as e:
+            log.error(f"Failed to list thumbnail folder for manifest: {e}")
+            return
+
+        loop = asyncio.get_event_loop()
+        try:
+            await loop.run_in_executor(None, ThumbManifest.build, self.__manifest_file, folder_hash, entries)
+            manifest = await loop.run_in_executor(None, ThumbManifest, self.__manifest_file)
+        except (sqlite3.Error, OSError) as e:
+            log.error(f"Failed to build thumbnail manifest: {e}")
+            return
+
+        old_manifest, self.__manifest = self.__manifest, manifest
+        if old_manifest is not None:
+            old_manifest.close()
+        log.info(f"Thumbnail manifest built for {folder_hash} ({manifest.count} thumbnails)")
+
+    async def get_gateway(self):
+        return self.gateway_selector.best()
 
     async def get_thumb_url(self, video_id):
-        gateway = await self.get_random_gateway()
+        # Concurrent lookups of the same thumbnail share one resolve
+        return await self.single_flight.do(video_id, lambda: self.__get_thumb_url(video_id))
+
+    async def __get_thumb_url(self, video_id):
+        gateway = await self.get_gateway()
+        folder_hash = self.__ipfs_thumb_folder_hash
+        if self.__manifest is not None and self.__manifest.folder_hash == folder_hash:
+            path = self.__manifest.lookup(video_id)
+            return None if path is None else gateway + path
+        if self.__is_missing(video_id):
+            return None
+        path = self.thumb_paths.get(video_id, _MISSING)
+        if path is _MISSING and self.__shared_store is not None and folder_hash is not None:
+            path = self.__get_shared_thumb_path(folder_hash, video_id)
+        if path is not _MISSING:
+            return None if path is None else gateway + path
         try:
-            data = await asyncio.wait_for(self.__ipfs_client.core.resolve(self.__ipfs_thumb_folder_hash + f"/{video_id[0]}/{video_id}.jpg"), timeout=IPFS_THUMBNAIL_GET_TIMEOUT)
+            async with metrics.track("ipfs", "resolve_thumb"):
+                data = await asyncio.wait_for(self.__ipfs_client.core.resolve(self.__ipfs_thumb_folder_hash + f"/{video_id[0]}/{video_id}.jpg"), timeout=IPFS_THUMBNAIL_GET_TIMEOUT)
             log.debug(f"Resolved thumbnail to {data['Path']}")
-        except aioipfs.APIError:
-            log.critical(f"Failed to get IPFS hash for thumbnail {video_id}.jpg (doesn't exist?)")
-            return None
+        except aioipfs.APIError as e:
+            if any(message in str(e.message).lower() for message in NOT_FOUND_MESSAGES):
+                log.info(f"Thumbnail {video_id}.jpg doesn't exist")
+                await self.__cache_thumb_path(folder_hash, video_id, None)
+                return None
+            log.error(f"Failed to get IPFS hash for thumbnail {video_id}.jpg ({e.message}). Returning file path instead.")
+            return gateway + self.__ipfs_thumb_folder_hash + f"/{video_id[0]}/{video_id}.jpg"
         except asyncio.TimeoutError:
             log.error(f"Failed to get IPFS hash for thumbnail {video_id}.jpg (timed out). Returning file path instead.")
             return gateway + self.__ipfs_thumb_folder_hash + f"/{video_id[0]}/{video_id}.jpg"
@@ -95,8 +361,9 @@ class IPFSThumbnailHandler:
         except TypeError:
             log.error("ipfs_thumb_folder_hash has yet to be resolved!")
             return None
+        await self.__cache_thumb_path(folder_hash, video_id, data['Path'])
         return gateway + data['Path']
 
     async def get_thumb_folder(self):
-        gateway = await self.get_random_gateway()
+        gateway = await self.get_gateway()
         return gateway + self.__ipfs_thumb_folder_hash
@@ -0,0 +1,236 @@
+import asyncio
+import bisect
+import itertools
+import logging
+import time
+from array import array
+from const import ID_FIELD, ID_KEYWORD_FIELD
+from video import ETCVideo
+log = logging.getLogger('root')
+
+"""
+
+In-memory timeline of the main index: every video with a publish date, sorted by (date, id).
+
+Date window listings (!searchr without a query) are answered from it with binary search, without a round trip,
+in the same order and with the same search_after cursors as the backend would return
+([date, score, id], the date in the unit the backend sorts dates in: see SearchBackend.DATE_SORT_SCALE).
+Searches with text in a small date window are sent to the backend with the window as an id filter instead.
+
+Only the fields a listing shows are kept (id, title and whether the video is reuploaded/archived), so the
+flags can be up to refresh_interval out of date, like the enrichment map.
+
+"""
+
+TIMELINE_REFRESH_INTERVAL_S = 3600
+PREFILTER_MAX_IDS = 1024
+FLAG_REUPLOADED = 1
+FLAG_ARCHIVED = 2
+# score of each clause of a query without text (range, match_all), as in Elasticsearch. A bool query sums them
+CLAUSE_SCORE = 1.0
+
+
+def _epoch_ms(value, scale=1):
+    # value: epoch seconds times scale
+    return int(round(float(value) * 1000 / scale))
+
+
+def _sort_date(ms, scale):
+    # epoch seconds times scale, as the backend sorts dates: whole values as an int
+    value = ms * scale
+    return value // 1000 if value % 1000 == 0 else value / 1000
+
+
+class Timeline:
+
+    def __init__(self, prefilter_max_ids=PREFILTER_MAX_IDS):
+        """
+        prefilter_max_ids: largest window sent to the backend as an id filter (0 to never prefilter)
+        """
+        self.prefilter_max_ids = prefilter_max_ids
+        self.__dates = array('q')  # publish dates in ms, ascending
+        self.__ids = []
+        self.__titles = []
+        self.__flags = bytearray()
+        self.__date_sort_scale = 1  # of the backend the timeline was loaded from
+        self.loaded_at = None
+        self.answered = 0
+        self.prefiltered = 0
+
+    def __len__(self):
+        return len(self.__ids)
+
+    def is_ready(self):
+        return self.loaded_at is not None
+
+    async def load(self, db):
+        """
+        Read the date, id and title of every video from the backend, and swap in the new timeline once complete
+        """
+        entries = []
+        async for source in db.iter_videos(source=[ID_FIELD, 'date_published', 'title']):
+            try:
+                entries.append((_epoch_ms(source['date_published']), source[ID_FIELD], source.get('title')))
+            except (KeyError, TypeError, ValueError):
+                continue  # no (valid) date: never in a date window
+        reuploaded_ids, archived_ids = await db.get_membership_ids()
+        entries.sort(key=lambda entry: (entry[0], entry[1]))
+
+        dates = array('q', (entry[0] for entry in entries))
+        ids = [entry[1] for entry in entries]
+        titles = [entry[2] for entry in entries]
+        flags = bytearray((FLAG_REUPLOADED if video_id in reuploaded_ids else 0) |
+                          (FLAG_ARCHIVED if video_id in archived_ids else 0) for video_id in ids)
+        self.__dates, self.__ids, self.__titles, self.__flags = dates, ids, titles, flags
+        self.__date_sort_scale = db.DATE_SORT_SCALE
+        self.loaded_at = time.time()
+        log.info(f"Loaded timeline of {len(ids)} videos (~{self.memory_bytes()} bytes)")
+
+    async def start_refresher(self, db, refresh_interval=TIMELINE_REFRESH_INTERVAL_S):
+        while True:
+            try:
+                await self.load(db)
+            except Exception as e:
+                log.error(f"Failed to load timeline: {e}")
+            await asyncio.sleep(refresh_interval)
+
+    def memory_bytes(self):
+        return (self.__dates.itemsize * len(self.__dates) + len(self.__flags) +
+                sum(len(video_id) for video_id in self.__ids) + sum(len(title or "") for title in self.__titles))
+
+    def window(self, start_ms, end_ms):
+        """
+        Returns the (lo, hi) index range of the videos published in [start_ms, end_ms]
+        """
+        return bisect.bisect_left(self.__dates, start_ms), bisect.bisect_right(self.__dates, end_ms)
+
+    def ids_between(self, start_ms, end_ms):
+        lo, hi = self.window(start_ms, end_ms)
+        return self.__ids[lo:hi]
+
+    @staticmethod
+    def __date_range(clause):
+        # (start ms, end ms) of a range clause on date_published, None if it isn't one the timeline can answer
+        try:
+            (field, bounds), = clause['range'].items()
+        except (KeyError, AttributeError, ValueError):
+            return None
+        if field != 'date_published' or bounds.get('format') != 'epoch_second' or \
+                not set(bounds) <= {'gte', 'lte', 'format'}:
+            return None
+        try:
+            return _epoch_ms(bounds.get('gte', float('-inf'))), _epoch_ms(bounds.get('lte', float('inf')))
+        except (ValueError, OverflowError):
+            return None
+
+    def __split_query(self, query):
+        # (date range, other must clauses) of a bool must query with a date range, or None
+        clause = query.get('query', {})
+        if set(clause) != {'bool'} or set(clause['bool']) != {'must'}:
+            return None
+        date_range = None
+        others = []
+        for must in clause['bool']['must']:
+            must_range = self.__date_range(must) if 'range' in must else None
+            if must_range is not None and date_range is None:
+                date_range = must_range
+            else:
+                others.append(must)
+        return None if date_range is None else (date_range, others)
+
+    @staticmethod
+    def __order(sort):
+        # 'asc'/'desc' for a sort on date_published then _score and id, None for any other sort
+        if not isinstance(sort, list) or len(sort) != 3 or sort[1] != '_score' or sort[2] != {ID_KEYWORD_FIELD: 'asc'}:
+            return None
+        order = sort[0].get('date_published') if isinstance(sort[0], dict) else None
+        order = order.get('order', 'asc') if isinstance(order, dict) else order
+        return order if order in ('asc', 'desc') else None
+
+    def answer(self, query):
+        """
+        Returns (videos, cursor) for a date window listing sorted by date (the listing fields only),
+        or None if the query needs the backend.
+        """
+        if not self.is_ready() or not set(query) <= {'size', 'query', 'sort', 'search_after'}:
+            return None
+        split = self.__split_query(query)
+        order = self.__order(query.get('sort'))
+        if split is None or order is None or any(clause != {'match_all': {}} for clause in split[1]):
+            return None
+        (start_ms, end_ms), others = split
+        lo, hi = self.window(start_ms, end_ms)
+
+        after = query.get('search_after')
+        try:
+            after = None if after is None else (_epoch_ms(after[0], self.__date_sort_scale), str(after[-1]))
+        except (TypeError, ValueError, IndexError, OverflowError):
+            return None
+        indices = self.__ascending(lo, hi, after) if order == 'asc' else self.__descending(lo, hi, after)
+        size = query.get('size', 10)
+        page = list(itertools.islice(indices, size))
+        if len(page) == 1 and after is None:
+            return None  # a single video is shown in full: the backend returns its whole document with the listing
+
+        self.answered += 1
+        videos = [self.__video(i) for i in page]
+        cursor = None
+        if len(page) > 0 and len(page) >= size:
+            cursor = [_sort_date(self.__dates[page[-1]], self.__date_sort_scale), CLAUSE_SCORE * (1 + len(others)), self.__ids[page[-1]]]
+        return videos, cursor
+
+    def __ascending(self, lo, hi, after):
+        i = lo
+        if after is not None:
+            date, video_id = after
+            i = bisect.bisect_left(self.__dates, date, lo, hi)
+            while i < hi and self.__dates[i] == date and self.__ids[i] <= video_id:
+                i += 1
+        return iter(range(i, hi))
+
+    def __descending(self, lo, hi, after):
+        # Dates descending, but ids still ascending within the same date (the id tiebreaker is always asc)
+        end = hi
+        if after is not None:
+            date, video_id = after
+            start = bisect.bisect_left(self.__dates, date, lo, hi)
+            end = bisect.bisect_right(self.__dates, date, lo, hi)
+            for i in range(start, end):
+                if self.__ids[i] > video_id:
+                    yield i
+            end = start
+        while end > lo:
+            start = bisect.bisect_left(self.__dates, self.__dates[end - 1], lo, end)
+            yield from range(start, end)
+            end = start
+
+    def __video(self, i):
+        fields = {'id': self.__ids[i]}
+        if self.__titles[i] is not None:
+            fields['title'] = self.__titles[i]
+        if self.__flags[i] & FLAG_REUPLOADED:
+            fields['on_youtube'] = True
+        if self.__flags[i] & FLAG_ARCHIVED:
+            fields['archived'] = True
+        return ETCVideo(**fields)
+
+    def prefilter(self, query):
+        """
+        Replace the date range of a query with text by the ids in the window, if the window is small enough
+        """
+        if not self.is_ready() or self.prefilter_max_ids <= 0:
+            return query
+        split = self.__split_query(query)
+        if split is None:
+            return query
+        (start_ms, end_ms), others = split
+        lo, hi = self.window(start_ms, end_ms)
+        if hi - lo > self.prefilter_max_ids:
+            return query
+        self.prefiltered += 1
+        ids_filter = {"terms": {ID_KEYWORD_FIELD: self.__ids[lo:hi]}} if hi > lo else {"match_none": {}}
+        return {**query, 'query': {'bool': {'must': [ids_filter] + others}}}
+
+    def stats(self):
+        return {'entries': len(self), 'bytes': self.memory_bytes(), 'answered': self.answered,
+                'prefiltered': self.prefiltered, 'age': 0 if self.loaded_at is None else time.time() - self.loaded_at}
@@ -2,13 +2,62 @@
 
 Class representing a video in the Elastic Search Database
 
+The raw document is kept as is, and each field is only cleaned up the first time it is used
+(a listing only ever looks at the title and id).
+
 """
 
 from const import INVALID_STRINGS
 
 
+def _clean_str(value):
+    if value is None:
+        return None
+    value = str(value).replace(r'\n', '')
+    return None if value == "" else value
+
+
+def _clean_list(value):
+    return [s for s in value if s not in INVALID_STRINGS]
+
+
+def _clean_quality(value):
+    return None if value == "" else value
+
+
+def _clean_bool(value):
+    return None if value is None else bool(value)
+
+
+def _clean_url(value):
+    return None if value is None else str(value).replace(r'\n', '')
+
+
+# attribute -> (key in the raw document, normalize, default when missing from the raw document)
+_LAZY_FIELDS = {
+    'title': ('title', _clean_str, None),
+    'alternate_titles': ('alternate_titles', _clean_list, ()),
+    'description': ('description', _clean_str, None),
+    'alternate_descriptions': ('alternate_descriptions', _clean_list, ()),
+    'duration': ('duration', _clean_str, None),
+    'date_published': ('date_published', _clean_str, None),
+    'uploader': ('uploader', _clean_str, None),
+    'alternate_uploaders': ('alternate_uploaders', _clean_list, ()),
+    'uploader_ids': ('uploader_ids', _clean_list, ()),
+    'tags': ('tags', _clean_list, ()),
+    'duplicate_of': ('duplicate_of', _clean_list, ()),
+    '_local_quality_width': ('local_quality_width', _clean_quality, None),
+    '_local_quality_height': ('local_quality_height', _clean_quality, None),
+    'archived': ('archived', _clean_bool, None),
+    'on_youtube': ('on_youtube', _clean_bool, None),
+    'reupload_url': ('reupload_url', _clean_url, None),
+}
+
+
 class ETCVideo:
 
+    __slots__ = ('id', '_source') + tuple(_LAZY_FIELDS)
+
     def __init__(self, **kwargs):
 
         self.id = kwargs.get('id', None)
@@ -16,67 +65,45 @@ class ETCVideo:
         if self.id is None:
             raise ValueError('id is a required value.')
 
-        self.title = kwargs.get('title', None)
-        if self.title is not None:
-            self.title = str(self.title).replace(r'\n', '')
-            if self.title == "":
-                self.title = None
-        self.alternate_titles = self.__skip_invalid_strings(list(kwargs.get('alternate_titles', [])))
-        self.description = kwargs.get('description', None)
-        if self.description is not None:
-            self.description = str(self.description).replace(r'\n', '')
-            if self.description == "":
-                self.description = None
-        self.alternate_descriptions = self.__skip_invalid_strings(list(kwargs.get('alternate_descriptions', [])))
-        self.duration = kwargs.get('duration', None)
-        if self.duration is not None:
-            self.duration = str(self.duration).replace(r'\n', '')
-            if self.duration == "":
-                self.duration = None
-        self.date_published = kwargs.get('date_published', None)
-        if self.date_published is not None:
-            self.date_published = str(self.date_published).replace(r'\n', '')
-            if self.date_published == "":
-                self.date_published = None
-        self.uploader = kwargs.get('uploader', None)
-        if self.uploader is not None:
-            self.uploader = str(self.uploader).replace(r'\n', '')
-            if self.uploader == "":
-                self.uploader = None
-        self.alternate_uploaders = self.__skip_invalid_strings(list(kwargs.get('alternate_uploaders', [])))
-        self.uploader_ids = self.__skip_invalid_strings(list(kwargs.get('uploader_ids', [])))
-        self.tags = self.__skip_invalid_strings(list(kwargs.get('tags', [])))
-
-        self.duplicate_of = self.__skip_invalid_strings(list(kwargs.get('duplicate_of', [])))
-
-        self.__local_quality_width = kwargs.get('local_quality_width', None)
-
-        if self.__local_quality_width is not None:
-            if self.__local_quality_width == "":
-                self.__local_quality_width = None
-        self.__local_quality_height = kwargs.get('local_quality_height', None)
-        if self.__local_quality_height is not None:
-            if self.__local_quality_height == "":
-                self.__local_quality_height = None
-        self.archived = kwargs.get('archived', None)
-        if self.archived is not None:
-            self.archived = bool(self.archived)
-        self.on_youtube = kwargs.get('on_youtube', None)
-        if self.on_youtube is not None:
-            self.on_youtube = bool(self.on_youtube)
-        self.reupload_url = kwargs.get('reupload_url', None)
-        if self.reupload_url is not None:
-            self.reupload_url = str(self.reupload_url).replace(r'\n', '')
+        self._source = kwargs
+
+    def __getattr__(self, name):
+        # Only called when the slot is not set yet: normalize the field from the raw document and cache it in the slot
+        try:
+            key, normalize, default = _LAZY_FIELDS[name]
+        except KeyError:
+            raise AttributeError(name)
+        value = normalize(self._source.get(key, default))
+        setattr(self, name, value)
+        return value
+
+    def __normalize_all(self):
+        # Normalize every field in one go (cheaper than faulting each one in), then drop the raw document
+        source = self._source
+        for name, (key, normalize, default) in _LAZY_FIELDS.items():
+            setattr(self, name, normalize(source.get(key, default)))
+        self._source = None
+
+    def raw(self):
+        """
+        The fields to rebuild the video from with ETCVideo(**video.raw()), without normalizing any of them
+        (the raw document, or as_dict() once every field was normalized)
+        """
+        return self._source if self._source is not None else self.as_dict()
+
+    def estimated_size(self):
+        # Rough size in memory for the caches, without normalizing any field
+        return len(repr(self.raw()))
 
     def get_original_url(self):
         return f"https://www.youtube.com/watch?v={self.id}"
 
     def get_quality(self):
 
-        if self.__local_quality_height is None or self.__local_quality_width is None:
+        if self._local_quality_height is None or self._local_quality_width is None:
             return None
 
-        return int(self.__local_quality_width), int(self.__local_quality_height)
+        return int(self._local_quality_width), int(self._local_quality_height)
 
     def __eq__(self, other):
 
@@ -88,17 +115,17 @@ class ETCVideo:
         else:
             return False
 
+    __hash__ = None
+
     def __str__(self):
         return str(self.id)
 
     def __repr__(self):
         return f"DatabaseVideo(**{self.as_dict()})"
 
-    @staticmethod
-    def __skip_invalid_strings(l: list):
-        return [s for s in l if s not in INVALID_STRINGS]
-
     def as_dict(self, pretty=False):
+        if self._source is not None:
+            self.__normalize_all()
         d = {}
         d['id'] = self.id
         if self.title is not None:
@@ -111,10 +138,10 @@ class ETCVideo:
             d['date_published'] = self.date_published
         if self.uploader is not None:
             d['uploader'] = self.uploader
-        if self.__local_quality_width is not None:
-            d['local_quality_width'] = self.__local_quality_width
-        if self.__local_quality_height is not None:
-            d['local_quality_height'] = self.__local_quality_height
+        if self._local_quality_width is not None:
+            d['local_quality_width'] = self._local_quality_width
+        if self._local_quality_height is not None:
+            d['local_quality_height'] = self._local_quality_height
         if self.archived is not None:
             d['archived'] = self.archived
         if self.on_youtube is not None:
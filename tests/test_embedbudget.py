@@ -0,0 +1,85 @@
+import random
+
+import pytest
+
+from const import (
+    EMBED_MAX_LENGTH,
+    EMBED_TITLE_MAX_LENGTH,
+    EMBED_FIELD_NAME_MAX_LENGTH,
+    EMBED_FIELD_VALUE_MAX_LENGTH,
+    EMBED_FOOTER_MAX_LENGTH,
+    EMBED_MAX_FIELDS,
+    EMBED_FIELD_PRIORITY,
+)
+from embedbudget import fit_embed, shorten_str, value_length
+
+CASES = 300
+ALPHABET = "abcdefghij klmnopqrstuvwxyz[].,"
+
+
+def random_text(rng, max_length):
+    length = rng.choice((0, 1, rng.randint(0, 40), rng.randint(0, max_length)))
+    return "".join(rng.choices(ALPHABET, k=length))
+
+
+def random_value(rng, max_length):
+    if rng.random() < 0.4:
+        return [random_text(rng, max_length // 8) for _ in range(rng.randint(0, 60))]
+    return random_text(rng, max_length)
+
+
+def random_embed(rng, scale):
+    """
+    (title, fields, footer) of random sizes, scale being roughly the largest size of a part relative to its limit
+    """
+    title = random_text(rng, int(EMBED_TITLE_MAX_LENGTH * scale)) if rng.random() < 0.9 else None
+    footer = random_text(rng, int(EMBED_FOOTER_MAX_LENGTH * scale)) if rng.random() < 0.5 else None
+    names = EMBED_FIELD_PRIORITY + ["extra"]
+    fields = {}
+    for i in range(rng.randint(0, int(EMBED_MAX_FIELDS * scale) + 1)):
+        # the index keeps names unique once shortened to the name limit
+        name = f"{i:02d} {rng.choice(names)} " + random_text(rng, int(EMBED_FIELD_NAME_MAX_LENGTH * scale))
+        fields[name] = random_value(rng, int(EMBED_FIELD_VALUE_MAX_LENGTH * scale))
+    return title, fields, footer
+
+
+def embed_length(title, fields, footer):
+    return len(title or "") + len(footer or "") + sum(len(name) + value_length(value) for name, value in fields.items())
+
+
+def fits(title, fields, footer):
+    return (len(title or "") <= EMBED_TITLE_MAX_LENGTH and len(footer or "") <= EMBED_FOOTER_MAX_LENGTH and
+            len(fields) <= EMBED_MAX_FIELDS and embed_length(title, fields, footer) <= EMBED_MAX_LENGTH and
+            all(len(name) <= EMBED_FIELD_NAME_MAX_LENGTH and value_length(value) <= EMBED_FIELD_VALUE_MAX_LENGTH
+                for name, value in fields.items()))
+
+
+def is_subsequence(items, sequence):
+    sequence = iter(sequence)
+    return all(item in sequence for item in items)
+
+
+@pytest.mark.parametrize("scale", [0.5, 1, 3])
+def test_limits_hold_and_order_is_kept(scale):
+    rng = random.Random(f"fit_embed {scale}")
+    for _ in range(CASES):
+        title, fields, footer = random_embed(rng, scale)
+        fitted_title, fitted_fields, fitted_footer = fit_embed(title, fields, footer)
+
+        assert fits(fitted_title, fitted_fields, fitted_footer)
+        assert (fitted_title is None) == (title is None) and (fitted_footer is None) == (footer is None)
+        assert is_subsequence(list(fitted_fields), [shorten_str(name, EMBED_FIELD_NAME_MAX_LENGTH) for name in fields])
+
+
+def test_fitting_embed_is_unchanged():
+    rng = random.Random("fit_embed unchanged")
+    checked = 0
+    for _ in range(CASES * 3):
+        embed = random_embed(rng, 0.3)
+        if not fits(*embed):
+            continue
+        checked += 1
+        fitted = fit_embed(*embed)
+        assert fitted == embed
+        assert list(fitted[1]) == list(embed[1])
+    assert checked >= CASES
@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("elasticsearch")
+
+from etcdatabase import ETCDatabase, STATS_ID_PAGE_SIZE  # noqa: E402
+from searchbackend import MODERN_ETC_MAIN_CHANNEL_QUERY  # noqa: E402
+
+MATCHES = 12000  # more than the 10,000 hits a search can return
+
+
+class FakeElasticsearch:
+    """
+    Answers the stats requests of ETCDatabase from in-memory indexes
+    """
+
+    def __init__(self, indexes):
+        self.indexes = indexes
+        self.searches = []
+
+    @staticmethod
+    def matches(document, query):
+        if query == MODERN_ETC_MAIN_CHANNEL_QUERY:
+            return document.get('modern', False)
+        (kind, clause), = query.items()
+        if kind == 'match_all':
+            return True
+        if kind == 'match_phrase':
+            (field, phrase), = clause.items()
+            return phrase in document.get(field, "")
+        if kind == 'terms':
+            (field, values), = clause.items()
+            return document.get(field.replace(".keyword", "")) in values
+        raise ValueError(query)
+
+    def run(self, index, body):
+        assert body.get('size', 10) <= 10000
+        self.searches.append(body)
+        documents = [d for d in self.indexes[index] if self.matches(d, body.get('query', {'match_all': {}}))]
+        response = {'hits': {'total': {'value': len(documents)}, 'hits': []}, 'aggregations': {}}
+        for name, aggregation in body.get('aggs', {}).items():
+            if 'composite' in aggregation:
+                composite = aggregation['composite']
+                field = composite['sources'][0]['id']['terms']['field'].replace(".keyword", "")
+                counts = {}
+                for document in documents:
+                    counts[document[field]] = counts.get(document[field], 0) + 1
+                keys = sorted(key for key in counts if 'after' not in composite or key > composite['after']['id'])
+                page = keys[:composite['size']]
+                response['aggregations'][name] = {'buckets': [{'key': {'id': key}, 'doc_count': counts[key]} for key in page]}
+                if len(page) > 0:
+                    response['aggregations'][name]['after_key'] = {'id': page[-1]}
+            elif 'terms' in aggregation:
+                field = aggregation['terms']['field'].replace(".keyword", "")
+                counts = {}
+                for document in documents:
+                    counts[document[field]] = counts.get(document[field], 0) + 1
+                response['aggregations'][name] = {'buckets': [{'key': key, 'doc_count': count} for key, count in counts.items()]}
+            elif 'filters' in aggregation:
+                response['aggregations'][name] = {'buckets': {
+                    key: {'doc_count': sum(self.matches(d, query) for d in documents)}
+                    for key, query in aggregation['filters']['filters'].items()}}
+        return response
+
+    async def search(self, index, body):
+        return self.run(index, body)
+
+    async def msearch(self, body):
+        return {'responses': [self.run(header['index'], query) for header, query in zip(body[::2], body[1::2])]}
+
+
+def make_database():
+    main = [{'id': f"v{i:05d}", 'title': f"Weekly Weird News {i}", 'modern': i % 2 == 0} for i in range(MATCHES)]
+    main += [{'id': "v00000", 'title': "Weekly Weird News duplicate"}, {'id': "other", 'title': "Tech Tuesday"}]
+    youtube = [{'id': f"r{i}", 'original_id': f"v{i:05d}"} for i in range(0, MATCHES, 3)]
+    youtube.append({'id': "r-extra", 'original_id': "v00000"})
+    local = [{'id': f"v{i:05d}", 'collection': "Modern ETC"} for i in range(0, MATCHES, 4)]
+    local.append({'id': "v00004", 'collection': "Modern ETC"})  # two local documents: not counted as archived
+    db = ETCDatabase("main", "youtube", "local")
+    db._ETCDatabase__es_object = FakeElasticsearch({'main': main, 'youtube': youtube, 'local': local})
+    return db
+
+
+def test_stats_are_not_capped_at_10000_hits():
+    db = make_database()
+    stats = asyncio.run(db.get_stats(phrases=["Weekly Weird News", "Tech Tuesday"]))
+
+    archived = len(range(0, MATCHES, 4)) - 1
+    # v00000 has 2 main documents and 2 reuploads: each main document counts both
+    reuploaded = len(range(0, MATCHES, 3)) + 1 + 2
+    assert stats['phrase']["Weekly Weird News"] == {'total': MATCHES + 1, 'total_reuploaded': reuploaded,
+                                                    'total_archived': archived}
+    assert stats['phrase']["Tech Tuesday"] == {'total': 1, 'total_reuploaded': 0, 'total_archived': 0}
+    assert stats['pure_modern_etc_archived'] == (archived, MATCHES // 2)
+    assert stats['total'] == MATCHES + 2
+    assert stats['total_modern'] == stats['total_archived'] == archived + 2
+    # the ids were paged through composite aggregations, never fetched as hits
+    searches = db._ETCDatabase__es_object.searches
+    assert all(search['size'] == 0 for search in searches)
+    pages = [search for search in searches if 'after' in search.get('aggs', {}).get('ids', {}).get('composite', {})]
+    assert len(pages) >= MATCHES // STATS_ID_PAGE_SIZE
+
+
+def test_stats_by_phrase_match_get_stats():
+    db = make_database()
+    stats = asyncio.run(db.get_stats(phrases=["Weekly Weird News"]))
+    assert asyncio.run(db.get_stats_by_phrase("Weekly Weird News")) == stats['phrase']["Weekly Weird News"]
+    assert asyncio.run(db.modern_etc_main_channel()) == stats['pure_modern_etc_archived']
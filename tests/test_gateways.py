@@ -0,0 +1,83 @@
+import asyncio
+
+from aiohttp import web
+
+from gateways import GatewaySelector, FAILURE_THRESHOLD
+
+PROBE_CID = "QmTest"
+SLOW_DELAY_S = 0.2
+
+
+async def start_gateways(state):
+    """
+    Serve three gateways on a local port under /fast, /slow and /broken.
+    state['fast_status'] is the status /fast answers with.
+    """
+    async def fast(request):
+        return web.Response(status=state['fast_status'], body=b"{}")
+
+    async def slow(request):
+        await asyncio.sleep(SLOW_DELAY_S)
+        return web.Response(body=b"{}")
+
+    async def broken(request):
+        return web.Response(status=500)
+
+    app = web.Application()
+    app.router.add_get(f"/fast/ipfs/{PROBE_CID}", fast)
+    app.router.add_get(f"/slow/ipfs/{PROBE_CID}", slow)
+    app.router.add_get(f"/broken/ipfs/{PROBE_CID}", broken)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+def by_url(selector):
+    return {stats['url']: stats for stats in selector.stats()}
+
+
+def test_probe_scoring_and_failover():
+    async def run():
+        state = {'fast_status': 200}
+        runner, base = await start_gateways(state)
+        fast, slow, broken = f"{base}/fast", f"{base}/slow", f"{base}/broken"
+        selector = GatewaySelector(gateways=(fast, slow + "/", broken), probe_cid=PROBE_CID, probe_timeout=2)
+        try:
+            await selector.probe_all()
+            stats = by_url(selector)
+            assert stats[fast]['latency'] < stats[slow]['latency']
+            assert stats[slow]['latency'] >= SLOW_DELAY_S
+            assert stats[broken]['latency'] is None and stats[broken]['failures'] == 1
+            assert selector.best() == fast
+
+            for _ in range(FAILURE_THRESHOLD - 1):
+                await selector.probe_all()
+            assert by_url(selector)[broken]['open']
+
+            # the fastest gateway starts failing: once its circuit opens, the slow one is handed out
+            state['fast_status'] = 502
+            for _ in range(FAILURE_THRESHOLD):
+                await selector.probe_all()
+            stats = by_url(selector)
+            assert stats[fast]['open'] and not stats[slow]['open']
+            assert selector.best() == slow
+
+            # one successful probe closes the circuit again
+            state['fast_status'] = 200
+            await selector.probe_all()
+            stats = by_url(selector)
+            assert not stats[fast]['open']
+            assert stats[fast]['error_rate'] > 0
+            assert stats[broken]['open']
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(run())
+
+
+def test_random_gateway_before_any_probe():
+    selector = GatewaySelector(gateways=("http://a", "http://b"))
+    assert selector.best() in ("http://a", "http://b")
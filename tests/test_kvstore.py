@@ -0,0 +1,60 @@
+import asyncio
+import sqlite3
+import time
+
+from kvstore import SQLiteKVStore, MemoryKVStore
+
+
+def test_reads_do_not_wait_for_writers(tmp_path):
+    path = str(tmp_path / "store.sqlite")
+    store = SQLiteKVStore(path)
+    asyncio.run(store.set("ns", "key", "value"))
+
+    # another process holding the write lock
+    writer = sqlite3.connect(path, isolation_level=None)
+    writer.execute("BEGIN IMMEDIATE")
+    try:
+        start = time.monotonic()
+        assert store.get("ns", "key") == "value"
+        assert store.get("ns", "missing") is None
+        assert time.monotonic() - start < 1
+    finally:
+        writer.execute("ROLLBACK")
+        writer.close()
+
+
+def test_reads_count_for_least_recently_used(tmp_path):
+    for store in (SQLiteKVStore(str(tmp_path / "store.sqlite")), MemoryKVStore()):
+        for key in ("a", "b", "c"):
+            asyncio.run(store.set("ns", key, key))
+            time.sleep(0.01)
+        assert store.get("ns", "a") == "a"
+        assert asyncio.run(store.evict("ns", max_entries=2)) == ["b"]
+        assert store.get("ns", "a") == "a" and store.get("ns", "c") == "c"
+
+
+def test_expired_entries(tmp_path):
+    store = SQLiteKVStore(str(tmp_path / "store.sqlite"))
+    asyncio.run(store.set("ns", "key", "value", ttl=-1))
+    assert store.get("ns", "key") is None
+    assert not store.contains("ns", "key")
+    assert asyncio.run(store.evict("ns")) == ["key"]
+
+
+def test_writes_waiting_for_the_lock_do_not_block_the_loop(tmp_path):
+    path = str(tmp_path / "store.sqlite")
+    store = SQLiteKVStore(path)
+
+    async def run():
+        # another process holding the write lock, released by the event loop itself
+        writer = sqlite3.connect(path, isolation_level=None)
+        writer.execute("BEGIN IMMEDIATE")
+        asyncio.get_running_loop().call_later(0.2, writer.execute, "ROLLBACK")
+        start = time.monotonic()
+        await store.set("ns", "key", "value")
+        assert await store.acquire_lease("lease", "owner", ttl=30)
+        writer.close()
+        return time.monotonic() - start
+
+    assert asyncio.run(run()) < 5
+    assert store.get("ns", "key") == "value"
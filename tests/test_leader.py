@@ -0,0 +1,49 @@
+import asyncio
+
+from kvstore import MemoryKVStore
+from leader import LeaderElection
+
+
+def test_crashed_role_is_restarted():
+    async def run():
+        starts = []
+
+        async def leader():
+            starts.append(len(starts))
+            if len(starts) == 1:
+                raise RuntimeError("crashed")
+            await asyncio.Event().wait()
+
+        election = LeaderElection(MemoryKVStore(), owner="test", renew_interval=0.01)
+        task = asyncio.ensure_future(election.run(leader))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return starts, election
+
+    starts, election = asyncio.run(run())
+    assert starts == [0, 1]  # restarted once, then kept running
+    assert election.stats() == {'is_leader': 0, 'elections_won': 1, 'role_restarts': 1}
+
+
+def test_only_one_leader():
+    async def run():
+        store = MemoryKVStore()
+        roles = []
+
+        async def role(name):
+            roles.append(name)
+            await asyncio.Event().wait()
+
+        elections = [LeaderElection(store, owner=f"p{i}", renew_interval=0.01) for i in range(3)]
+        tasks = [asyncio.ensure_future(e.run(lambda: role("leader"), lambda: role("follower"))) for e in elections]
+        await asyncio.sleep(0.05)
+        leaders = sum(e.is_leader for e in elections)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return leaders, sorted(roles)
+
+    leaders, roles = asyncio.run(run())
+    assert leaders == 1
+    assert roles == ["follower", "follower", "leader"]
@@ -0,0 +1,14 @@
+from const import ID_KEYWORD_FIELD
+from query import build_search_query
+
+
+def test_tiebreaker_only_for_paged_searches():
+    assert 'sort' not in build_search_query(query="weird news")
+    assert build_search_query(query="weird news", sort_by_field="date_published", sort=1)['sort'] == \
+        [{"date_published": {"order": "desc"}}, '_score']
+
+
+def test_paged_searches_end_in_keyword_tiebreaker():
+    assert build_search_query(query="weird news", paged=True)['sort'] == ['_score', {ID_KEYWORD_FIELD: 'asc'}]
+    assert build_search_query(query="weird news", sort_by_field="date_published", paged=True)['sort'] == \
+        [{"date_published": {"order": "asc"}}, '_score', {ID_KEYWORD_FIELD: 'asc'}]
@@ -0,0 +1,32 @@
+import asyncio
+
+from selection import Selection, SelectionStore
+from video import ETCVideo
+
+
+def test_evicting_a_selection_during_a_prefetch_falls_back_to_fetching():
+    async def run():
+        prefetch_started = asyncio.Event()
+
+        async def slow_get_thumb(video_id):
+            prefetch_started.set()
+            await asyncio.sleep(3600)
+
+        async def get_thumb(video_id):
+            return f"thumb of {video_id}"
+
+        store = SelectionStore(max_entries=1)
+        selection = Selection([ETCVideo(id="abc", title="Weekly Weird News")])
+        await store.set(1, selection)
+        selection.prefetch_thumbs(slow_get_thumb)
+        await prefetch_started.wait()
+
+        waiting = asyncio.ensure_future(selection.get_thumb("abc", get_thumb))
+        await asyncio.sleep(0.01)
+        await store.set(2, Selection([ETCVideo(id="def", title="Tech Tuesday")]))
+        await store.purge()  # evicts the selection of user 1
+
+        assert 1 not in store
+        assert await asyncio.wait_for(waiting, 1) == "thumb of abc"
+
+    asyncio.run(run())
@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+
+from snapshot import export_snapshot, import_snapshot
+
+
+def make_documents(count):
+    return [{'_id': str(i), '_source': {'id': f"video{i:04d}", 'title': f"Video {i}"}} for i in range(count)]
+
+
+@pytest.fixture
+def snapshot_path(tmp_path):
+    indexes = {'main': make_documents(95), 'youtube': make_documents(12)}
+
+    async def iter_documents(index):
+        for document in indexes[index]:
+            yield document
+
+    asyncio.run(export_snapshot(iter_documents, {'main': 'main', 'youtube': 'youtube'}, str(tmp_path), chunk_size=40))
+    return str(tmp_path)
+
+
+def test_failed_batch_is_counted(snapshot_path):
+    received = {}
+
+    async def sink(name, documents):
+        await asyncio.sleep(0)
+        if name == 'main' and documents[0]['_source']['id'] == "video0020":
+            raise ConnectionError("bulk request failed")
+        received.setdefault(name, []).extend(document['_source']['id'] for document in documents)
+        return 1 if name == 'youtube' else 0  # one document rejected by the sink itself
+
+    results = asyncio.run(import_snapshot(snapshot_path, sink, batch_size=10, concurrency=3))
+
+    assert results == {'main': (85, 10), 'youtube': (11, 1)}
+    assert len(received['main']) == 85 and "video0020" not in received['main']
+
+
+def test_import_only_named_indexes(snapshot_path):
+    async def sink(name, documents):
+        return 0
+
+    assert asyncio.run(import_snapshot(snapshot_path, sink, names=['youtube'], batch_size=5)) == {'youtube': (12, 0)}
@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+
+from query import build_search_query
+from searchbackend import SearchBackend
+from sqlitedatabase import SQLiteDatabase
+
+
+def make_database():
+    db = SQLiteDatabase(":memory:")
+    db.import_documents("main", [
+        {"id": "a", "title": "Weekly Weird News 1", "description": "first", "date_published": "2015-01-01T00:00:00Z"},
+        {"id": "b", "title": "Weekly Weird News 2", "description": "second", "date_published": "2015-01-08T00:00:00Z"},
+        {"id": "c", "title": "Tech Tuesday", "description": "third", "date_published": "2015-01-13T00:00:00Z"},
+    ])
+    db.import_documents("youtube", [{"id": "r1", "original_id": "c"}, {"id": "r2", "original_id": "c"}])
+    db.import_documents("local", [{"id": "c", "width": 640, "height": 480, "collection": "Classic ETC"}])
+    return db
+
+
+def test_listing_with_a_single_hit_returns_the_whole_document():
+    db = make_database()
+    videos, cursor = asyncio.run(db.search_page(build_search_query(query="Tech Tuesday", paged=True), profile='listing'))
+    assert [video.id for video in videos] == ["c"]
+    assert cursor is None
+    assert videos[0].description == "third"
+    assert videos[0].archived and videos[0].on_youtube
+
+
+def test_listing_with_several_hits_only_has_the_listing_fields():
+    db = make_database()
+    videos, _ = asyncio.run(db.search_page(build_search_query(query="Weekly Weird News", paged=True), profile='listing'))
+    assert sorted(video.id for video in videos) == ["a", "b"]
+    assert all(video.description is None for video in videos)
+
+
+def test_stats_sum_reuploads_per_video():
+    db = make_database()
+    assert asyncio.run(db.get_stats_by_phrase("Tech Tuesday")) == {'total': 1, 'total_reuploaded': 2, 'total_archived': 1}
+
+
+def test_incomplete_backend_fails_at_construction():
+    class SearchOnly(SearchBackend):
+        async def _search(self, query):
+            return [], None
+
+    with pytest.raises(TypeError):
+        SearchOnly()
+    SQLiteDatabase(":memory:")
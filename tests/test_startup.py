@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import types
+
+import pytest
+
+from startup import Startup
+
+PHASE_DELAY_S = 0.1
+
+
+async def slow_phase(events, name, delay=PHASE_DELAY_S):
+    await asyncio.sleep(delay)
+    events.append(name)
+
+
+async def failing_phase():
+    raise ConnectionError("unreachable")
+
+
+def test_commands_wait_for_readiness_and_first_command_is_recorded_once(caplog):
+    async def run():
+        startup = Startup(target_first_command=0.05)
+        events = []
+
+        async def command(number):
+            await startup.wait_ready(timeout=5)
+            events.append(f"command {number}")
+            startup.command_finished()
+
+        async def warm():
+            assert startup.is_ready()
+            events.append("warm")
+
+        # commands arriving while the bot is still starting
+        commands = [asyncio.ensure_future(command(number)) for number in range(3)]
+        await asyncio.sleep(0)
+        assert not startup.is_ready()
+        await startup.run({'caches': slow_phase(events, "caches"), 'elasticsearch': slow_phase(events, "elasticsearch", 0.15),
+                           'ipfs': failing_phase(), 'stuck': asyncio.sleep(10)}, warm=warm, timeout=0.2)
+        await asyncio.gather(*commands)
+        first_command = startup.phases['first_command']
+        startup.command_finished()
+        return startup, events, first_command
+
+    with caplog.at_level(logging.INFO):
+        startup, events, first_command = asyncio.run(run())
+
+    assert events[:2] == ["caches", "elasticsearch"]
+    assert sorted(events[2:]) == ["command 0", "command 1", "command 2", "warm"]
+    assert set(startup.phases) == {"caches", "elasticsearch", "ipfs", "stuck", "ready", "first_command"}
+    assert startup.phases['ready'] >= 0.2  # waited for the stuck phase to time out
+    assert startup.phases['first_command'] == first_command >= startup.phases['ready']
+    over_target = [r for r in caplog.records if "over the target" in r.getMessage()]
+    assert len(over_target) == 1 and over_target[0].levelno == logging.WARNING
+    assert any("ipfs failed" in r.getMessage() for r in caplog.records)
+    assert any("stuck timed out" in r.getMessage() for r in caplog.records)
+    assert startup.stats()['target_first_command_seconds'] == 0.05
+
+
+def test_first_command_within_target_is_not_warned(caplog):
+    startup = Startup(target_first_command=60)
+    startup.set_ready()
+    with caplog.at_level(logging.WARNING):
+        startup.command_finished()
+    assert 'first_command' in startup.phases
+    assert not any("over the target" in r.getMessage() for r in caplog.records)
+
+
+def test_bot_hooks_wait_for_initialize(caplog):
+    pytest.importorskip("discord")
+    pytest.importorskip("aioipfs")
+    import bot
+
+    async def run():
+        events = []
+
+        async def info():
+            await asyncio.sleep(PHASE_DELAY_S)
+            events.append("elasticsearch")
+            return {}
+
+        bot.startup = Startup(target_first_command=0)
+        bot.config = {}
+        bot.admission = None
+        bot.query_cache = None
+        bot.db = types.SimpleNamespace(info=info)
+        bot.thumbdb = types.SimpleNamespace(load_caches=lambda: slow_phase(events, "caches"),
+                                            warm_up=lambda: slow_phase(events, "ipfs"))
+
+        async def command(number):
+            ctx = types.SimpleNamespace(command=types.SimpleNamespace(qualified_name="search"),
+                                        author=types.SimpleNamespace(id=number), guild=None, command_failed=False)
+            await bot.before_command(ctx)
+            events.append("command")
+            await bot.after_command(ctx)
+
+        commands = [asyncio.ensure_future(command(number)) for number in range(2)]
+        await asyncio.sleep(0)
+        await bot.initialize()
+        await asyncio.gather(*commands)
+        return events, bot.startup
+
+    with caplog.at_level(logging.WARNING):
+        events, startup = asyncio.run(run())
+    assert sorted(events[:3]) == ["caches", "elasticsearch", "ipfs"]
+    assert events[3:] == ["command", "command"]
+    assert 'first_command' in startup.phases
+    assert len([r for r in caplog.records if "over the target" in r.getMessage()]) == 1
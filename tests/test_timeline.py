@@ -0,0 +1,118 @@
+import asyncio
+import random
+
+from query import build_search_query, parse_window_days
+from sqlitedatabase import SQLiteDatabase
+from timeline import Timeline
+
+DAY_S = 86400
+START_S = 1420070400  # 2015-01-01
+
+
+def make_database(count=120, seed=0):
+    rng = random.Random(seed)
+    db = SQLiteDatabase(":memory:")
+    # several videos share a date, so the id tiebreaker matters
+    db.import_documents("main", [{"id": f"v{i:04d}", "title": f"Video {i}",
+                                  "date_published": START_S + rng.randrange(0, 30) * DAY_S} for i in range(count)])
+    db.import_documents("local", [{"id": "v0001", "width": 640, "height": 480, "collection": "Classic ETC"}])
+    return db
+
+
+class MillisecondCursorDatabase(SQLiteDatabase):
+    """
+    Sorts dates in epoch ms like Elasticsearch: search_after and cursors hold ms
+    """
+
+    DATE_SORT_SCALE = 1000
+
+    async def _search(self, query):
+        if 'search_after' in query:
+            date, *rest = query['search_after']
+            query = {**query, 'search_after': [date / 1000, *rest]}
+        videos, cursor = await super()._search(query)
+        if cursor is not None:
+            cursor = [int(cursor[0] * 1000), *cursor[1:]]
+        return videos, cursor
+
+
+def make_ms_database(count=120, seed=0):
+    rng = random.Random(seed)
+    db = MillisecondCursorDatabase(":memory:")
+    db.import_documents("main", [{"id": f"v{i:04d}", "title": f"Video {i}",
+                                  "date_published": START_S + rng.randrange(0, 30) * DAY_S} for i in range(count)])
+    return db
+
+
+def window_query(days, sort=0, size=10):
+    date_query = asyncio.run(SQLiteDatabase(":memory:").get_date_range_query(START_S + 15 * DAY_S, range=days))
+    return {**build_search_query(extra_querys=[date_query], sort_by_field='date_published', sort=sort, paged=True),
+            'size': size}
+
+
+def pages(answer, query):
+    # (ids, cursor) of every page of query, following the cursors
+    result = []
+    cursor = None
+    while True:
+        videos, cursor = answer({**query, 'search_after': cursor} if cursor is not None else query)
+        result.append(([video.id for video in videos], cursor))
+        if cursor is None:
+            return result
+
+
+def test_pages_and_cursors_match_the_backend():
+    db = make_database()
+    timeline = Timeline()
+    asyncio.run(timeline.load(db))
+    for sort in (0, 1):
+        query = window_query(days=10, sort=sort)
+        from_timeline = pages(timeline.answer, query)
+        from_backend = pages(lambda q: asyncio.run(db.search_page(q, profile='listing')), query)
+        assert from_timeline == from_backend
+        assert len(from_timeline) > 1
+        assert timeline.answered > 0
+
+
+def test_cursors_are_epoch_seconds_with_the_bool_score():
+    db = make_database()
+    timeline = Timeline()
+    asyncio.run(timeline.load(db))
+    _, cursor = timeline.answer(window_query(days=10))
+    date, score, video_id = cursor
+    assert isinstance(date, int) and (date - START_S) % DAY_S == 0
+    assert score == 2.0
+    assert video_id.startswith("v")
+
+
+def test_single_hit_window_is_left_to_the_backend():
+    db = SQLiteDatabase(":memory:")
+    db.import_documents("main", [{"id": "only", "title": "Only video", "date_published": START_S + 15 * DAY_S}])
+    timeline = Timeline()
+    asyncio.run(timeline.load(db))
+    assert timeline.answer(window_query(days=2)) is None
+
+
+def test_window_days_argument():
+    assert parse_window_days("days=30") == 30
+    assert parse_window_days("DAYS=3") == 3
+    assert parse_window_days("30") is None
+    assert parse_window_days("weird news") is None
+
+
+def test_cursors_follow_a_backend_sorting_dates_in_ms():
+    db = make_ms_database()
+    timeline = Timeline()
+    asyncio.run(timeline.load(db))
+    for sort in (0, 1):
+        query = window_query(days=10, sort=sort)
+        from_timeline = pages(timeline.answer, query)
+        from_backend = pages(lambda q: asyncio.run(db.search_page(q, profile='listing')), query)
+        assert from_timeline == from_backend
+        assert len(from_timeline) > 1
+    date, score, _ = from_timeline[0][1]
+    assert isinstance(date, int) and (date - START_S * 1000) % (DAY_S * 1000) == 0
+    # an Elasticsearch cursor given to the timeline (e.g the backend answered the first page) continues the listing
+    _, backend_cursor = asyncio.run(db.search_page(window_query(days=10), profile='listing'))
+    videos, _ = timeline.answer({**window_query(days=10), 'search_after': backend_cursor})
+    assert [video.id for video in videos] == pages(timeline.answer, window_query(days=10))[1][0]
@@ -0,0 +1,33 @@
+from selection import Selection
+from video import ETCVideo
+
+
+def make_video(video_id="abc", **fields):
+    return ETCVideo(id=video_id, title="Weekly Weird News\\n", tags=["NA", "news"], local_quality_width=640, **fields)
+
+
+def test_estimated_size_does_not_normalize():
+    video = make_video()
+    assert video.estimated_size() > 0
+    assert video._source is not None
+
+
+def test_selection_round_trip_does_not_normalize():
+    videos = [make_video("abc"), make_video("def")]
+    selection = Selection(videos, query={"size": 2}, cursor=[1, 1.0, "def"])
+    data = selection.dumps()
+    assert all(video._source is not None for video in videos)
+
+    loaded = Selection.loads(data)
+    assert loaded.cursors == {1: [1, 1.0, "def"]}
+    assert [video.id for video in loaded.videos] == ["abc", "def"]
+    assert [video.as_dict() for video in loaded.videos] == [video.as_dict() for video in videos]
+    assert loaded.videos[0].title == "Weekly Weird News"
+    assert loaded.videos[0].tags == ["news"]
+
+
+def test_raw_after_normalizing_rebuilds_the_same_video():
+    video = make_video()
+    normalized = video.as_dict()
+    assert video._source is None
+    assert ETCVideo(**video.raw()).as_dict() == normalized